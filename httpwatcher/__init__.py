@@ -3,6 +3,17 @@
 from httpwatcher.cmdline import *
 from httpwatcher.server import *
 from httpwatcher.filesystem import *
+from httpwatcher.filters import *
+from httpwatcher.backends import *
+from httpwatcher.polling import *
+from httpwatcher.fingerprints import *
+from httpwatcher.builds import *
+from httpwatcher.workers import *
+from httpwatcher.metrics import *
+from httpwatcher.cache import *
+from httpwatcher.compression import *
+from httpwatcher.injection import *
+from httpwatcher.mime import *
 from httpwatcher.errors import *
 
 __version__ = "0.5.2"
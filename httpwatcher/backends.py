@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from future.utils import raise_
+
+import errno
+import io
+import os
+import os.path
+import sys
+
+from watchdog.observers import Observer
+from watchdog.observers.api import ObservedWatch
+
+from httpwatcher.polling import SnapshotPollingObserver, DEFAULT_POLL_INTERVAL
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "BACKEND_NATIVE",
+    "BACKEND_POLLING",
+    "BACKEND_HYBRID",
+    "BACKENDS",
+    "merge_watch_paths",
+    "is_network_mount",
+    "is_watch_limit_error",
+    "WatcherBackend"
+]
+
+# the operating system's native file system notifications (inotify, FSEvents, kqueue, etc.), falling back to
+# polling for any watch path for which the native watch limits have been exhausted
+BACKEND_NATIVE = "native"
+# periodically walks the watched folders and diffs snapshots of their stat results (see SnapshotPollingObserver)
+BACKEND_POLLING = "polling"
+# native notifications where they work, and polling for watch paths on network/virtualised file systems (on
+# which native notifications aren't delivered for changes made elsewhere)
+BACKEND_HYBRID = "hybrid"
+BACKENDS = (BACKEND_NATIVE, BACKEND_POLLING, BACKEND_HYBRID)
+
+# file system types (as reported in /proc/mounts) that don't support native change notifications for changes
+# made by other hosts, or by the host of a container or virtual machine
+NETWORK_FS_TYPES = {
+    "9p",
+    "afs",
+    "ceph",
+    "cifs",
+    "davfs",
+    "fakeowner",
+    "fuse.glusterfs",
+    "fuse.grpcfuse",
+    "fuse.rclone",
+    "fuse.sshfs",
+    "fuse.vmhgfs-fuse",
+    "glusterfs",
+    "ncpfs",
+    "nfs",
+    "nfs4",
+    "osxfs",
+    "smb3",
+    "smbfs",
+    "sshfs",
+    "vboxsf",
+    "virtiofs"
+}
+
+# whitespace and backslashes in mount points are octal-escaped in /proc/mounts
+MOUNT_POINT_ESCAPES = (("\\040", " "), ("\\011", "\t"), ("\\012", "\n"), ("\\134", "\\"))
+
+# errors raised when the native watch limits have been reached (e.g. fs.inotify.max_user_watches for ENOSPC,
+# and fs.inotify.max_user_instances or the open file limit for EMFILE)
+WATCH_LIMIT_ERRNOS = (errno.ENOSPC, errno.EMFILE)
+
+
+def merge_watch_paths(watch_paths, recursive=True):
+    """Removes duplicate watch paths and, if watching recursively, those nested within other watch paths (which
+    would otherwise be watched twice).
+
+    Returns:
+        A list of absolute paths, in their original order.
+    """
+    paths = []
+    for path in [os.path.abspath(p) for p in watch_paths]:
+        if path not in paths:
+            paths.append(path)
+    if not recursive:
+        return paths
+
+    def is_nested(path):
+        return any(path.startswith(other.rstrip(os.sep) + os.sep) for other in paths if other != path)
+
+    merged = [path for path in paths if not is_nested(path)]
+    for path in paths:
+        if path not in merged:
+            logger.debug("Not watching %s separately, as it is nested within another watch path", path)
+    return merged
+
+
+def read_mounts(mounts_file="/proc/mounts"):
+    """Reads the mount points and their file system types on Linux.
+
+    Returns:
+        A list of (mount point, file system type) tuples, or an empty list if unavailable.
+    """
+    if not sys.platform.startswith("linux") or not os.path.isfile(mounts_file):
+        return []
+    mounts = []
+    try:
+        with io.open(mounts_file, "rt", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 3:
+                    mount_point = fields[1]
+                    for escaped, char in MOUNT_POINT_ESCAPES:
+                        mount_point = mount_point.replace(escaped, char)
+                    mounts.append((mount_point, fields[2]))
+    except (IOError, OSError):
+        return []
+    return mounts
+
+
+def is_network_mount(path, mounts=None):
+    """Checks whether the given path lives on a network (or virtual machine/container host) file system, on
+    which native change notifications can't be relied upon."""
+    if mounts is None:
+        mounts = read_mounts()
+    path = os.path.realpath(path)
+    best_match, fs_type = "", None
+    for mount_point, mount_fs_type in mounts:
+        prefix = mount_point.rstrip("/") + "/"
+        if (path == mount_point or path.startswith(prefix)) and len(mount_point) >= len(best_match):
+            best_match, fs_type = mount_point, mount_fs_type
+    return fs_type in NETWORK_FS_TYPES
+
+
+def is_watch_limit_error(e):
+    return isinstance(e, (IOError, OSError)) and e.errno in WATCH_LIMIT_ERRNOS
+
+
+class WatcherBackend(object):
+    """Schedules watch paths on the appropriate watchdog observer (native or polling) for the selected backend,
+    falling back to polling for any watch path that can't be watched natively because the native watch limits
+    have been reached."""
+
+    native_observer_class = Observer
+    polling_observer_class = SnapshotPollingObserver
+
+    def __init__(self, backend=BACKEND_NATIVE, poll_interval=DEFAULT_POLL_INTERVAL, snapshot_dir=None):
+        """Constructor.
+
+        Args:
+            backend: One of BACKEND_NATIVE, BACKEND_POLLING or BACKEND_HYBRID.
+            poll_interval: The interval (in seconds) at which to poll watch paths that are being polled.
+            snapshot_dir: An optional folder in which to persist snapshots of polled watch paths between runs.
+        """
+        if backend not in BACKENDS:
+            raise ValueError("Unrecognised file system watcher backend: %s" % backend)
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.snapshot_dir = snapshot_dir
+        self.observers = dict()
+        # watch path -> BACKEND_NATIVE or BACKEND_POLLING
+        self.methods = dict()
+
+    def start(self, handlers, recursive=True):
+        """Starts watching the given paths.
+
+        Args:
+            handlers: A list of (path, event handler) tuples.
+            recursive: Whether to watch the paths recursively.
+        """
+        mounts = read_mounts() if self.backend == BACKEND_HYBRID else []
+        for path, handler in handlers:
+            if self.backend == BACKEND_POLLING:
+                method = BACKEND_POLLING
+            elif self.backend == BACKEND_HYBRID and is_network_mount(path, mounts):
+                logger.info("%s is on a network file system - polling it for changes", path)
+                method = BACKEND_POLLING
+            else:
+                method = BACKEND_NATIVE
+
+            if method == BACKEND_NATIVE:
+                try:
+                    self.schedule(BACKEND_NATIVE, handler, path, recursive)
+                except (IOError, OSError) as e:
+                    if not is_watch_limit_error(e):
+                        raise
+                    logger.warning(
+                        "Unable to watch %s natively (%s) - polling it for changes instead. Consider raising the "
+                        "limit (e.g. fs.inotify.max_user_watches on Linux), or excluding large folders.", path, e
+                    )
+                    method = BACKEND_POLLING
+            if method == BACKEND_POLLING:
+                self.schedule(BACKEND_POLLING, handler, path, recursive)
+            self.methods[path] = method
+
+    def schedule(self, method, handler, path, recursive):
+        observer = self.observers.get(method)
+        if observer is None:
+            if method == BACKEND_NATIVE:
+                observer = self.native_observer_class()
+            else:
+                observer = self.polling_observer_class(timeout=self.poll_interval, snapshot_dir=self.snapshot_dir)
+            # observers are started before any paths are scheduled, so that errors can be attributed to
+            # individual paths
+            observer.start()
+            self.observers[method] = observer
+        try:
+            observer.schedule(handler, path, recursive)
+        except Exception:
+            # on Python 2, a bare raise after handling another exception would re-raise the latter
+            exc_info = sys.exc_info()
+            # clean up the partially scheduled watch
+            try:
+                observer.unschedule(ObservedWatch(path, recursive))
+            except (KeyError, IOError, OSError):
+                pass
+            raise_(*exc_info)
+
+    def stop(self, timeout=None):
+        for observer in self.observers.values():
+            observer.stop()
+        for observer in self.observers.values():
+            observer.join(timeout=timeout)
+        self.observers = dict()
+        self.methods = dict()
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+from past.builtins import basestring
+
+import datetime
+import io
+import json
+import os
+import os.path
+import time
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from watchdog.events import EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED
+
+from tornado import gen, locks
+from tornado.process import Subprocess
+
+from httpwatcher.filters import PathFilter
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "BuildRule",
+    "BuildPipeline",
+    "BuildResult",
+    "load_build_config",
+    "parse_build_rules",
+    "DEFAULT_BUILD_CONCURRENCY"
+]
+
+DEFAULT_BUILD_CONCURRENCY = 2
+
+
+class BuildRule(object):
+    """Maps changes to source files matching one or more .gitignore-style patterns (see PathFilter) to a command
+    that rebuilds them.
+
+    Commands may either be strings, which are run using the shell, or lists of arguments. The placeholder
+    "{paths}" is replaced with the (absolute) paths of all of the matching changed files, and "{path}" causes the
+    command to be run once for each of them."""
+
+    def __init__(self, patterns, command, name=None, cwd=None, debounce=0.0, timeout=None):
+        """Constructor.
+
+        Args:
+            patterns: A pattern, or list of patterns, matched against the paths of changed files relative to the
+                rule's working folder.
+            command: The command to run, as a string or a list of arguments.
+            name: An optional name for the rule, for logging purposes.
+            cwd: The folder in which to run the command, relative to which patterns are matched. Defaults to the
+                current working folder.
+            debounce: The time (in seconds) for which to wait after the latest matching change before running
+                the command, so that several changes can be built at once.
+            timeout: The maximum time (in seconds) for which the command may run before being killed.
+        """
+        if isinstance(patterns, basestring):
+            patterns = [patterns]
+        if not patterns or not command:
+            raise ValueError("Build rules require at least one pattern and a command")
+        self.patterns = patterns
+        self.command = command
+        self.name = name or (command if isinstance(command, basestring) else " ".join(command))
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        self.debounce = debounce
+        self.timeout = timeout
+        self.rules = PathFilter.compile_patterns(patterns)
+
+    def __repr__(self):
+        return "BuildRule(%r, %r)" % (self.patterns, self.name)
+
+    def matches(self, path):
+        prefix = self.cwd.rstrip(os.sep) + os.sep
+        if not path.startswith(prefix):
+            return False
+        rel_path = path[len(prefix):]
+        if os.sep != "/":
+            rel_path = rel_path.replace(os.sep, "/")
+        return PathFilter.match(self.rules, rel_path)
+
+    def get_commands(self, paths):
+        """Returns the commands to run for the given changed paths, with their placeholders replaced."""
+        paths = sorted(paths)
+        if isinstance(self.command, basestring):
+            if "{path}" in self.command:
+                return [self.command.replace("{path}", quote(path)) for path in paths]
+            return [self.command.replace("{paths}", " ".join([quote(path) for path in paths]))]
+
+        if "{path}" in self.command:
+            return [[path if arg == "{path}" else arg for arg in self.command] for path in paths]
+        command = []
+        for arg in self.command:
+            if arg == "{paths}":
+                command.extend(paths)
+            else:
+                command.append(arg)
+        return [command]
+
+
+class BuildResult(object):
+    """The outcome of running the build rules for a set of changes."""
+
+    def __init__(self, paths=None, succeeded=True):
+        # the changed paths that were matched by build rules
+        self.paths = paths or set()
+        self.succeeded = succeeded
+
+    def __bool__(self):
+        return self.succeeded
+
+    __nonzero__ = __bool__
+
+
+class BuildPipeline(object):
+    """Runs the commands of the build rules matching changed source files, with at most a given number of
+    commands running at once. Each rule is debounced, and if a rule's command is already running when more
+    matching changes arrive, those changes are built by a single subsequent run."""
+
+    def __init__(self, rules, max_concurrency=DEFAULT_BUILD_CONCURRENCY):
+        self.rules = rules
+        self.max_concurrency = max_concurrency
+        self.semaphore = locks.Semaphore(max_concurrency)
+        self.states = dict([(rule, {
+            "pending": set(),
+            "last_matched": None,
+            "waiting": None,
+            "running": None
+        }) for rule in rules])
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, changes):
+        """Works out which rules match which of the given changes.
+
+        Returns:
+            A dictionary mapping rules to the sets of changed paths they match.
+        """
+        matches = dict()
+        for event in changes or []:
+            if event.is_directory:
+                continue
+            if event.event_type == EVENT_TYPE_MOVED:
+                path = event.dest_path
+            elif event.event_type in (EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED):
+                path = event.src_path
+            else:
+                # there's nothing to build from deleted files
+                continue
+            for rule in self.rules:
+                if rule.matches(path):
+                    matches.setdefault(rule, set()).add(path)
+        return matches
+
+    @gen.coroutine
+    def run(self, changes):
+        """Runs the build rules matching the given changes, and waits for them to complete.
+
+        Returns:
+            A BuildResult.
+        """
+        matches = self.match(changes)
+        if not matches:
+            raise gen.Return(BuildResult())
+
+        paths = set()
+        futures = []
+        for rule, rule_paths in matches.items():
+            paths.update(rule_paths)
+            futures.append(self.schedule(rule, rule_paths))
+        results = yield futures
+        raise gen.Return(BuildResult(paths=paths, succeeded=all(results)))
+
+    def schedule(self, rule, paths):
+        state = self.states[rule]
+        state["pending"].update(paths)
+        state["last_matched"] = time.time()
+        if state["waiting"] is None:
+            state["waiting"] = self.run_rule(rule)
+        return state["waiting"]
+
+    @gen.coroutine
+    def run_rule(self, rule):
+        state = self.states[rule]
+        # let schedule() register this run as the rule's waiting run before we go any further
+        yield gen.moment
+        # wait until no more matching changes have arrived for the rule's debounce period
+        while True:
+            delay = state["last_matched"] + rule.debounce - time.time()
+            if delay <= 0:
+                break
+            yield gen.sleep(delay)
+        # only one instance of each rule's command runs at a time
+        while state["running"] is not None:
+            try:
+                yield state["running"]
+            except Exception:
+                pass
+
+        paths, state["pending"], state["waiting"] = state["pending"], set(), None
+        running = state["running"] = self.execute(rule, paths)
+        # cleared by the first of the future's callbacks, before anyone waiting on it resumes
+        running.add_done_callback(lambda future: state.update(running=None) if state["running"] is future else None)
+        succeeded = yield running
+        raise gen.Return(succeeded)
+
+    @gen.coroutine
+    def execute(self, rule, paths):
+        """Runs the given rule's commands for the given paths.
+
+        Returns:
+            True if all of the commands succeeded.
+        """
+        with (yield self.semaphore.acquire()):
+            for command in rule.get_commands(paths):
+                started = time.time()
+                logger.info("Building %d changed file(s): %s", len(paths), rule.name)
+                logger.debug("Running: %s", command)
+                try:
+                    process = Subprocess(command, shell=isinstance(command, basestring), cwd=rule.cwd)
+                except (IOError, OSError) as e:
+                    logger.error("Unable to run build command for %s: %s", rule.name, e)
+                    raise gen.Return(False)
+
+                exit_future = process.wait_for_exit(raise_error=False)
+                try:
+                    if rule.timeout is not None:
+                        exit_code = yield gen.with_timeout(datetime.timedelta(seconds=rule.timeout), exit_future)
+                    else:
+                        exit_code = yield exit_future
+                except gen.TimeoutError:
+                    logger.error("Build command for %s timed out after %.1fs", rule.name, rule.timeout)
+                    try:
+                        process.proc.kill()
+                    except OSError:
+                        pass
+                    raise gen.Return(False)
+
+                if exit_code != 0:
+                    logger.error("Build command for %s failed with exit code %d", rule.name, exit_code)
+                    raise gen.Return(False)
+                logger.info("Built %s in %.2fs", rule.name, time.time() - started)
+        raise gen.Return(True)
+
+
+def parse_build_rules(rules, cwd=None):
+    """Parses a list of "PATTERN=COMMAND" strings (e.g. "*.scss=sass style.scss style.css") into BuildRules."""
+    parsed = []
+    for rule in rules or []:
+        pattern, sep, command = rule.partition("=")
+        if not sep or not pattern.strip() or not command.strip():
+            raise ValueError("Invalid build rule (expected PATTERN=COMMAND): %s" % rule)
+        parsed.append(BuildRule(pattern.strip(), command.strip(), cwd=cwd))
+    return parsed
+
+
+def load_build_config(filename):
+    """Loads build rules from a JSON configuration file of the form:
+
+        {
+            "concurrency": 2,
+            "rules": [
+                {"name": "styles", "patterns": ["*.scss"], "command": "sass {path}", "debounce": 0.1},
+                {"patterns": ["docs/**/*.rst"], "command": ["sphinx-build", "-b", "html", "docs", "_build"]}
+            ]
+        }
+
+    Rules' working folders ("cwd") are relative to the configuration file's folder, which is also the default.
+
+    Returns:
+        A (rules, concurrency) tuple.
+    """
+    with io.open(filename, "rt", encoding="utf-8") as f:
+        config = json.loads(f.read())
+    base_path = os.path.dirname(os.path.abspath(filename))
+
+    rules = []
+    for rule in config.get("rules", []):
+        if not isinstance(rule, dict):
+            raise ValueError("Invalid build rule in %s: %r" % (filename, rule))
+        try:
+            rules.append(BuildRule(
+                rule.get("patterns") or rule.get("pattern"),
+                rule.get("command"),
+                name=rule.get("name"),
+                cwd=os.path.join(base_path, rule.get("cwd", ".")),
+                debounce=float(rule.get("debounce", 0.0)),
+                timeout=float(rule["timeout"]) if rule.get("timeout") is not None else None
+            ))
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid build rule in %s (%s): %r" % (filename, e, rule))
+    return rules, int(config.get("concurrency", DEFAULT_BUILD_CONCURRENCY))
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "ContentCache",
+    "PathCache",
+    "ResolvedPath",
+    "DEFAULT_CONTENT_CACHE_SIZE",
+    "DEFAULT_PATH_CACHE_ENTRIES"
+]
+
+DEFAULT_CONTENT_CACHE_SIZE = 64 * 1024 * 1024
+DEFAULT_PATH_CACHE_ENTRIES = 10000
+
+# The outcome of resolving a request's URL path to a file: the HTTP status with which to respond (200, 301 for
+# directories requested without a trailing slash, 403 or 404), and for files, their stat result and MIME type.
+ResolvedPath = namedtuple("ResolvedPath", ["status", "abspath", "stat_result", "content_type"])
+
+
+class ContentCache(object):
+    """A thread-safe, in-memory LRU cache for the contents of served files, bounded by the total number of
+    bytes held. Each file can have several cached variants (e.g. its raw bytes and its script-injected HTML),
+    all of which are evicted together when the file changes."""
+
+    def __init__(self, max_size=DEFAULT_CONTENT_CACHE_SIZE, max_entry_size=None):
+        """Constructor.
+
+        Args:
+            max_size: The maximum total number of bytes to hold in the cache.
+            max_entry_size: The maximum size (in bytes) of a single cached entry. Defaults to 1/16th of
+                the total cache size.
+        """
+        self.max_size = max_size
+        self.max_entry_size = max_entry_size if max_entry_size is not None else max_size // 16
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # (path, variant) -> (signature, content), in least- to most-recently used order
+        self.entries = OrderedDict()
+        self.variants = dict()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path, variant="raw", signature=None):
+        """Looks up the given variant of the file at the given path.
+
+        Args:
+            path: The absolute path to the file.
+            variant: The variant of the file's contents to look up.
+            signature: If supplied, the cached entry is only returned if it was stored with the same
+                signature (e.g. the file's size and modification time), otherwise it is evicted.
+
+        Returns:
+            The cached content, or None if the content is not cached.
+        """
+        key = (path, variant)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if signature is not None and entry[0] != signature:
+                self._forget(key, entry)
+                self.misses += 1
+                return None
+            # re-insert to mark it as the most recently used entry
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, path, content, variant="raw", signature=None):
+        """Stores the given variant of the file's contents in the cache, evicting the least recently used
+        entries as necessary.
+
+        Returns:
+            True if the content was cached, or False if it is too large to be cached.
+        """
+        if len(content) > self.max_entry_size or len(content) > self.max_size:
+            return False
+
+        key = (path, variant)
+        with self.lock:
+            existing = self.entries.pop(key, None)
+            if existing is not None:
+                self._forget(key, existing)
+
+            while self.entries and self.size + len(content) > self.max_size:
+                self._evict_oldest()
+
+            self.entries[key] = (signature, content)
+            self.variants.setdefault(path, set()).add(variant)
+            self.size += len(content)
+        return True
+
+    def invalidate(self, path, recursive=False):
+        """Evicts all cached variants of the file at the given path.
+
+        Args:
+            path: The absolute path to the file (or folder) that has changed.
+            recursive: If True, also evicts all cached files beneath the given path.
+
+        Returns:
+            The number of entries evicted.
+        """
+        with self.lock:
+            paths = [path] if path in self.variants else []
+            if recursive:
+                prefix = path.rstrip(os.sep) + os.sep
+                paths.extend([p for p in self.variants if p.startswith(prefix)])
+
+            evicted = 0
+            for p in paths:
+                for variant in list(self.variants.get(p, [])):
+                    key = (p, variant)
+                    self._forget(key, self.entries.pop(key))
+                    evicted += 1
+
+        if evicted > 0:
+            logger.debug("Evicted %d cached entr(ies) for %s", evicted, path)
+        return evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.variants.clear()
+            self.size = 0
+
+    def _evict_oldest(self):
+        key = next(iter(self.entries))
+        self._forget(key, self.entries.pop(key))
+
+    def _forget(self, key, entry):
+        self.size -= len(entry[1])
+        path, variant = key
+        path_variants = self.variants.get(path)
+        if path_variants is not None:
+            path_variants.discard(variant)
+            if not path_variants:
+                del self.variants[path]
+
+
+class PathCache(object):
+    """A thread-safe LRU cache of file system lookups (such as the resolution of request URL paths to files,
+    and stat results), bounded by the number of entries. Each entry is registered against the file system
+    paths on which it depends, and is evicted when any of those paths (or their parent folders) change.
+
+    Entries are never validated against the file system, so this cache must only be used for paths that are
+    being watched for changes."""
+
+    MISS = object()
+
+    def __init__(self, max_entries=DEFAULT_PATH_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, dependencies), in least- to most-recently used order
+        self.entries = OrderedDict()
+        self.keys_by_path = dict()
+        # incremented whenever anything is invalidated, so that lookups that were under way at the time can
+        # avoid caching what may be outdated results
+        self.generation = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns the cached value for the given key, or PathCache.MISS if it is not cached."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return self.MISS
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, dependencies, generation=None):
+        """Caches the given value.
+
+        Args:
+            key: The key under which to cache the value.
+            value: The value to cache (may be None).
+            dependencies: The absolute file system paths whose modification should evict this entry.
+            generation: If supplied, the value is only cached if nothing has been invalidated since the cache's
+                generation was the given one (i.e. since the value was looked up).
+        """
+        dependencies = [os.path.normpath(path) for path in dependencies]
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            existing = self.entries.pop(key, None)
+            if existing is not None:
+                self._forget(key, existing)
+            while len(self.entries) >= self.max_entries:
+                oldest = next(iter(self.entries))
+                self._forget(oldest, self.entries.pop(oldest))
+
+            self.entries[key] = (value, dependencies)
+            for path in dependencies:
+                self.keys_by_path.setdefault(path, set()).add(key)
+
+    def invalidate(self, path, recursive=False):
+        """Evicts all entries that depend on the given path or on its parent folder (whose listing has changed).
+
+        Args:
+            path: The absolute path to the file (or folder) that has changed.
+            recursive: If True, also evicts all entries that depend on paths beneath the given path.
+
+        Returns:
+            The number of entries evicted.
+        """
+        path = os.path.normpath(path)
+        with self.lock:
+            self.generation += 1
+            keys = set(self.keys_by_path.get(path, set()))
+            keys.update(self.keys_by_path.get(os.path.dirname(path), set()))
+            if recursive:
+                prefix = path.rstrip(os.sep) + os.sep
+                for p, path_keys in self.keys_by_path.items():
+                    if p.startswith(prefix):
+                        keys.update(path_keys)
+
+            for key in keys:
+                self._forget(key, self.entries.pop(key))
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.keys_by_path.clear()
+
+    def _forget(self, key, entry):
+        for path in entry[1]:
+            path_keys = self.keys_by_path.get(path)
+            if path_keys is not None:
+                path_keys.discard(key)
+                if not path_keys:
+                    del self.keys_by_path[path]
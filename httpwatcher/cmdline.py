@@ -4,6 +4,11 @@ from __future__ import unicode_literals
 
 import argparse
 import httpwatcher
+from httpwatcher.filesystem import DEFAULT_WATCHER_INTERVAL, DEFAULT_WATCHER_MAX_WAIT, DEFAULT_MAX_PENDING_EVENTS
+from httpwatcher.backends import BACKENDS, BACKEND_NATIVE
+from httpwatcher.polling import DEFAULT_POLL_INTERVAL, DEFAULT_SNAPSHOT_DIR
+from httpwatcher.builds import DEFAULT_BUILD_CONCURRENCY
+from httpwatcher.server import DEFAULT_WEBSOCKET_PING_INTERVAL, DEFAULT_IO_WORKERS
 
 import tornado.ioloop
 
@@ -16,7 +21,15 @@ __all__ = [
 
 
 def watch(static_root, watch_paths=None, on_reload=None, host='localhost', port=5555, server_base_path="/",
-          watcher_interval=1.0, recursive=True, open_browser=True, open_browser_delay=1.0):
+          watcher_interval=DEFAULT_WATCHER_INTERVAL, recursive=True, open_browser=True,
+          open_browser_delay=1.0, content_types=None, hot_swap=True,
+          watcher_max_wait=DEFAULT_WATCHER_MAX_WAIT, watch_include=None, watch_exclude=None, watch_gitignore=False,
+          verify_changes=False, watcher_backend=BACKEND_NATIVE, watcher_poll_interval=DEFAULT_POLL_INTERVAL,
+          watcher_snapshot_dir=None, on_reload_timeout=None, on_reload_blocking=False, on_reload_changes=False,
+          build_rules=None, build_concurrency=DEFAULT_BUILD_CONCURRENCY,
+          websocket_ping_interval=DEFAULT_WEBSOCKET_PING_INTERVAL, websocket_ping_timeout=None, max_clients=None,
+          websocket_compression=False, workers=1, sendfile=True, io_workers=DEFAULT_IO_WORKERS,
+          watcher_max_events=DEFAULT_MAX_PENDING_EVENTS, metrics=False):
     """Initialises an HttpWatcherServer to watch the given path for changes. Watches until the IO loop
     is terminated, or a keyboard interrupt is intercepted.
 
@@ -24,15 +37,45 @@ def watch(static_root, watch_paths=None, on_reload=None, host='localhost', port=
         static_root: The path whose contents are to be served and watched.
         watch_paths: The paths to be watched for changes. If not supplied, this defaults to the static root.
         on_reload: An optional callback to pass to the watcher server that will be executed just before the
-            server triggers a reload in connected clients.
+            server triggers a reload in connected clients. It may be a coroutine (see HttpWatcherServer).
         host: The host to which to bind our server.
         port: The port to which to bind our server.
         server_base_path: If the content is to be served from a non-standard base path, specify it here.
-        watcher_interval: The maximum refresh rate of the watcher server.
+        watcher_interval: The period of quiet (in seconds) to wait for after the last change before reloading.
         recursive: Whether to monitor the watch path recursively.
         open_browser: Whether or not to automatically attempt to open the user's browser at the root URL of
             the project (default: True).
         open_browser_delay: The number of seconds to wait before attempting to open the user's browser.
+        content_types: An optional dictionary mapping file name extensions (e.g. ".scss") to the content types
+            with which to serve them.
+        hot_swap: Whether to swap changed stylesheets and images in place in the browser, instead of reloading
+            the whole page.
+        watcher_max_wait: The maximum time (in seconds) for which to delay a reload while changes keep arriving.
+        watch_include: An optional list of glob patterns. If given, only changes to matching files trigger a reload.
+        watch_exclude: An optional list of glob patterns of paths whose changes are to be ignored.
+        watch_gitignore: Whether to ignore changes to paths ignored by the watch paths' .gitignore files.
+        verify_changes: Whether to verify that modified files' contents have actually changed before reloading.
+        watcher_backend: How to watch for changes ("native", "polling" or "hybrid").
+        watcher_poll_interval: The interval (in seconds) at which to poll watch paths that are being polled.
+        watcher_snapshot_dir: An optional folder in which to persist snapshots of polled watch paths between runs.
+        on_reload_timeout: The maximum time (in seconds) for which to wait for the on_reload callback to complete.
+        on_reload_blocking: Whether to run the on_reload callback on a worker thread, because it blocks.
+        on_reload_changes: Whether to pass the ChangeSet of file system changes to the on_reload callback.
+        build_rules: An optional list of BuildRules whose commands are to be run for matching changed files
+            before reloading.
+        build_concurrency: The maximum number of build commands to run at once.
+        websocket_ping_interval: How often (in seconds) to ping WebSocket clients, disconnecting those that
+            don't respond (0 disables pings).
+        websocket_ping_timeout: How long (in seconds) to wait for a response to a ping.
+        max_clients: An optional maximum number of connected WebSocket clients.
+        websocket_compression: Whether to compress messages to WebSocket clients that support it.
+        workers: The number of worker processes from which to serve requests (see HttpWatcherServer).
+        sendfile: Whether to send large files using the operating system's sendfile() call, where available.
+        io_workers: The number of threads on which to access the file system while serving requests (0 to access
+            it on the I/O loop's thread).
+        watcher_max_events: The maximum number of file system events to keep track of between reloads, beyond
+            which clients are told to reload everything.
+        metrics: Whether to collect statistics about the server, and serve them from /httpwatcher/metrics.
     """
     server = httpwatcher.HttpWatcherServer(
         static_root,
@@ -44,7 +87,31 @@ def watch(static_root, watch_paths=None, on_reload=None, host='localhost', port=
         watcher_interval=watcher_interval,
         recursive=recursive,
         open_browser=open_browser,
-        open_browser_delay=open_browser_delay
+        open_browser_delay=open_browser_delay,
+        content_types=content_types,
+        hot_swap=hot_swap,
+        watcher_max_wait=watcher_max_wait,
+        watch_include=watch_include,
+        watch_exclude=watch_exclude,
+        watch_gitignore=watch_gitignore,
+        verify_changes=verify_changes,
+        watcher_backend=watcher_backend,
+        watcher_poll_interval=watcher_poll_interval,
+        watcher_snapshot_dir=watcher_snapshot_dir,
+        on_reload_timeout=on_reload_timeout,
+        on_reload_blocking=on_reload_blocking,
+        on_reload_changes=on_reload_changes,
+        build_rules=build_rules,
+        build_concurrency=build_concurrency,
+        websocket_ping_interval=websocket_ping_interval,
+        websocket_ping_timeout=websocket_ping_timeout,
+        max_clients=max_clients,
+        websocket_compression=websocket_compression,
+        workers=workers,
+        sendfile=sendfile,
+        io_workers=io_workers,
+        watcher_max_events=watcher_max_events,
+        metrics=metrics
     )
     server.listen()
 
@@ -89,12 +156,173 @@ def main():
         default='/',
         help="The base path from which the server is to serve content (default: /)"
     )
+    parser.add_argument(
+        '-m', '--mime-type',
+        action='append',
+        default=[],
+        metavar='EXT=TYPE',
+        help="Serve files with the given extension using the given content type, e.g. \".scss=text/x-scss\" " +
+             "(may be specified multiple times)"
+    )
+    parser.add_argument(
+        '-i', '--interval',
+        type=float,
+        default=DEFAULT_WATCHER_INTERVAL,
+        help="The period of quiet (in seconds) to wait for after the last file system change before reloading " +
+             "(default: %.2f)" % DEFAULT_WATCHER_INTERVAL
+    )
+    parser.add_argument(
+        '--max-wait',
+        type=float,
+        default=DEFAULT_WATCHER_MAX_WAIT,
+        help="The maximum time (in seconds) for which to delay a reload while file system changes keep " +
+             "arriving (default: %.1f)" % DEFAULT_WATCHER_MAX_WAIT
+    )
+    parser.add_argument(
+        '--max-events',
+        type=int,
+        default=DEFAULT_MAX_PENDING_EVENTS,
+        help="The maximum number of file system events to keep track of between reloads - if more arrive at " +
+             "once, everything is reloaded (default: %d)" % DEFAULT_MAX_PENDING_EVENTS
+    )
+    parser.add_argument(
+        '--include',
+        action='append',
+        default=None,
+        metavar='PATTERN',
+        help="Only reload when files matching this glob pattern change, e.g. \"*.html\" (may be specified " +
+             "multiple times)"
+    )
+    parser.add_argument(
+        '-x', '--exclude',
+        action='append',
+        default=[],
+        metavar='PATTERN',
+        help="Ignore changes to paths matching this .gitignore-style pattern, e.g. \"build/\" (may be specified " +
+             "multiple times). Version control folders, node_modules, editor swap files, etc. are always " +
+             "ignored, unless re-included with a negated pattern such as \"!node_modules/\""
+    )
+    parser.add_argument(
+        '--gitignore',
+        action='store_true',
+        default=False,
+        help="Also ignore changes to paths ignored by the watch paths' .gitignore files"
+    )
+    parser.add_argument(
+        '--verify-changes',
+        action='store_true',
+        default=False,
+        help="Only reload when the contents of modified files have actually changed (requires all watched " +
+             "files to be read when the server starts)"
+    )
+    parser.add_argument(
+        '--backend',
+        choices=BACKENDS,
+        default=BACKEND_NATIVE,
+        help="How to watch for changes: using the operating system's native file system notifications, by " +
+             "polling, or natively except for paths on network file systems, which are polled (default: native)"
+    )
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help="The interval (in seconds) at which to poll paths that are being polled for changes " +
+             "(default: %.1f)" % DEFAULT_POLL_INTERVAL
+    )
+    parser.add_argument(
+        '--snapshot-dir',
+        default=DEFAULT_SNAPSHOT_DIR,
+        help="The folder in which to persist snapshots of polled paths between runs, or an empty string to " +
+             "disable persistence (default: %s)" % DEFAULT_SNAPSHOT_DIR
+    )
+    parser.add_argument(
+        '--build',
+        action='append',
+        default=[],
+        metavar='PATTERN=COMMAND',
+        help="Run the given shell command before reloading whenever files matching the given pattern change, " +
+             "e.g. \"*.scss=sass style.scss static/style.css\". The placeholder {paths} is replaced with the " +
+             "changed files' paths, and {path} runs the command once per changed file (may be specified " +
+             "multiple times)"
+    )
+    parser.add_argument(
+        '--build-config',
+        default=None,
+        metavar='FILE',
+        help="Load build rules from the given JSON configuration file (see load_build_config)"
+    )
+    parser.add_argument(
+        '--build-concurrency',
+        type=int,
+        default=None,
+        help="The maximum number of build commands to run at once (default: %d)" % DEFAULT_BUILD_CONCURRENCY
+    )
+    parser.add_argument(
+        '--ping-interval',
+        type=float,
+        default=DEFAULT_WEBSOCKET_PING_INTERVAL,
+        help="How often (in seconds) to ping connected browsers, disconnecting those that don't respond, or 0 " +
+             "to disable pings (default: %.1f)" % DEFAULT_WEBSOCKET_PING_INTERVAL
+    )
+    parser.add_argument(
+        '--ping-timeout',
+        type=float,
+        default=None,
+        help="How long (in seconds) to wait for a browser to respond to a ping before disconnecting it " +
+             "(default: three times the ping interval, but at least 30 seconds)"
+    )
+    parser.add_argument(
+        '--max-clients',
+        type=int,
+        default=None,
+        help="The maximum number of connected browsers. When exceeded, the browser heard from least recently " +
+             "is disconnected (default: unlimited)"
+    )
+    parser.add_argument(
+        '--websocket-compression',
+        action='store_true',
+        default=False,
+        help="Compress reload messages for browsers that support it"
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help="The number of worker processes from which to serve requests. With more than one, the main " +
+             "process watches for changes and relays them to the workers (default: 1)"
+    )
+    parser.add_argument(
+        '--io-workers',
+        type=int,
+        default=DEFAULT_IO_WORKERS,
+        help="The number of threads on which to read files while serving requests, so that slow disks don't " +
+             "hold up other requests, or 0 to read them on the main thread (default: %d)" % DEFAULT_IO_WORKERS
+    )
+    parser.add_argument(
+        '--no-sendfile',
+        action='store_true',
+        default=False,
+        help="Always read and send files in chunks, instead of using the operating system's sendfile() call"
+    )
+    parser.add_argument(
+        '--metrics',
+        action='store_true',
+        default=False,
+        help="Serve statistics about requests, caches, file system events and reloads from /httpwatcher/metrics " +
+             "(in Prometheus' text format, or as JSON with ?format=json)"
+    )
     parser.add_argument(
         '-n', '--no-browser',
         action='store_true',
         default=False,
         help="Do not attempt to open a web browser at the server's base URL"
     )
+    parser.add_argument(
+        '--no-hot-swap',
+        action='store_true',
+        default=False,
+        help="Always reload the whole page, even if only stylesheets or images have changed"
+    )
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
@@ -106,6 +334,26 @@ def main():
     if args.version:
         print("httpwatcher v%s" % httpwatcher.__version__)
     else:
+        try:
+            content_types = httpwatcher.parse_content_type_mappings(args.mime_type)
+        except ValueError as e:
+            parser.error(str(e))
+
+        build_concurrency = DEFAULT_BUILD_CONCURRENCY
+        try:
+            build_rules = httpwatcher.parse_build_rules(args.build)
+            if args.build_config is not None:
+                config_rules, build_concurrency = httpwatcher.load_build_config(args.build_config)
+                build_rules.extend(config_rules)
+        except (IOError, OSError, ValueError) as e:
+            parser.error(str(e))
+        if args.workers < 1:
+            parser.error("The number of worker processes must be at least 1")
+        if args.io_workers < 0:
+            parser.error("The number of I/O threads cannot be negative")
+        if args.build_concurrency is not None:
+            build_concurrency = args.build_concurrency
+
         watch_paths = args.watch
         if watch_paths is not None:
             watch_paths = [p.strip() for p in watch_paths.split(",") if len(p.strip()) > 0]
@@ -121,5 +369,27 @@ def main():
             host=args.host,
             port=args.port,
             server_base_path=args.base_path,
-            open_browser=(not args.no_browser)
+            watcher_interval=args.interval,
+            watcher_max_wait=args.max_wait,
+            watch_include=args.include,
+            watch_exclude=args.exclude,
+            watch_gitignore=args.gitignore,
+            verify_changes=args.verify_changes,
+            watcher_backend=args.backend,
+            watcher_poll_interval=args.poll_interval,
+            watcher_snapshot_dir=(args.snapshot_dir or None),
+            open_browser=(not args.no_browser),
+            content_types=content_types,
+            hot_swap=(not args.no_hot_swap),
+            build_rules=build_rules,
+            build_concurrency=build_concurrency,
+            websocket_ping_interval=args.ping_interval,
+            websocket_ping_timeout=args.ping_timeout,
+            max_clients=args.max_clients,
+            websocket_compression=args.websocket_compression,
+            workers=args.workers,
+            sendfile=(not args.no_sendfile),
+            io_workers=args.io_workers,
+            watcher_max_events=args.max_events,
+            metrics=args.metrics
         )
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import zlib
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = [
+    "COMPRESSIBLE_CONTENT_TYPES",
+    "PRECOMPRESSED_EXTENSIONS",
+    "is_compressible",
+    "supported_encodings",
+    "compress"
+]
+
+# content types, other than text/*, that benefit from compression
+COMPRESSIBLE_CONTENT_TYPES = {
+    "application/javascript",
+    "application/json",
+    "application/ld+json",
+    "application/manifest+json",
+    "application/rss+xml",
+    "application/atom+xml",
+    "application/wasm",
+    "application/x-javascript",
+    "application/xhtml+xml",
+    "application/xml",
+    "font/otf",
+    "font/ttf",
+    "image/svg+xml",
+    "image/x-icon",
+    "image/vnd.microsoft.icon"
+}
+
+# file name extensions of precompressed siblings (e.g. "style.css.br"), in order of preference
+PRECOMPRESSED_EXTENSIONS = OrderedDict([
+    ("br", ".br"),
+    ("gzip", ".gz")
+])
+
+
+def is_compressible(content_type):
+    if content_type is None:
+        return False
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_CONTENT_TYPES
+
+
+def gzip_compress(content, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(content) + compressor.flush()
+
+
+def brotli_compress(content, quality=5):
+    return brotli.compress(content, quality=quality)
+
+
+_COMPRESSORS = OrderedDict()
+if brotli is not None:
+    _COMPRESSORS["br"] = brotli_compress
+_COMPRESSORS["gzip"] = gzip_compress
+
+
+def supported_encodings():
+    """Returns the content encodings that can be applied on the fly, in order of preference. Brotli is only
+    available if the optional brotli package is installed."""
+    return list(_COMPRESSORS.keys())
+
+
+def compress(content, encoding):
+    """Compresses the given bytes using the specified content encoding ("br" or "gzip")."""
+    if encoding not in _COMPRESSORS:
+        raise ValueError("Unsupported content encoding: %s" % encoding)
+    return _COMPRESSORS[encoding](content)
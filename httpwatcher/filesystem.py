@@ -4,34 +4,86 @@ from __future__ import unicode_literals
 from past.builtins import basestring
 
 import os.path
+import threading
+from collections import OrderedDict
 
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import FileSystemEventHandler, EVENT_TYPE_CREATED, EVENT_TYPE_DELETED, \
+    EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED, FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, \
+    FileMovedEvent, DirCreatedEvent, DirDeletedEvent, DirModifiedEvent, DirMovedEvent
 
 from httpwatcher.errors import MissingFolderError
+from httpwatcher.backends import WatcherBackend, merge_watch_paths, BACKEND_NATIVE
+from httpwatcher.polling import DEFAULT_POLL_INTERVAL
+from httpwatcher.filters import PathFilter
+from httpwatcher.fingerprints import ChangeVerifier
+from httpwatcher.metrics import Histogram, DRAIN_SIZE_BUCKETS
 
-from tornado import gen
-from tornado.ioloop import PeriodicCallback
-from tornado.queues import Queue
+from tornado import gen, locks
+from tornado.ioloop import IOLoop
 
 import logging
 logger = logging.getLogger(__name__)
 
 __all__ = [
-    "FileSystemWatcher"
+    "FileSystemWatcher",
+    "ChangeSet",
+    "DEFAULT_WATCHER_INTERVAL",
+    "DEFAULT_WATCHER_MAX_WAIT",
+    "DEFAULT_MAX_PENDING_EVENTS"
 ]
 
+DEFAULT_WATCHER_INTERVAL = 0.25
+DEFAULT_WATCHER_MAX_WAIT = 2.0
+# the maximum number of raw file system events to hold on to between notifications
+DEFAULT_MAX_PENDING_EVENTS = 10000
+
 
 class FileSystemWatcher(object):
 
-    def __init__(self, watch_paths, on_changed=None, interval=1.0, recursive=True):
+    def __init__(self, watch_paths, on_changed=None, interval=DEFAULT_WATCHER_INTERVAL, recursive=True,
+                 max_wait=DEFAULT_WATCHER_MAX_WAIT, include=None, exclude=None, gitignore=False,
+                 verify_changes=False, backend=BACKEND_NATIVE, poll_interval=DEFAULT_POLL_INTERVAL,
+                 snapshot_dir=None, max_pending_events=DEFAULT_MAX_PENDING_EVENTS, on_excluded=None,
+                 on_touched=None):
         """Constructor.
 
         Args:
             watch_paths: A list of filesystem paths to watch for changes.
-            on_changed: Callback to call when one or more changes to the watch path are detected.
-            interval: The minimum interval at which to notify about changes (in seconds).
+            on_changed: Callback to call when one or more changes to the watch path are detected. It is passed a
+                ChangeSet containing the net changes since the last callback, or None if there were too many
+                events to keep track of (in which case anything may have changed).
+            interval: The period of quiet (in seconds) to wait for after the last file system event before
+                notifying about changes, so that a burst of changes (e.g. a build) results in a single notification.
             recursive: Should the watch path be monitored recursively for changes?
+            max_wait: The maximum time (in seconds) for which to delay notification of changes while file
+                system events keep arriving.
+            include: An optional list of glob patterns. If given, only changes to files matching at least one
+                of them are reported.
+            exclude: An optional list of additional glob patterns of paths whose changes are to be ignored (see
+                PathFilter).
+            gitignore: Should changes to paths ignored by each watch path's .gitignore file be ignored too?
+            verify_changes: Should modifications be verified against a fingerprint of each file's contents,
+                so that files rewritten with identical contents aren't reported as changed? This requires all
+                watched files to be read (in the background) when the watcher starts.
+            backend: How to watch for changes: using the operating system's native notifications
+                (BACKEND_NATIVE), by polling (BACKEND_POLLING) or using native notifications except for watch
+                paths on network file systems, which are polled (BACKEND_HYBRID). Watch paths that can't be watched
+                natively because the operating system's watch limits have been reached are always polled.
+            poll_interval: The interval (in seconds) at which to poll watch paths that are being polled.
+            snapshot_dir: An optional folder in which to persist the snapshots of watch paths that are being
+                polled, so that they needn't be walked in full again (and changes made in the meantime are
+                detected) when the watcher is restarted.
+            max_pending_events: The maximum number of raw file system events to hold on to between
+                notifications. If more than this arrive (e.g. when a huge folder is replaced), they're all
+                discarded and the callback is told that anything may have changed instead.
+            on_excluded: An optional callback to call with the changes to excluded paths (which aren't passed to
+                on_changed), e.g. to keep caches of the watched files up to date. It is passed a list of
+                (path, is directory) tuples, or None if more than max_pending_events excluded paths changed (which
+                doesn't affect on_changed), and is called before on_changed is called for the same period.
+            on_touched: An optional callback to call as soon as raw file system events arrive, rather than once
+                they've settled, e.g. to evict cached lookups of the affected files straight away. It is passed a
+                list of the affected (path, is directory) tuples (including excluded ones, if there's an
+                on_excluded callback), or None if too many paths were affected to keep track of.
         """
         if isinstance(watch_paths, basestring):
             watch_paths = [watch_paths]
@@ -41,55 +93,428 @@ class FileSystemWatcher(object):
             if not os.path.exists(path) or not os.path.isdir(path):
                 raise MissingFolderError(path)
 
-        self.watch_paths = watch_paths
-        self.interval = interval * 1000.0
+        # nested watch paths would otherwise be watched (and reported) twice
+        self.watch_paths = merge_watch_paths(watch_paths, recursive=recursive)
+        self.interval = interval
+        self.max_wait = max(max_wait, interval)
         self.recursive = recursive
-        self.periodic_callback = PeriodicCallback(self.check_fs_events, self.interval)
         self.on_changed = on_changed
-        self.observer = Observer()
-        for path in self.watch_paths:
-            self.observer.schedule(
-                WatcherEventHandler(self),
-                path,
-                self.recursive
-            )
+        self.on_excluded = on_excluded
+        self.on_touched = on_touched
+        self.backend = WatcherBackend(backend=backend, poll_interval=poll_interval, snapshot_dir=snapshot_dir)
+        self.path_filters = dict([
+            (path, PathFilter(path, include=include, exclude=exclude, gitignore=gitignore))
+            for path in self.watch_paths
+        ])
+        self.verifier = ChangeVerifier() if verify_changes else None
+        # ensures that change sets are passed on in order, even if verifying them takes a while
+        self.notify_lock = locks.Lock()
         self.started = False
-        self.fs_event_queue = Queue()
+        self.io_loop = None
+        # events are collected on the observer's thread and handed over to the I/O loop
+        self.pending_events = []
+        # the (path, is directory) tuples of excluded paths that have changed, if anyone is interested in them,
+        # and whether too many of them have changed to keep track of (which is no reason to report everything)
+        self.excluded_paths = set()
+        self.excluded_overflowed = False
+        self.pending_lock = threading.Lock()
+        self.max_pending_events = max_pending_events
+        # set once more than max_pending_events events have arrived since the last notification
+        self.overflowed = False
+        # the (path, is directory) tuples affected by raw events that have yet to be passed to on_touched, and
+        # whether there have been too many of them to keep track of
+        self.touched_paths = set()
+        self.touched_overflowed = False
+        # statistics: the number of raw events received and net changes reported, how often too many events
+        # arrived at once, and how many events were handed over to the I/O loop at a time
+        self.events_received = 0
+        self.changes_reported = 0
+        self.overflows = 0
+        self.drain_sizes = Histogram(DRAIN_SIZE_BUCKETS)
+        self.first_event_time = None
+        self.last_event_time = None
+        self.timeout = None
 
     def track_event(self, event):
-        self.fs_event_queue.put(event)
+        """Called from the observer's thread for each raw file system event. Only the first event of a burst
+        wakes up the I/O loop."""
+        with self.pending_lock:
+            wake = self.is_idle()
+            self.events_received += 1
+            if self.overflowed:
+                pass
+            elif len(self.pending_events) >= self.max_pending_events:
+                # collapse everything into a single full reload, rather than holding on to ever more events
+                self.pending_events = []
+                self.overflowed = True
+            else:
+                self.pending_events.append(event)
+            self.last_event_time = self.io_loop.time()
+            wake_touched = self.track_touched_paths(event)
+        if wake:
+            self.io_loop.add_callback(self.schedule_check)
+        if wake_touched:
+            self.io_loop.add_callback(self.flush_touched_paths)
+
+    def track_excluded_event(self, event):
+        """Called from the observer's thread for each raw file system event affecting an excluded path, if
+        there's an on_excluded or on_touched callback."""
+        paths = [path for path in [event.src_path, getattr(event, "dest_path", None)] if path]
+        wake = False
+        with self.pending_lock:
+            if self.on_excluded is not None:
+                wake = self.is_idle()
+                if self.excluded_overflowed:
+                    pass
+                elif len(self.excluded_paths) + len(paths) > self.max_pending_events:
+                    self.excluded_paths = set()
+                    self.excluded_overflowed = True
+                else:
+                    self.excluded_paths.update([(path, event.is_directory) for path in paths])
+                self.last_event_time = self.io_loop.time()
+            wake_touched = self.track_touched_paths(event)
+        if wake:
+            self.io_loop.add_callback(self.schedule_check)
+        if wake_touched:
+            self.io_loop.add_callback(self.flush_touched_paths)
+
+    def is_idle(self):
+        """Checks whether nothing has happened since the last notification (with the pending lock held)."""
+        return not self.pending_events and not self.overflowed and not self.excluded_paths and \
+            not self.excluded_overflowed
+
+    def track_touched_paths(self, event):
+        """Records the paths affected by the given raw event for the on_touched callback. Must be called with
+        the pending lock held.
+
+        Returns:
+            True if the I/O loop is to be woken up to pass them on.
+        """
+        if self.on_touched is None:
+            return False
+        paths = [path for path in [event.src_path, getattr(event, "dest_path", None)] if path]
+        wake = not self.touched_paths and not self.touched_overflowed
+        if self.touched_overflowed:
+            pass
+        elif len(self.touched_paths) + len(paths) > self.max_pending_events:
+            self.touched_paths = set()
+            self.touched_overflowed = True
+        else:
+            self.touched_paths.update([(path, event.is_directory) for path in paths])
+        return wake
+
+    def flush_touched_paths(self):
+        with self.pending_lock:
+            paths, self.touched_paths = self.touched_paths, set()
+            overflowed, self.touched_overflowed = self.touched_overflowed, False
+        if self.started and callable(self.on_touched):
+            self.on_touched(None if overflowed else sorted(paths))
+
+    def schedule_check(self):
+        if not self.started or self.timeout is not None:
+            return
+        self.first_event_time = self.io_loop.time()
+        self.timeout = self.io_loop.call_at(self.first_event_time + self.interval, self.check_settled)
+
+    def check_settled(self):
+        """Notifies about changes once no events have arrived for the quiet period, or once we've waited for
+        the maximum amount of time, whichever comes first."""
+        self.timeout = None
+        with self.pending_lock:
+            last_event_time = self.last_event_time
+        deadline = min(last_event_time + self.interval, self.first_event_time + self.max_wait)
+        if self.io_loop.time() < deadline:
+            self.timeout = self.io_loop.call_at(deadline, self.check_settled)
+        else:
+            # log any errors raised by the callback
+            self.io_loop.add_future(self.check_fs_events(), lambda future: future.result())
 
     @gen.coroutine
     def check_fs_events(self):
-        drained_events = []
-        while self.fs_event_queue.qsize() > 0:
-            drained_events.append(self.fs_event_queue.get_nowait())
-        if len(drained_events) > 0 and callable(self.on_changed):
-            logger.debug("Detected %d file system change(s) - triggering callback" % len(drained_events))
-            self.on_changed(drained_events)
+        with self.pending_lock:
+            events, self.pending_events = self.pending_events, []
+            excluded_paths, self.excluded_paths = self.excluded_paths, set()
+            excluded_overflowed, self.excluded_overflowed = self.excluded_overflowed, False
+            overflowed, self.overflowed = self.overflowed, False
+        if excluded_overflowed and callable(self.on_excluded):
+            logger.debug(
+                "More than %d excluded paths changed at once - assuming that any of them may have changed",
+                self.max_pending_events
+            )
+            self.on_excluded(None)
+        elif excluded_paths and callable(self.on_excluded):
+            self.on_excluded(sorted(excluded_paths))
+        if overflowed:
+            self.overflows += 1
+            logger.warning(
+                "More than %d file system events arrived at once - assuming that anything may have changed",
+                self.max_pending_events
+            )
+            changes = None
+        else:
+            self.drain_sizes.observe(len(events))
+            changes = ChangeSet(events)
+        with (yield self.notify_lock.acquire()):
+            if self.verifier is not None and changes is None:
+                # our fingerprints can't be trusted any more
+                self.verifier.fingerprints.clear()
+                self.scan_fingerprints()
+            elif self.verifier is not None and len(changes) > 0:
+                changes = yield self.verifier.verify(changes)
+            self.notify(changes)
+
+    def scan_fingerprints(self):
+        for path in self.watch_paths:
+            self.io_loop.add_future(
+                self.verifier.scan(path, path_filter=self.path_filters[path], recursive=self.recursive),
+                lambda future: future.result()
+            )
+
+    def notify(self, changes):
+        if (changes is None or len(changes) > 0) and callable(self.on_changed):
+            if changes is not None:
+                self.changes_reported += len(changes)
+                logger.debug(
+                    "Detected %d file system change(s) from %d event(s) - triggering callback",
+                    len(changes), changes.raw_event_count
+                )
+            result = self.on_changed(changes)
+            if gen.is_future(result):
+                # log any errors raised by asynchronous callbacks
+                self.io_loop.add_future(result, lambda future: future.result())
 
     def start(self):
         if not self.started:
-            self.observer.start()
-            self.periodic_callback.start()
+            self.io_loop = IOLoop.current()
+            self.pending_events = []
+            self.excluded_paths = set()
+            self.excluded_overflowed = False
+            self.overflowed = False
+            self.touched_paths = set()
+            self.touched_overflowed = False
             self.started = True
+            try:
+                self.backend.start(
+                    [(path, WatcherEventHandler(self, self.path_filters[path])) for path in self.watch_paths],
+                    recursive=self.recursive
+                )
+            except Exception:
+                self.backend.stop()
+                self.started = False
+                raise
+            if self.verifier is not None:
+                self.scan_fingerprints()
             logger.debug("Started file system watcher for paths:\n%s" % "\n".join(self.watch_paths))
 
     def shutdown(self, timeout=None):
         if self.started:
-            self.periodic_callback.stop()
-            self.observer.stop()
-            self.observer.join(timeout=timeout)
             self.started = False
+            if self.timeout is not None:
+                self.io_loop.remove_timeout(self.timeout)
+                self.timeout = None
+            self.backend.stop(timeout=timeout)
+            with self.pending_lock:
+                self.pending_events = []
+                self.excluded_paths = set()
+                self.excluded_overflowed = False
+                self.overflowed = False
+                self.touched_paths = set()
+                self.touched_overflowed = False
             logger.debug("Shut down file system watcher for path:\n%s" % "\n".join(self.watch_paths))
 
 
 class WatcherEventHandler(FileSystemEventHandler):
 
-    def __init__(self, watcher):
+    def __init__(self, watcher, path_filter=None):
         super(WatcherEventHandler, self).__init__()
         self.watcher = watcher
+        self.path_filter = path_filter
 
     def on_any_event(self, event):
-        logger.debug("WatcherEventHandler detected filesystem event: %s" % event)
+        # filtering happens here, on the observer's thread, so that ignored events never reach the I/O loop
+        # (unless the watcher's on_excluded or on_touched callbacks are interested in them)
+        if self.path_filter is not None:
+            filtered = self.filter_event(event)
+            interested = self.watcher.on_excluded is not None or self.watcher.on_touched is not None
+            if filtered is not event and interested and \
+                    not (event.is_directory and event.event_type == EVENT_TYPE_MODIFIED):
+                self.watcher.track_excluded_event(event)
+            if filtered is None:
+                return
+            event = filtered
         self.watcher.track_event(event)
+
+    @property
+    def snapshot_filter(self):
+        """The path filter whose excluded paths polling observers can leave out of their snapshots (without ever
+        walking excluded folders), which is only possible if nobody's interested in changes to excluded paths."""
+        if self.watcher.on_excluded is not None or self.watcher.on_touched is not None:
+            return None
+        return self.path_filter
+
+    def filter_event(self, event):
+        if event.is_directory and event.event_type == EVENT_TYPE_MODIFIED:
+            # a folder's listing has changed, which is also reported through the events of the files within it
+            # (unless they're excluded, in which case the folder's modification is of no interest either)
+            return None
+        is_excluded = self.path_filter.is_excluded
+        src_excluded = is_excluded(event.src_path, event.is_directory)
+        if event.event_type != EVENT_TYPE_MOVED:
+            return None if src_excluded else event
+
+        dest_excluded = is_excluded(event.dest_path, event.is_directory)
+        if src_excluded and dest_excluded:
+            return None
+        event_classes = ChangeSet.DIR_EVENTS if event.is_directory else ChangeSet.FILE_EVENTS
+        if src_excluded:
+            # e.g. a temporary file being moved into place
+            return event_classes[EVENT_TYPE_CREATED](event.dest_path)
+        if dest_excluded:
+            return event_classes[EVENT_TYPE_DELETED](event.src_path)
+        return event
+
+
+class ChangeSet(object):
+    """Collapses a sequence of raw watchdog events into the net change to each affected path. For example, a
+    file that is created, modified and then deleted results in no change at all, a file that is deleted and
+    then re-created is reported as modified, and chains of moves are merged into a single move. Iterating over
+    a change set yields watchdog events describing the net changes."""
+
+    CREATED = EVENT_TYPE_CREATED
+    MODIFIED = EVENT_TYPE_MODIFIED
+    DELETED = EVENT_TYPE_DELETED
+    MOVED = EVENT_TYPE_MOVED
+    # the source of a move, which is reported through the move itself
+    MOVED_AWAY = "moved_away"
+
+    FILE_EVENTS = {
+        CREATED: FileCreatedEvent,
+        MODIFIED: FileModifiedEvent,
+        DELETED: FileDeletedEvent,
+        MOVED: FileMovedEvent
+    }
+    DIR_EVENTS = {
+        CREATED: DirCreatedEvent,
+        MODIFIED: DirModifiedEvent,
+        DELETED: DirDeletedEvent,
+        MOVED: DirMovedEvent
+    }
+
+    def __init__(self, events=None):
+        # path -> [change type, is directory, origin of move, whether something is known to have been at the
+        # path before the batch (for the destinations of moves)]
+        self.changes = OrderedDict()
+        self.raw_event_count = 0
+        self._events = None
+        for event in events or []:
+            self.add(event)
+
+    def __len__(self):
+        return len(self.events())
+
+    def __iter__(self):
+        return iter(self.events())
+
+    def __bool__(self):
+        return len(self) > 0
+
+    __nonzero__ = __bool__
+
+    @property
+    def paths(self):
+        """All of the paths affected by the net changes (including the sources of moves)."""
+        return [path for path in self.changes if self.changes[path][0] is not None]
+
+    def discard(self, path):
+        """Removes any change to the given path from the change set."""
+        if self.changes.pop(path, None) is not None:
+            self._events = None
+
+    def add(self, event):
+        """Folds the given raw watchdog event into the change set."""
+        self.raw_event_count += 1
+        self._events = None
+        if event.event_type == EVENT_TYPE_MOVED:
+            self._add_move(event.src_path, event.dest_path, event.is_directory)
+            return
+
+        path = event.src_path
+        existing = self.changes.get(path)
+        current = existing[0] if existing is not None else None
+
+        if event.event_type == EVENT_TYPE_CREATED:
+            # something that was deleted (or moved away) and then re-created has been modified
+            change = self.MODIFIED if current in (self.DELETED, self.MOVED_AWAY) else self.CREATED
+            self._set(path, change, event.is_directory)
+
+        elif event.event_type == EVENT_TYPE_MODIFIED:
+            if current in (None, self.DELETED, self.MOVED_AWAY):
+                self._set(path, self.MODIFIED, event.is_directory)
+
+        elif event.event_type == EVENT_TYPE_DELETED:
+            if current == self.CREATED:
+                # created and deleted again: no net change
+                del self.changes[path]
+            elif current == self.MOVED:
+                # moved here and then deleted: the original was effectively deleted, as was whatever the move
+                # overwrote
+                if existing[3]:
+                    self._set(path, self.DELETED, event.is_directory)
+                else:
+                    del self.changes[path]
+                if self.changes.get(existing[2], [None])[0] == self.MOVED_AWAY:
+                    self._set(existing[2], self.DELETED, event.is_directory)
+            else:
+                self._set(path, self.DELETED, event.is_directory)
+
+    def events(self):
+        """Returns the list of watchdog events describing the net changes."""
+        if self._events is None:
+            self._events = []
+            for path, (change, is_directory, origin, existed) in self.changes.items():
+                if change == self.MOVED_AWAY:
+                    continue
+                event_classes = self.DIR_EVENTS if is_directory else self.FILE_EVENTS
+                if change == self.MOVED:
+                    self._events.append(event_classes[change](origin, path))
+                else:
+                    self._events.append(event_classes[change](path))
+        return self._events
+
+    def _set(self, path, change, is_directory, origin=None, existed=False):
+        self.changes.pop(path, None)
+        self.changes[path] = [change, is_directory, origin, existed]
+
+    def _existed(self, path):
+        """Is something known to have been at the given path before the batch of events? Raw events don't say
+        whether a move overwrote its destination, so only paths that we've seen change are known to have."""
+        existing = self.changes.get(path)
+        if existing is None:
+            return False
+        return existing[0] in (self.MODIFIED, self.DELETED, self.MOVED_AWAY) or \
+            (existing[0] == self.MOVED and existing[3])
+
+    def _add_move(self, src_path, dest_path, is_directory):
+        existing = self.changes.get(src_path)
+        current = existing[0] if existing is not None else None
+        dest_existed = self._existed(dest_path)
+
+        if current == self.CREATED:
+            # created and then moved: it's as if it had been created at its destination
+            del self.changes[src_path]
+            self._set(dest_path, self.MODIFIED if dest_existed else self.CREATED, is_directory)
+        elif current == self.MOVED:
+            # a chain of moves collapses into a single move from the original location, and intermediate
+            # locations only appear as deleted if something was there before the batch
+            origin = existing[2]
+            if existing[3]:
+                self._set(src_path, self.DELETED, is_directory)
+            else:
+                del self.changes[src_path]
+            if origin == dest_path:
+                self._set(dest_path, self.MODIFIED, is_directory)
+            else:
+                self._set(dest_path, self.MOVED, is_directory, origin=origin, existed=dest_existed)
+        else:
+            self._set(src_path, self.MOVED_AWAY, is_directory)
+            self._set(dest_path, self.MOVED, is_directory, origin=src_path, existed=dest_existed)
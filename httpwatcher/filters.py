@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import io
+import os
+import os.path
+import re
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "PathFilter",
+    "DEFAULT_EXCLUDE_PATTERNS"
+]
+
+# version control metadata, dependency folders, bytecode and editor swap/backup files, none of which should
+# ever trigger a reload
+DEFAULT_EXCLUDE_PATTERNS = [
+    ".git/",
+    ".hg/",
+    ".svn/",
+    "node_modules/",
+    "__pycache__/",
+    "*.py[cod]",
+    "*.sw[a-p]",
+    "*~",
+    ".#*",
+    "#*#",
+    ".DS_Store",
+    # Vim writes this file to check whether it can create files in a folder
+    "4913"
+]
+
+
+class PathFilter(object):
+    """Decides which paths beneath a watched root are of interest, using .gitignore-style patterns: patterns
+    containing a slash are matched relative to the root, other patterns match the name of any file or folder
+    beneath it, a trailing slash only matches folders, "**" matches any number of folders and a leading "!"
+    re-includes a previously excluded path. Excluding a folder excludes everything beneath it. Later patterns
+    take precedence over earlier ones.
+
+    All of the patterns are compiled once, and consecutive patterns of the same kind are combined into a single
+    regular expression, so that matching is cheap enough to be done for every raw file system event."""
+
+    def __init__(self, root, include=None, exclude=None, gitignore=False):
+        """Constructor.
+
+        Args:
+            root: The absolute path to the watched folder, relative to which paths are matched.
+            include: An optional list of patterns. If given, only files matching at least one of them are of
+                interest. Folders are not subject to these patterns.
+            exclude: An optional list of additional patterns of paths to exclude, applied after the default
+                patterns (DEFAULT_EXCLUDE_PATTERNS) and those from the .gitignore file. Negated patterns
+                (e.g. "!node_modules/") re-include paths excluded by the defaults.
+            gitignore: Should the patterns in the root's .gitignore file (if any) be excluded too?
+        """
+        self.root = os.path.abspath(root).rstrip(os.sep)
+        self.prefix = self.root + os.sep
+
+        exclude_patterns = list(DEFAULT_EXCLUDE_PATTERNS)
+        if gitignore:
+            exclude_patterns.extend(self.read_patterns(os.path.join(self.root, ".gitignore")))
+        exclude_patterns.extend(exclude or [])
+
+        self.exclude_rules = self.compile_patterns(exclude_patterns)
+        self.include_rules = self.compile_patterns(include) if include else None
+
+    def is_excluded(self, path, is_directory=False):
+        """Checks whether the given absolute path should be ignored."""
+        if path.startswith(self.prefix):
+            rel_path = path[len(self.prefix):]
+        else:
+            # the root itself, or something outside of it
+            return False
+        if os.sep != "/":
+            rel_path = rel_path.replace(os.sep, "/")
+        if is_directory:
+            rel_path += "/"
+
+        if self.match(self.exclude_rules, rel_path):
+            return True
+        if self.include_rules is not None and not is_directory:
+            return not self.match(self.include_rules, rel_path)
+        return False
+
+    @staticmethod
+    def match(rules, rel_path):
+        # the last matching rule wins
+        for regex, negated in reversed(rules):
+            if regex.match(rel_path):
+                return not negated
+        return False
+
+    @classmethod
+    def compile_patterns(cls, patterns):
+        """Compiles the given list of patterns into a list of (regex, negated) rules, combining consecutive
+        patterns of the same kind into a single regular expression."""
+        rules = []
+        group, group_negated = [], None
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negated = pattern.startswith("!")
+            if negated:
+                pattern = pattern[1:]
+            if group and negated != group_negated:
+                rules.append((re.compile("|".join(group)), group_negated))
+                group = []
+            group.append(cls.translate(pattern))
+            group_negated = negated
+        if group:
+            rules.append((re.compile("|".join(group)), group_negated))
+        return rules
+
+    @staticmethod
+    def translate(pattern):
+        """Translates a single .gitignore-style pattern into a regular expression, to be matched against
+        slash-separated paths relative to the root (where folders have a trailing slash)."""
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+
+        i, n, regex = 0, len(pattern), []
+        while i < n:
+            c = pattern[i]
+            if pattern.startswith("**/", i):
+                regex.append("(?:.*/)?")
+                i += 3
+                continue
+            elif pattern.startswith("**", i):
+                regex.append(".*")
+                i += 2
+                continue
+            elif c == "*":
+                regex.append("[^/]*")
+            elif c == "?":
+                regex.append("[^/]")
+            elif c == "[":
+                j = pattern.find("]", i + 1)
+                if j < 0:
+                    regex.append(re.escape(c))
+                else:
+                    chars = pattern[i + 1:j]
+                    if chars.startswith("!"):
+                        chars = "^" + chars[1:]
+                    regex.append("[%s]" % chars.replace("\\", "\\\\"))
+                    i = j
+            else:
+                regex.append(re.escape(c))
+            i += 1
+
+        return "(?:^%s%s%s$)" % (
+            "" if anchored else "(?:.*/)?",
+            "".join(regex),
+            "/.*" if dir_only else "(?:/.*)?"
+        )
+
+    @staticmethod
+    def read_patterns(path):
+        if not os.path.isfile(path):
+            return []
+        try:
+            with io.open(path, "rt", encoding="utf-8", errors="replace") as f:
+                return [line.rstrip("\r\n") for line in f]
+        except (IOError, OSError):
+            logger.warning("Unable to read ignore patterns from %s", path)
+            return []
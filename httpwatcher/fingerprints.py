@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import os.path
+from concurrent.futures import ThreadPoolExecutor
+
+from watchdog.events import EVENT_TYPE_CREATED, EVENT_TYPE_DELETED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED
+
+from tornado import gen
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "ChangeVerifier",
+    "DEFAULT_VERIFY_WORKERS",
+    "DEFAULT_MAX_VERIFY_SIZE"
+]
+
+DEFAULT_VERIFY_WORKERS = 4
+# files larger than this are assumed to have changed whenever their size or modification time changes
+DEFAULT_MAX_VERIFY_SIZE = 64 * 1024 * 1024
+READ_BLOCK_SIZE = 64 * 1024
+
+
+def new_hash():
+    if xxhash is not None:
+        return xxhash.xxh64()
+    if hasattr(hashlib, "blake2b"):
+        return hashlib.blake2b(digest_size=16)
+    return hashlib.sha1()
+
+
+class ChangeVerifier(object):
+    """Keeps a fingerprint (size, modification time and content hash) of each watched file, so that
+    modifications that leave a file's contents unchanged (e.g. "touch", or a generator rewriting identical
+    output) can be discarded from a change set. Files are only hashed if their size or modification time has
+    changed, and all file system access happens on a pool of worker threads.
+
+    The first modification of a file whose fingerprint isn't known yet (e.g. because it was created while the
+    initial scan was still running) is always assumed to be a real change."""
+
+    def __init__(self, max_workers=DEFAULT_VERIFY_WORKERS, max_file_size=DEFAULT_MAX_VERIFY_SIZE):
+        """Constructor.
+
+        Args:
+            max_workers: The number of worker threads with which to read and hash files.
+            max_file_size: Files larger than this number of bytes are not hashed, and are assumed to have
+                changed if their size or modification time has changed.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.max_file_size = max_file_size
+        # path -> (size, mtime, digest), only ever accessed from the I/O loop's thread
+        self.fingerprints = dict()
+        self.suppressed = 0
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    @gen.coroutine
+    def scan(self, root, path_filter=None, recursive=True):
+        """Fingerprints all of the (non-excluded) files beneath the given folder, to serve as the baseline
+        against which subsequent modifications are verified."""
+        fingerprints = yield self.executor.submit(self.scan_folder, root, path_filter, recursive)
+        for path, fingerprint in fingerprints.items():
+            # fingerprints taken since the scan started are more recent
+            self.fingerprints.setdefault(path, fingerprint)
+        logger.debug("Fingerprinted %d file(s) beneath %s", len(fingerprints), root)
+
+    @gen.coroutine
+    def verify(self, changes):
+        """Discards the modifications in the given ChangeSet that haven't actually changed any file contents,
+        updating our fingerprints as we go.
+
+        Returns:
+            The given ChangeSet.
+        """
+        to_fingerprint = []
+        for event in list(changes):
+            if event.is_directory:
+                continue
+            if event.event_type == EVENT_TYPE_DELETED:
+                self.fingerprints.pop(event.src_path, None)
+            elif event.event_type == EVENT_TYPE_MOVED:
+                fingerprint = self.fingerprints.pop(event.src_path, None)
+                if fingerprint is not None:
+                    self.fingerprints[event.dest_path] = fingerprint
+            elif event.event_type in (EVENT_TYPE_CREATED, EVENT_TYPE_MODIFIED):
+                to_fingerprint.append(event.src_path)
+
+        if not to_fingerprint:
+            raise gen.Return(changes)
+
+        previous = [self.fingerprints.get(path) for path in to_fingerprint]
+        current = yield [
+            self.executor.submit(self.fingerprint, path, prev) for path, prev in zip(to_fingerprint, previous)
+        ]
+        for path, prev, fingerprint in zip(to_fingerprint, previous, current):
+            if fingerprint is None:
+                # it's gone again (a deletion event should follow)
+                self.fingerprints.pop(path, None)
+                continue
+            self.fingerprints[path] = fingerprint
+            if prev is not None and fingerprint[2] is not None and fingerprint[2] == prev[2]:
+                logger.debug("Contents of %s are unchanged - ignoring", path)
+                changes.discard(path)
+                self.suppressed += 1
+        raise gen.Return(changes)
+
+    def fingerprint(self, path, previous=None):
+        """Computes the fingerprint of the file at the given path, reusing the given previous fingerprint's
+        digest if the file's size and modification time haven't changed. Called on a worker thread.
+
+        Returns:
+            A (size, mtime, digest) tuple, or None if the file doesn't exist (any more).
+        """
+        try:
+            st = os.stat(path)
+        except (IOError, OSError):
+            return None
+        mtime = getattr(st, "st_mtime_ns", st.st_mtime)
+        if previous is not None and previous[0] == st.st_size and previous[1] == mtime:
+            return previous
+        if st.st_size > self.max_file_size:
+            return st.st_size, mtime, None
+
+        h = new_hash()
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    block = f.read(READ_BLOCK_SIZE)
+                    if not block:
+                        break
+                    h.update(block)
+        except (IOError, OSError):
+            return None
+        return st.st_size, mtime, h.digest()
+
+    def scan_folder(self, root, path_filter=None, recursive=True):
+        fingerprints = dict()
+        for folder, subfolders, filenames in os.walk(root):
+            if path_filter is not None:
+                subfolders[:] = [
+                    name for name in subfolders
+                    if not path_filter.is_excluded(os.path.join(folder, name), True)
+                ]
+            if not recursive:
+                subfolders[:] = []
+            for filename in filenames:
+                path = os.path.join(folder, filename)
+                if path_filter is not None and path_filter.is_excluded(path):
+                    continue
+                fingerprint = self.fingerprint(path)
+                if fingerprint is not None:
+                    fingerprints[path] = fingerprint
+        return fingerprints
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import sys
+
+__all__ = [
+    "ScriptInjector"
+]
+
+PY2 = sys.version_info[0] < 3
+
+
+class ScriptInjector(object):
+    """Locates the point at which to inject a snippet of HTML (our WebSocket scripts) into an HTML document:
+    just before the document's last closing </body> tag, failing which just before its last closing </html>
+    tag, failing which at the very end of the document. Documents are scanned backwards from the end in
+    fixed-size blocks, so that only the tail of a large document ever needs to be examined."""
+
+    BLOCK_SIZE = 8 * 1024
+    CLOSING_TAGS = (b"</body", b"</html")
+
+    def __init__(self, snippet):
+        self.snippet = snippet
+
+    def find_offset(self, content):
+        """Finds the injection offset within the given bytes."""
+        return self._find_offset(lambda start, end: content[start:end], len(content))
+
+    def find_offset_in_file(self, file, size):
+        """Finds the injection offset within the given open (binary) file of the given size."""
+        def read_block(start, end):
+            file.seek(start)
+            return file.read(end - start)
+        return self._find_offset(read_block, size)
+
+    def inject(self, content):
+        """Returns a copy of the given HTML document with the snippet injected."""
+        offset = self.find_offset(content)
+        if PY2:
+            return b"".join((content[:offset], self.snippet, content[offset:]))
+        view = memoryview(content)
+        return b"".join((view[:offset], self.snippet, view[offset:]))
+
+    def injected_size(self, size):
+        return size + len(self.snippet)
+
+    def _find_offset(self, read_block, size):
+        # blocks overlap slightly so that tags straddling two blocks are still found
+        overlap = max(len(tag) for tag in self.CLOSING_TAGS) - 1
+        fallback = None
+        end = size
+        while end > 0:
+            start = max(end - self.BLOCK_SIZE, 0)
+            block = read_block(start, min(end + overlap, size)).lower()
+            body_offset = block.rfind(self.CLOSING_TAGS[0])
+            if body_offset >= 0:
+                return start + body_offset
+            if fallback is None:
+                html_offset = block.rfind(self.CLOSING_TAGS[1])
+                if html_offset >= 0:
+                    fallback = start + html_offset
+            end = start
+        return fallback if fallback is not None else size
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import bisect
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "Histogram",
+    "ServerMetrics",
+    "PROMETHEUS_CONTENT_TYPE"
+]
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# upper bounds (in seconds) of the request latency histograms' buckets, as used by Prometheus' client libraries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# upper bounds (in seconds) of the broadcast duration histogram's buckets: broadcasts only queue messages up
+BROADCAST_DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+# upper bounds of the buckets of the histogram of the number of file system events handed over to the I/O loop
+DRAIN_SIZE_BUCKETS = (1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+class Histogram(object):
+    """Counts observed values in buckets, Prometheus-style: each bucket counts the values less than or equal to
+    its upper bound. Not thread-safe."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        # the number of values in each bucket (but not the preceding ones), the last one being unbounded
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """Returns a list of (upper bound, count) tuples, where each count includes the values in all of the
+        preceding buckets. The last upper bound is "+Inf"."""
+        result, total = [], 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": dict([(format_value(bound), count) for bound, count in self.cumulative_counts()])
+        }
+
+
+class ServerMetrics(object):
+    """Collects statistics about the requests served by an HttpWatcherServer and its reloads, and renders them
+    (along with those kept by its file system watcher and caches) in Prometheus' text exposition format or as
+    JSON. Statistics are only to be recorded from the I/O loop's thread."""
+
+    def __init__(self, server):
+        self.server = server
+        self.started = time.time()
+        # (route, status) -> number of requests
+        self.requests = dict()
+        # route -> Histogram of request durations
+        self.request_durations = dict()
+        # route -> number of bytes of response bodies sent
+        self.bytes_served = dict()
+        self.broadcast_durations = Histogram(BROADCAST_DURATION_BUCKETS)
+
+    def record_request(self, route, status, duration, bytes_sent=0):
+        """Records a completed request.
+
+        Args:
+            route: The name of the route that handled the request (e.g. "static").
+            status: The response's HTTP status code.
+            duration: How long (in seconds) the request took.
+            bytes_sent: The number of bytes of the response's body that were sent.
+        """
+        key = (route, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        if route not in self.request_durations:
+            self.request_durations[route] = Histogram(LATENCY_BUCKETS)
+        self.request_durations[route].observe(duration)
+        self.bytes_served[route] = self.bytes_served.get(route, 0) + bytes_sent
+
+    def record_broadcast(self, duration):
+        self.broadcast_durations.observe(duration)
+
+    def to_dict(self):
+        watcher = self.server.watcher
+        routes = sorted(self.request_durations.keys())
+        result = {
+            "uptime_seconds": time.time() - self.started,
+            "requests": dict([(route, {
+                "statuses": dict([
+                    ("%d" % status, count) for (r, status), count in self.requests.items() if r == route
+                ]),
+                "bytes_served": self.bytes_served.get(route, 0),
+                "duration_seconds": self.request_durations[route].to_dict()
+            }) for route in routes]),
+            "watcher": {
+                "raw_events": watcher.events_received,
+                "changes": watcher.changes_reported,
+                "overflows": watcher.overflows,
+                "drain_sizes": watcher.drain_sizes.to_dict()
+            },
+            "clients": {
+                "connected": len(self.server.connected_clients)
+            },
+            "broadcasts": {
+                "duration_seconds": self.broadcast_durations.to_dict()
+            },
+            "caches": dict()
+        }
+        for name, cache in self.get_caches():
+            result["caches"][name] = {
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "entries": len(cache)
+            }
+        return result
+
+    def to_prometheus(self):
+        lines = []
+
+        def family(name, metric_type, description):
+            lines.append("# HELP httpwatcher_%s %s" % (name, description))
+            lines.append("# TYPE httpwatcher_%s %s" % (name, metric_type))
+
+        def sample(name, value, **labels):
+            lines.append("httpwatcher_%s%s %s" % (name, format_labels(labels), format_value(value)))
+
+        def histogram(name, hist, **labels):
+            for bound, count in hist.cumulative_counts():
+                sample(name + "_bucket", count, le=format_value(bound), **labels)
+            sample(name + "_sum", hist.sum, **labels)
+            sample(name + "_count", hist.count, **labels)
+
+        family("uptime_seconds", "gauge", "Time since the server was started.")
+        sample("uptime_seconds", time.time() - self.started)
+
+        family("requests_total", "counter", "Requests served, by route and HTTP status.")
+        for (route, status), count in sorted(self.requests.items()):
+            sample("requests_total", count, route=route, code="%d" % status)
+        family("request_duration_seconds", "histogram", "Time taken to serve requests, by route.")
+        for route, hist in sorted(self.request_durations.items()):
+            histogram("request_duration_seconds", hist, route=route)
+        family("response_bytes_total", "counter", "Bytes of response bodies sent, by route.")
+        for route, count in sorted(self.bytes_served.items()):
+            sample("response_bytes_total", count, route=route)
+
+        watcher = self.server.watcher
+        family("fs_events_total", "counter", "Raw file system events received by the watcher.")
+        sample("fs_events_total", watcher.events_received)
+        family("fs_changes_total", "counter", "Net file system changes reported after coalescing raw events.")
+        sample("fs_changes_total", watcher.changes_reported)
+        family("fs_event_overflows_total", "counter", "Times too many file system events arrived to keep track of.")
+        sample("fs_event_overflows_total", watcher.overflows)
+        family("fs_event_drain_size", "histogram", "File system events handed over to the I/O loop at once.")
+        histogram("fs_event_drain_size", watcher.drain_sizes)
+
+        family("connected_clients", "gauge", "Connected WebSocket clients.")
+        sample("connected_clients", len(self.server.connected_clients))
+        family("broadcast_duration_seconds", "histogram", "Time taken to send messages to all connected clients.")
+        histogram("broadcast_duration_seconds", self.broadcast_durations)
+
+        caches = self.get_caches()
+        family("cache_hits_total", "counter", "Cache lookups that were answered from the cache.")
+        for name, cache in caches:
+            sample("cache_hits_total", cache.hits, cache=name)
+        family("cache_misses_total", "counter", "Cache lookups that weren't answered from the cache.")
+        for name, cache in caches:
+            sample("cache_misses_total", cache.misses, cache=name)
+        family("cache_entries", "gauge", "Entries held in the cache.")
+        for name, cache in caches:
+            sample("cache_entries", len(cache), cache=name)
+        return "\n".join(lines) + "\n"
+
+    def get_caches(self):
+        caches = [("content", self.server.content_cache), ("path", self.server.path_cache)]
+        return [(name, cache) for name, cache in caches if cache is not None]
+
+
+def format_value(value):
+    """Formats the given number the way Prometheus expects it (e.g. integral floats without a decimal point)."""
+    if isinstance(value, float) and value.is_integer():
+        return "%d" % value
+    return "%s" % value
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join([
+        '%s="%s"' % (name, ("%s" % value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in sorted(labels.items())
+    ])
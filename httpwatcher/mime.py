@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os.path
+import mimetypes
+
+__all__ = [
+    "ContentTypeMap",
+    "DEFAULT_CONTENT_TYPES",
+    "parse_content_type_mappings"
+]
+
+# Modern and web-specific content types that are missing from (or differ in) the Python standard library's
+# built-in table. These affect whether browsers stream-compile, cache or render the content.
+DEFAULT_CONTENT_TYPES = {
+    ".html": "text/html",
+    ".htm": "text/html",
+    ".css": "text/css",
+    ".js": "application/javascript",
+    ".mjs": "application/javascript",
+    ".json": "application/json",
+    ".map": "application/json",
+    ".webmanifest": "application/manifest+json",
+    ".wasm": "application/wasm",
+    ".svg": "image/svg+xml",
+    ".avif": "image/avif",
+    ".webp": "image/webp",
+    ".ico": "image/x-icon",
+    ".woff": "font/woff",
+    ".woff2": "font/woff2",
+    ".ttf": "font/ttf",
+    ".otf": "font/otf",
+    ".md": "text/markdown",
+    ".txt": "text/plain",
+    ".xml": "application/xml",
+    ".mp4": "video/mp4",
+    ".webm": "video/webm",
+    # compressed files are served as-is, rather than with a Content-Encoding
+    ".gz": "application/gzip",
+    ".tgz": "application/gzip",
+    ".svgz": "application/gzip",
+    ".bz2": "application/octet-stream",
+    ".xz": "application/octet-stream",
+    ".br": "application/octet-stream",
+    ".z": "application/octet-stream"
+}
+
+
+class ContentTypeMap(object):
+    """Maps file name extensions to content types. The table is built once from the Python standard library's
+    built-in table (without reading the system's MIME type files), our own defaults and any user-supplied
+    mappings, and lookups are memoized per extension."""
+
+    def __init__(self, content_types=None, default_content_type="application/octet-stream"):
+        """Constructor.
+
+        Args:
+            content_types: An optional dictionary of additional or overriding mappings of file name
+                extensions (e.g. ".scss") to content types.
+            default_content_type: The content type of files whose extension is unknown.
+        """
+        self.default_content_type = default_content_type
+        self.table = dict([(ext.lower(), content_type) for ext, content_type in mimetypes.types_map.items()])
+        self.table.update(DEFAULT_CONTENT_TYPES)
+        for ext, content_type in (content_types or {}).items():
+            self.add(ext, content_type)
+        self._memo = dict()
+
+    def add(self, ext, content_type):
+        ext = ext.strip().lower()
+        if not ext.startswith("."):
+            ext = "." + ext
+        self.table[ext] = content_type
+        self._memo = dict()
+
+    def guess(self, path):
+        """Returns the content type of the file at the given path, based on its extension."""
+        ext = os.path.splitext(path)[1]
+        try:
+            return self._memo[ext]
+        except KeyError:
+            content_type = self.table.get(ext.lower(), self.default_content_type)
+            self._memo[ext] = content_type
+            return content_type
+
+
+def parse_content_type_mappings(mappings):
+    """Parses a list of "EXT=TYPE" strings (e.g. ".scss=text/x-scss") into a dictionary of extensions to
+    content types."""
+    content_types = dict()
+    for mapping in mappings or []:
+        ext, sep, content_type = mapping.partition("=")
+        if not sep or not ext.strip() or not content_type.strip():
+            raise ValueError("Invalid content type mapping (expected EXT=TYPE): %s" % mapping)
+        content_types[ext.strip()] = content_type.strip()
+    return content_types
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import base64
+import hashlib
+import io
+import json
+import os
+import os.path
+import stat
+import sys
+import threading
+import time
+from array import array
+
+from watchdog.events import DirCreatedEvent, DirDeletedEvent, DirModifiedEvent, DirMovedEvent, \
+    FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent
+from watchdog.observers.api import BaseObserver, EventEmitter
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "Snapshot",
+    "SnapshotPollingObserver",
+    "take_snapshot",
+    "diff_snapshots",
+    "DEFAULT_POLL_INTERVAL",
+    "DEFAULT_SNAPSHOT_DIR"
+]
+
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_SNAPSHOT_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "httpwatcher",
+    "snapshots"
+)
+
+SNAPSHOT_VERSION = 1
+# how often to persist a snapshot that has changed (in seconds), in addition to when polling stops
+SAVE_INTERVAL = 60.0
+# folders modified this recently (in nanoseconds) may be modified again without their modification time changing
+# (on file systems with coarse timestamps), so their listings aren't trusted on the next pass
+RACY_INTERVAL_NS = 2 * 1000000000
+UNKNOWN_MTIME = -1
+
+# array type codes (array's type codes must be native strings on Python 2, which lacks 64-bit codes)
+if sys.version_info >= (3, 3):
+    INT64, UINT64 = str("q"), str("Q")
+else:
+    INT64, UINT64 = str("l"), str("L")
+INT8 = str("b")
+
+
+def array_to_base64(a):
+    data = a.tobytes() if hasattr(a, "tobytes") else a.tostring()
+    return base64.b64encode(data).decode("ascii")
+
+
+def array_from_base64(a, data):
+    data = base64.b64decode(data)
+    if hasattr(a, "frombytes"):
+        a.frombytes(data)
+    else:
+        a.fromstring(data)
+
+
+def mtime_ns(st):
+    mtime = getattr(st, "st_mtime_ns", None)
+    return mtime if mtime is not None else int(st.st_mtime * 1e9)
+
+
+class Snapshot(object):
+    """A compact snapshot of the stat results (inode, size and modification time) of all of the files and folders
+    beneath a root folder. Paths are indexed into parallel arrays, rather than each having its own stat result
+    object, which keeps snapshots of hundreds of thousands of files small enough to hold in memory and persist."""
+
+    def __init__(self, root, recursive=True):
+        self.root = root
+        self.recursive = recursive
+        self.paths = []
+        self.index = dict()
+        self.inodes = array(UINT64)
+        self.sizes = array(INT64)
+        self.mtimes = array(INT64)
+        self.is_dir = array(INT8)
+        # folder path -> names of its entries
+        self.children = dict()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, path, st, is_dir, mtime=None):
+        self.index[path] = len(self.paths)
+        self.paths.append(path)
+        self.inodes.append(st.st_ino)
+        self.sizes.append(st.st_size)
+        self.mtimes.append(mtime if mtime is not None else mtime_ns(st))
+        self.is_dir.append(1 if is_dir else 0)
+
+    def save(self, filename):
+        """Persists the snapshot to the given file, atomically replacing any existing snapshot."""
+        prefix = self.root.rstrip(os.sep) + os.sep
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "root": self.root,
+            "recursive": self.recursive,
+            "byteorder": sys.byteorder,
+            "typecodes": "".join([self.inodes.typecode, self.sizes.typecode, self.is_dir.typecode]),
+            "paths": [path[len(prefix):] if path != self.root else "" for path in self.paths],
+            "inodes": array_to_base64(self.inodes),
+            "sizes": array_to_base64(self.sizes),
+            "mtimes": array_to_base64(self.mtimes),
+            "is_dir": array_to_base64(self.is_dir)
+        }
+        folder = os.path.dirname(filename)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        temp_filename = "%s.%d.tmp" % (filename, os.getpid())
+        with io.open(temp_filename, "wt", encoding="utf-8") as f:
+            f.write(json.dumps(data, ensure_ascii=False))
+        getattr(os, "replace", os.rename)(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename, root, recursive=True):
+        """Loads a persisted snapshot of the given root folder.
+
+        Returns:
+            The snapshot, or None if there's no usable snapshot in the given file.
+        """
+        if not os.path.isfile(filename):
+            return None
+        try:
+            with io.open(filename, "rt", encoding="utf-8") as f:
+                data = json.loads(f.read())
+            if data.get("version") != SNAPSHOT_VERSION or data.get("root") != root or \
+                    data.get("recursive") != recursive or data.get("byteorder") != sys.byteorder or \
+                    data.get("typecodes") != "".join([UINT64, INT64, INT8]):
+                return None
+
+            snapshot = cls(root, recursive=recursive)
+            for name in ["inodes", "sizes", "mtimes", "is_dir"]:
+                array_from_base64(getattr(snapshot, name), data[name])
+            snapshot.paths = [os.path.join(root, path) if path else root for path in data["paths"]]
+            if not (len(snapshot.paths) == len(snapshot.inodes) == len(snapshot.sizes) == len(snapshot.mtimes) ==
+                    len(snapshot.is_dir)):
+                return None
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            logger.warning("Unable to load snapshot from %s", filename)
+            return None
+
+        for i, path in enumerate(snapshot.paths):
+            snapshot.index[path] = i
+            if snapshot.is_dir[i]:
+                snapshot.children.setdefault(path, [])
+            if path != root:
+                snapshot.children.setdefault(os.path.dirname(path), []).append(os.path.basename(path))
+        return snapshot
+
+
+def list_folder(folder):
+    """Lists the given folder's entries and their (lstat) stat results."""
+    entries = []
+    if scandir is not None:
+        for entry in scandir(folder):
+            try:
+                entries.append((entry.name, entry.stat(follow_symlinks=False)))
+            except OSError:
+                # it's been deleted since we listed the folder
+                pass
+    else:
+        for name in os.listdir(folder):
+            try:
+                entries.append((name, os.lstat(os.path.join(folder, name))))
+            except OSError:
+                pass
+    return entries
+
+
+def stat_known_entries(folder, names):
+    """Re-stats the given, previously listed entries of a folder whose listing hasn't changed.
+
+    Returns:
+        A list of (name, stat result) tuples, or None if any of the entries has gone missing after all.
+    """
+    entries = []
+    for name in names:
+        try:
+            entries.append((name, os.lstat(os.path.join(folder, name))))
+        except OSError:
+            return None
+    return entries
+
+
+def take_snapshot(root, previous=None, recursive=True, path_filter=None):
+    """Takes a snapshot of the given folder. If a previous snapshot is supplied, folders whose modification time
+    hasn't changed since then aren't listed again: only their known entries are re-stat'ed.
+
+    Args:
+        root: The absolute path to the folder of which to take a snapshot.
+        previous: An optional previous snapshot of the same folder.
+        recursive: Whether to include all subfolders' contents in the snapshot.
+        path_filter: An optional PathFilter, whose excluded paths are left out of the snapshot (and excluded
+            folders are never walked).
+
+    Returns:
+        The new snapshot.
+    """
+    snapshot = Snapshot(root, recursive=recursive)
+    racy_after = int(time.time() * 1e9) - RACY_INTERVAL_NS
+
+    def folder_mtime(st):
+        mtime = mtime_ns(st)
+        return mtime if mtime < racy_after else UNKNOWN_MTIME
+
+    try:
+        root_stat = os.stat(root)
+    except OSError:
+        return snapshot
+    snapshot.add(root, root_stat, True, mtime=folder_mtime(root_stat))
+
+    folders = [(root, root_stat)]
+    while folders:
+        folder, folder_stat = folders.pop()
+        entries = None
+        if previous is not None:
+            i = previous.index.get(folder)
+            if i is not None and previous.is_dir[i] and previous.mtimes[i] != UNKNOWN_MTIME and \
+                    previous.mtimes[i] == mtime_ns(folder_stat) and previous.inodes[i] == folder_stat.st_ino and \
+                    folder in previous.children:
+                entries = stat_known_entries(folder, previous.children[folder])
+        if entries is None:
+            try:
+                entries = list_folder(folder)
+            except OSError:
+                # it's been deleted or replaced since we found it
+                entries = []
+
+        names = []
+        for name, st in entries:
+            path = os.path.join(folder, name)
+            is_dir = stat.S_ISDIR(st.st_mode)
+            if path_filter is not None and path_filter.is_excluded(path, is_dir):
+                continue
+            names.append(name)
+            if is_dir:
+                snapshot.add(path, st, True, mtime=folder_mtime(st))
+                if recursive:
+                    folders.append((path, st))
+            else:
+                snapshot.add(path, st, False)
+        snapshot.children[folder] = names
+    return snapshot
+
+
+def diff_snapshots(old, new):
+    """Works out the watchdog events that describe the differences between two snapshots of the same folder.
+    Paths that disappeared from one location and appeared in another with the same inode are reported as moves."""
+    deleted = [path for path in old.paths if path not in new.index]
+    created = [path for path in new.paths if path not in old.index]
+
+    deleted_by_inode = dict([((old.inodes[old.index[path]], old.is_dir[old.index[path]]), path) for path in deleted])
+    moved = []
+    for path in created:
+        i = new.index[path]
+        src_path = deleted_by_inode.pop((new.inodes[i], new.is_dir[i]), None)
+        if src_path is not None:
+            moved.append((src_path, path))
+    moved_sources = set([src_path for src_path, _ in moved])
+    moved_destinations = set([dest_path for _, dest_path in moved])
+
+    events = []
+    for path in deleted:
+        if path not in moved_sources:
+            events.append(DirDeletedEvent(path) if old.is_dir[old.index[path]] else FileDeletedEvent(path))
+    for src_path, dest_path in moved:
+        events.append(
+            DirMovedEvent(src_path, dest_path) if new.is_dir[new.index[dest_path]]
+            else FileMovedEvent(src_path, dest_path)
+        )
+    for path in created:
+        if path in moved_destinations:
+            continue
+        events.append(DirCreatedEvent(path) if new.is_dir[new.index[path]] else FileCreatedEvent(path))
+
+    for i, path in enumerate(new.paths):
+        j = old.index.get(path)
+        if j is None:
+            continue
+        if new.is_dir[i] != old.is_dir[j]:
+            # replaced by something of a different type
+            events.append(DirDeletedEvent(path) if old.is_dir[j] else FileDeletedEvent(path))
+            events.append(DirCreatedEvent(path) if new.is_dir[i] else FileCreatedEvent(path))
+        elif new.is_dir[i]:
+            if set(new.children.get(path, [])) != set(old.children.get(path, [])):
+                events.append(DirModifiedEvent(path))
+        elif new.sizes[i] != old.sizes[j] or new.mtimes[i] != old.mtimes[j] or new.inodes[i] != old.inodes[j]:
+            events.append(FileModifiedEvent(path))
+    return events
+
+
+class SnapshotPollingEmitter(EventEmitter):
+    """Polls a watched folder on its own thread, diffing successive snapshots of it. If a snapshot folder is
+    given, the snapshot is persisted there, so that changes made while we weren't running are detected when
+    polling resumes, without first having to take a baseline snapshot."""
+
+    def __init__(self, event_queue, watch, timeout=DEFAULT_POLL_INTERVAL, path_filter=None, snapshot_dir=None):
+        super(SnapshotPollingEmitter, self).__init__(event_queue, watch, timeout)
+        self.path_filter = path_filter
+        self.snapshot_file = None
+        if snapshot_dir:
+            key = "%s:%s" % (watch.path, watch.is_recursive)
+            self.snapshot_file = os.path.join(
+                snapshot_dir,
+                "%s.json" % hashlib.sha1(key.encode("utf-8")).hexdigest()
+            )
+        self.snapshot = None
+        # set once the baseline snapshot has been taken (or loaded), on our own thread, after which all changes
+        # are picked up
+        self.baseline_taken = threading.Event()
+        self.dirty = False
+        self.last_saved = time.time()
+
+    def take_snapshot(self, previous=None):
+        return take_snapshot(
+            self.watch.path,
+            previous=previous,
+            recursive=self.watch.is_recursive,
+            path_filter=self.path_filter
+        )
+
+    def queue_events(self, timeout):
+        if self.snapshot is None:
+            # the first pass happens immediately
+            if self.snapshot_file is not None:
+                self.snapshot = Snapshot.load(self.snapshot_file, self.watch.path, self.watch.is_recursive)
+            if self.snapshot is None:
+                started = time.time()
+                self.snapshot = self.take_snapshot()
+                self.dirty = True
+                logger.debug(
+                    "Took snapshot of %d path(s) beneath %s in %.3fs",
+                    len(self.snapshot), self.watch.path, time.time() - started
+                )
+                self.baseline_taken.set()
+                return
+            self.baseline_taken.set()
+        elif self.stopped_event.wait(timeout):
+            return
+
+        snapshot = self.take_snapshot(previous=self.snapshot)
+        events = diff_snapshots(self.snapshot, snapshot)
+        self.snapshot = snapshot
+        for event in events:
+            self.queue_event(event)
+        if events:
+            self.dirty = True
+        if self.dirty and time.time() - self.last_saved > SAVE_INTERVAL:
+            self.save_snapshot()
+
+    def run(self):
+        super(SnapshotPollingEmitter, self).run()
+        if self.dirty:
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        if self.snapshot_file is None or self.snapshot is None:
+            return
+        try:
+            self.snapshot.save(self.snapshot_file)
+            self.dirty = False
+            self.last_saved = time.time()
+        except (IOError, OSError) as e:
+            logger.warning("Unable to save snapshot of %s to %s: %s", self.watch.path, self.snapshot_file, e)
+
+
+class SnapshotPollingObserver(BaseObserver):
+    """A polling observer that diffs compact, incrementally taken (and optionally persisted) snapshots of each
+    watched folder, rather than re-listing and re-stat'ing every path on each pass. Folders excluded by an event
+    handler's snapshot filter (see WatcherEventHandler) aren't walked at all."""
+
+    def __init__(self, timeout=DEFAULT_POLL_INTERVAL, snapshot_dir=None):
+        self.snapshot_dir = snapshot_dir
+        self.path_filters = dict()
+        super(SnapshotPollingObserver, self).__init__(emitter_class=self.create_emitter, timeout=timeout)
+
+    def schedule(self, event_handler, path, recursive=False):
+        self.path_filters[path] = getattr(event_handler, "snapshot_filter", None)
+        return super(SnapshotPollingObserver, self).schedule(event_handler, path, recursive)
+
+    def wait_for_baselines(self, timeout=None):
+        """Waits for all of our emitters to have taken their baseline snapshots, after which changes to the
+        watched folders are guaranteed to be picked up. Changes made before then may go unnoticed.
+
+        Returns:
+            True if all of the baselines have been taken, or False if the timeout expired first.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        for emitter in list(self.emitters):
+            remaining = max(deadline - time.time(), 0) if deadline is not None else None
+            if not emitter.baseline_taken.wait(remaining):
+                return False
+        return True
+
+    def create_emitter(self, event_queue, watch, timeout):
+        return SnapshotPollingEmitter(
+            event_queue,
+            watch,
+            timeout=timeout,
+            path_filter=self.path_filters.get(watch.path),
+            snapshot_dir=self.snapshot_dir
+        )
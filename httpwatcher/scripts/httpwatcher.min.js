@@ -1 +1,48 @@
-!function(e){function n(o){if(t[o])return t[o].exports;var c=t[o]={exports:{},id:o,loaded:!1};return e[o].call(c.exports,c,c.exports,n),c.loaded=!0,c.exports}var t={};return n.m=e,n.c=t,n.p="",n(0)}([function(e,n,t){function o(){var e=0,n=0;return"number"==typeof window.pageYOffset?(e=window.pageYOffset,n=window.pageXOffset):document.body&&(document.body.scrollLeft||document.body.scrollTop)?(e=document.body.scrollTop,n=document.body.scrollLeft):document.documentElement&&(document.documentElement.scrollLeft||document.documentElement.scrollTop)&&(e=document.documentElement.scrollTop,n=document.documentElement.scrollLeft),{x:n,y:e}}function c(){if(window.location.href==d("scroll-for")){var e=d("scroll-x"),n=d("scroll-y");window.scrollTo(e,n)}f("scroll-for"),f("scroll-x"),f("scroll-y")}function r(){var e=o();u("scroll-for",window.location.href),u("scroll-x",e.x),u("scroll-y",e.y)}function i(e){null==s&&(s=new l(e),s.onerror=function(e){console.log("WebSocket error: "+e)},s.onmessage=function(e){msg=JSON.parse(e.data),msg.command&&"reload"==msg.command&&(r(),window.location.reload(!0))},c())}var l=t(1),s=null,u=function(){},d=function(){return null},a=function(){return!1},f=function(){};"undefined"!=typeof Storage&&(u=function(e,n){window.localStorage.setItem(e,n)},d=function(e){return window.localStorage.getItem(e)},a=function(e){return null!==d(e)},f=function(e){window.localStorage.removeItem(e)}),window.httpwatcher=i},function(e,n,t){var o,c,r;!function(t,i){c=[],o=i,r="function"==typeof o?o.apply(n,c):o,!(void 0!==r&&(e.exports=r))}(this,function(){function e(n,t,o){function c(e,n){var t=document.createEvent("CustomEvent");return t.initCustomEvent(e,!1,!1,n),t}var r={debug:!1,automaticOpen:!0,reconnectInterval:1e3,maxReconnectInterval:3e4,reconnectDecay:1.5,timeoutInterval:2e3,maxReconnectAttempts:null};o||(o={});for(var i in r)"undefined"!=typeof o[i]?this[i]=o[i]:this[i]=r[i];this.url=n,this.reconnectAttempts=0,this.readyState=WebSocket.CONNECTING,this.protocol=null;var l,s=this,u=!1,d=!1,a=document.createElement("div");a.addEventListener("open",function(e){s.onopen(e)}),a.addEventListener("close",function(e){s.onclose(e)}),a.addEventListener("connecting",function(e){s.onconnecting(e)}),a.addEventListener("message",function(e){s.onmessage(e)}),a.addEventListener("error",function(e){s.onerror(e)}),this.addEventListener=a.addEventListener.bind(a),this.removeEventListener=a.removeEventListener.bind(a),this.dispatchEvent=a.dispatchEvent.bind(a),this.open=function(n){if(l=new WebSocket(s.url,t||[]),n){if(this.maxReconnectAttempts&&this.reconnectAttempts>this.maxReconnectAttempts)return}else a.dispatchEvent(c("connecting")),this.reconnectAttempts=0;(s.debug||e.debugAll)&&console.debug("ReconnectingWebSocket","attempt-connect",s.url);var o=l,r=setTimeout(function(){(s.debug||e.debugAll)&&console.debug("ReconnectingWebSocket","connection-timeout",s.url),d=!0,o.close(),d=!1},s.timeoutInterval);l.onopen=function(t){clearTimeout(r),(s.debug||e.debugAll)&&console.debug("ReconnectingWebSocket","onopen",s.url),s.protocol=l.protocol,s.readyState=WebSocket.OPEN,s.reconnectAttempts=0;var o=c("open");o.isReconnect=n,n=!1,a.dispatchEvent(o)},l.onclose=function(t){if(clearTimeout(r),l=null,u)s.readyState=WebSocket.CLOSED,a.dispatchEvent(c("close"));else{s.readyState=WebSocket.CONNECTING;var o=c("connecting");o.code=t.code,o.reason=t.reason,o.wasClean=t.wasClean,a.dispatchEvent(o),n||d||((s.debug||e.debugAll)&&console.debug("ReconnectingWebSocket","onclose",s.url),a.dispatchEvent(c("close")));var r=s.reconnectInterval*Math.pow(s.reconnectDecay,s.reconnectAttempts);setTimeout(function(){s.reconnectAttempts++,s.open(!0)},r>s.maxReconnectInterval?s.maxReconnectInterval:r)}},l.onmessage=function(n){(s.debug||e.debugAll)&&console.debug("ReconnectingWebSocket","onmessage",s.url,n.data);var t=c("message");t.data=n.data,a.dispatchEvent(t)},l.onerror=function(n){(s.debug||e.debugAll)&&console.debug("ReconnectingWebSocket","onerror",s.url,n),a.dispatchEvent(c("error"))}},1==this.automaticOpen&&this.open(!1),this.send=function(n){if(l)return(s.debug||e.debugAll)&&console.debug("ReconnectingWebSocket","send",s.url,n),l.send(n);throw"INVALID_STATE_ERR : Pausing to reconnect websocket"},this.close=function(e,n){"undefined"==typeof e&&(e=1e3),u=!0,l&&l.close(e,n)},this.refresh=function(){l&&l.close()}}if("WebSocket"in window)return e.prototype.onopen=function(e){},e.prototype.onclose=function(e){},e.prototype.onconnecting=function(e){},e.prototype.onmessage=function(e){},e.prototype.onerror=function(e){},e.debugAll=!1,e.CONNECTING=WebSocket.CONNECTING,e.OPEN=WebSocket.OPEN,e.CLOSING=WebSocket.CLOSING,e.CLOSED=WebSocket.CLOSED,e})}]);
\ No newline at end of file
+(function(modules){var installedModules={};function __webpack_require__(moduleId){if(installedModules[moduleId])
+return installedModules[moduleId].exports;var module=installedModules[moduleId]={exports:{},id:moduleId,loaded:false};modules[moduleId].call(module.exports,module,module.exports,__webpack_require__);module.loaded=true;return module.exports;}
+__webpack_require__.m=modules;__webpack_require__.c=installedModules;__webpack_require__.p="";return __webpack_require__(0);})
+([function(module,exports,__webpack_require__){var ReconnectingWebSocket=__webpack_require__(1);var connection=null;var storageSet=function(){};var storageGet=function(){return null;};var storageHas=function(){return false;};var storageClear=function(){};if(typeof(Storage)!=="undefined"){storageSet=function(k,v){window.localStorage.setItem(k,v);};storageGet=function(k){return window.localStorage.getItem(k);};storageHas=function(k){return storageGet(k)!==null;};storageClear=function(k){window.localStorage.removeItem(k);}}
+function getWindowScrollPosition(){var top=0,left=0;if(typeof(window.pageYOffset)=='number'){top=window.pageYOffset;left=window.pageXOffset;}else if(document.body&&(document.body.scrollLeft||document.body.scrollTop)){top=document.body.scrollTop;left=document.body.scrollLeft;}else if(document.documentElement&&(document.documentElement.scrollLeft||document.documentElement.scrollTop)){top=document.documentElement.scrollTop;left=document.documentElement.scrollLeft;}
+return{x:left,y:top};}
+function restoreWindowScrollPosition(){if(window.location.href==storageGet('scroll-for')){var x=storageGet('scroll-x'),y=storageGet('scroll-y');window.scrollTo(x,y);}
+storageClear('scroll-for');storageClear('scroll-x');storageClear('scroll-y');}
+function saveWindowScrollPosition(){var coords=getWindowScrollPosition();storageSet('scroll-for',window.location.href);storageSet('scroll-x',coords.x);storageSet('scroll-y',coords.y);}
+function getResourcePath(url){if(typeof(url)!=='string'||url.length==0){return null;}
+var a=document.createElement('a');a.href=url;if(a.host&&a.host!=window.location.host){return null;}
+var path=(a.pathname.charAt(0)=='/')?a.pathname:'/'+a.pathname;try{return decodeURIComponent(path);}catch(e){return path;}}
+function getLoadedResourcePaths(){var paths={};var addPath=function(url){var path=getResourcePath(url);if(path!==null){paths[path]=true;}};var i;addPath(window.location.href);if(window.performance&&typeof(window.performance.getEntriesByType)=='function'){var entries=window.performance.getEntriesByType('resource');for(i=0;i<entries.length;i++){addPath(entries[i].name);}}
+var elements=document.querySelectorAll('link[href], script[src], img[src], source[src], iframe[src], video[src], audio[src], embed[src]');for(i=0;i<elements.length;i++){addPath(elements[i].getAttribute('href')||elements[i].getAttribute('src'));}
+return paths;}
+function shouldReload(msg){if(!msg.paths){return true;}
+var loaded=getLoadedResourcePaths();var i,path;for(i=0;i<msg.paths.length;i++){if(loaded[msg.paths[i]]){return true;}}
+for(i=0;i<(msg.folders||[]).length;i++){for(path in loaded){if(loaded.hasOwnProperty(path)&&path.indexOf(msg.folders[i])==0){return true;}}}
+return false;}
+function isHotSwappable(contentType){return typeof(contentType)=='string'&&(contentType=='text/css'||contentType.indexOf('image/')==0);}
+function cacheBust(url){var hashIndex=url.indexOf('#');var hash=(hashIndex>=0)?url.substring(hashIndex):'';var base=(hashIndex>=0)?url.substring(0,hashIndex):url;base=base.replace(/([?&])httpwatcher=\d+(&|$)/,'$1').replace(/[?&]$/,'');return base+(base.indexOf('?')>=0?'&':'?')+'httpwatcher='+new Date().getTime()+hash;}
+function swapStylesheet(link){var replacement=link.cloneNode(false);replacement.setAttribute('href',cacheBust(link.getAttribute('href')));replacement.onload=replacement.onerror=function(){if(link.parentNode){link.parentNode.removeChild(link);}};link.parentNode.insertBefore(replacement,link.nextSibling);}
+function swapImage(img){img.setAttribute('src',cacheBust(img.getAttribute('src')));}
+function hotSwap(msg){if(!msg.hot_swap||!msg.paths||(msg.folders&&msg.folders.length>0)){return false;}
+var loaded=getLoadedResourcePaths();var contentTypes=msg.content_types||{};var changed={},i,path;for(i=0;i<msg.paths.length;i++){path=msg.paths[i];if(loaded[path]){if(!isHotSwappable(contentTypes[path])){return false;}
+changed[path]=true;}}
+var swaps=[],swapped={};var findSwaps=function(selector,attr,swap){var elements=document.querySelectorAll(selector);for(var j=0;j<elements.length;j++){var elementPath=getResourcePath(elements[j].getAttribute(attr));if(elementPath!==null&&changed[elementPath]){swaps.push({element:elements[j],swap:swap});swapped[elementPath]=true;}}};findSwaps('link[rel~="stylesheet"][href]','href',swapStylesheet);findSwaps('img[src]','src',swapImage);for(path in changed){if(changed.hasOwnProperty(path)&&!swapped[path]){return false;}}
+for(i=0;i<swaps.length;i++){swaps[i].swap(swaps[i].element);}
+return true;}
+function httpwatcher(webSocketUrl){if(connection==null){connection=new ReconnectingWebSocket(webSocketUrl);connection.onerror=function(e){console.log("WebSocket error: "+e);};connection.onmessage=function(m){msg=JSON.parse(m.data);if(msg.command&&msg.command=="reload"&&shouldReload(msg)&&!hotSwap(msg)){saveWindowScrollPosition();window.location.reload(true);}};restoreWindowScrollPosition();}}
+window.httpwatcher=httpwatcher;},function(module,exports,__webpack_require__){var __WEBPACK_AMD_DEFINE_FACTORY__,__WEBPACK_AMD_DEFINE_ARRAY__,__WEBPACK_AMD_DEFINE_RESULT__;(function(global,factory){if(true){!(__WEBPACK_AMD_DEFINE_ARRAY__=[],__WEBPACK_AMD_DEFINE_FACTORY__=(factory),__WEBPACK_AMD_DEFINE_RESULT__=(typeof __WEBPACK_AMD_DEFINE_FACTORY__==='function'?(__WEBPACK_AMD_DEFINE_FACTORY__.apply(exports,__WEBPACK_AMD_DEFINE_ARRAY__)):__WEBPACK_AMD_DEFINE_FACTORY__),__WEBPACK_AMD_DEFINE_RESULT__!==undefined&&(module.exports=__WEBPACK_AMD_DEFINE_RESULT__));}else if(typeof module!=='undefined'&&module.exports){module.exports=factory();}else{global.ReconnectingWebSocket=factory();}})(this,function(){if(!('WebSocket'in window)){return;}
+function ReconnectingWebSocket(url,protocols,options){var settings={debug:false,automaticOpen:true,reconnectInterval:1000,maxReconnectInterval:30000,reconnectDecay:1.5,timeoutInterval:2000,maxReconnectAttempts:null}
+if(!options){options={};}
+for(var key in settings){if(typeof options[key]!=='undefined'){this[key]=options[key];}else{this[key]=settings[key];}}
+this.url=url;this.reconnectAttempts=0;this.readyState=WebSocket.CONNECTING;this.protocol=null;var self=this;var ws;var forcedClose=false;var timedOut=false;var eventTarget=document.createElement('div');eventTarget.addEventListener('open',function(event){self.onopen(event);});eventTarget.addEventListener('close',function(event){self.onclose(event);});eventTarget.addEventListener('connecting',function(event){self.onconnecting(event);});eventTarget.addEventListener('message',function(event){self.onmessage(event);});eventTarget.addEventListener('error',function(event){self.onerror(event);});this.addEventListener=eventTarget.addEventListener.bind(eventTarget);this.removeEventListener=eventTarget.removeEventListener.bind(eventTarget);this.dispatchEvent=eventTarget.dispatchEvent.bind(eventTarget);function generateEvent(s,args){var evt=document.createEvent("CustomEvent");evt.initCustomEvent(s,false,false,args);return evt;};this.open=function(reconnectAttempt){ws=new WebSocket(self.url,protocols||[]);if(reconnectAttempt){if(this.maxReconnectAttempts&&this.reconnectAttempts>this.maxReconnectAttempts){return;}}else{eventTarget.dispatchEvent(generateEvent('connecting'));this.reconnectAttempts=0;}
+if(self.debug||ReconnectingWebSocket.debugAll){console.debug('ReconnectingWebSocket','attempt-connect',self.url);}
+var localWs=ws;var timeout=setTimeout(function(){if(self.debug||ReconnectingWebSocket.debugAll){console.debug('ReconnectingWebSocket','connection-timeout',self.url);}
+timedOut=true;localWs.close();timedOut=false;},self.timeoutInterval);ws.onopen=function(event){clearTimeout(timeout);if(self.debug||ReconnectingWebSocket.debugAll){console.debug('ReconnectingWebSocket','onopen',self.url);}
+self.protocol=ws.protocol;self.readyState=WebSocket.OPEN;self.reconnectAttempts=0;var e=generateEvent('open');e.isReconnect=reconnectAttempt;reconnectAttempt=false;eventTarget.dispatchEvent(e);};ws.onclose=function(event){clearTimeout(timeout);ws=null;if(forcedClose){self.readyState=WebSocket.CLOSED;eventTarget.dispatchEvent(generateEvent('close'));}else{self.readyState=WebSocket.CONNECTING;var e=generateEvent('connecting');e.code=event.code;e.reason=event.reason;e.wasClean=event.wasClean;eventTarget.dispatchEvent(e);if(!reconnectAttempt&&!timedOut){if(self.debug||ReconnectingWebSocket.debugAll){console.debug('ReconnectingWebSocket','onclose',self.url);}
+eventTarget.dispatchEvent(generateEvent('close'));}
+var timeout=self.reconnectInterval*Math.pow(self.reconnectDecay,self.reconnectAttempts);setTimeout(function(){self.reconnectAttempts++;self.open(true);},timeout>self.maxReconnectInterval?self.maxReconnectInterval:timeout);}};ws.onmessage=function(event){if(self.debug||ReconnectingWebSocket.debugAll){console.debug('ReconnectingWebSocket','onmessage',self.url,event.data);}
+var e=generateEvent('message');e.data=event.data;eventTarget.dispatchEvent(e);};ws.onerror=function(event){if(self.debug||ReconnectingWebSocket.debugAll){console.debug('ReconnectingWebSocket','onerror',self.url,event);}
+eventTarget.dispatchEvent(generateEvent('error'));};}
+if(this.automaticOpen==true){this.open(false);}
+this.send=function(data){if(ws){if(self.debug||ReconnectingWebSocket.debugAll){console.debug('ReconnectingWebSocket','send',self.url,data);}
+return ws.send(data);}else{throw'INVALID_STATE_ERR : Pausing to reconnect websocket';}};this.close=function(code,reason){if(typeof code=='undefined'){code=1000;}
+forcedClose=true;if(ws){ws.close(code,reason);}};this.refresh=function(){if(ws){ws.close();}};}
+ReconnectingWebSocket.prototype.onopen=function(event){};ReconnectingWebSocket.prototype.onclose=function(event){};ReconnectingWebSocket.prototype.onconnecting=function(event){};ReconnectingWebSocket.prototype.onmessage=function(event){};ReconnectingWebSocket.prototype.onerror=function(event){};ReconnectingWebSocket.debugAll=false;ReconnectingWebSocket.CONNECTING=WebSocket.CONNECTING;ReconnectingWebSocket.OPEN=WebSocket.OPEN;ReconnectingWebSocket.CLOSING=WebSocket.CLOSING;ReconnectingWebSocket.CLOSED=WebSocket.CLOSED;return ReconnectingWebSocket;});}]);
\ No newline at end of file
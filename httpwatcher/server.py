@@ -1,58 +1,173 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+from past.builtins import basestring
 
 import os.path
 import pkg_resources
-import mimetypes
 import datetime
+import email.utils
+import errno
+import hashlib
+import inspect
+import select
 import stat
+import time
 import webbrowser
+from concurrent.futures import ThreadPoolExecutor
 
 from tornado import gen
+from tornado.concurrent import dummy_executor
+import tornado.escape
+import tornado.httpserver
+import tornado.netutil
 import tornado.web
 import tornado.websocket
 import tornado.iostream
 import tornado.ioloop
 
-from httpwatcher.filesystem import FileSystemWatcher
+from httpwatcher.filesystem import FileSystemWatcher, ChangeSet, DEFAULT_WATCHER_INTERVAL, DEFAULT_WATCHER_MAX_WAIT, \
+    DEFAULT_MAX_PENDING_EVENTS
+from httpwatcher.backends import BACKEND_NATIVE
+from httpwatcher.polling import DEFAULT_POLL_INTERVAL
+from httpwatcher.cache import ContentCache, PathCache, ResolvedPath, DEFAULT_CONTENT_CACHE_SIZE
+from httpwatcher.injection import ScriptInjector
+from httpwatcher.mime import ContentTypeMap
+from httpwatcher.builds import BuildPipeline, BuildResult, DEFAULT_BUILD_CONCURRENCY
+from httpwatcher.workers import fork_workers, describe_exit_status, DEFAULT_WORKER_CHECK_INTERVAL
+from httpwatcher.metrics import ServerMetrics, PROMETHEUS_CONTENT_TYPE
+from httpwatcher import compression
 from httpwatcher.errors import MissingFolderError
 
 import logging
 logger = logging.getLogger(__name__)
-mimetypes.init()
-
 __all__ = [
     "HttpWatcherServer"
 ]
 
+DEFAULT_STREAM_THRESHOLD = 4 * 1024 * 1024
+# clients with more than this many bytes of messages still waiting to be sent to them are disconnected
+DEFAULT_MAX_CLIENT_BUFFER = 1024 * 1024
+# the number of threads on which to access the file system while serving requests
+DEFAULT_IO_WORKERS = 8
+# the number of files that can be sent using sendfile() at once
+DEFAULT_SENDFILE_WORKERS = 4
+# how long (in seconds) to wait for a client to accept more data before giving up on a sendfile() transfer
+SENDFILE_TIMEOUT = 60.0
+# sendfile() errors indicating that it isn't supported for the given file/socket
+SENDFILE_UNSUPPORTED_ERRNOS = (errno.EINVAL, errno.ENOSYS, getattr(errno, "EOPNOTSUPP", errno.EINVAL))
+
+# how often (in seconds) to ping WebSocket clients, so that dead connections can be detected and closed
+DEFAULT_WEBSOCKET_PING_INTERVAL = 30.0
+DEFAULT_CONTENT_TYPE_MAP = ContentTypeMap()
+
 
 class HttpWatcherServer(tornado.web.Application):
 
     def __init__(self, static_root, watch_paths=None, on_reload=None, host="localhost", port=5555,
-                 server_base_path="/", watcher_interval=1.0, recursive=True, open_browser=False,
-                 open_browser_delay=1.0, **kwargs):
+                 server_base_path="/", watcher_interval=DEFAULT_WATCHER_INTERVAL, recursive=True, open_browser=False,
+                 open_browser_delay=1.0, content_cache_size=DEFAULT_CONTENT_CACHE_SIZE,
+                 stream_threshold=DEFAULT_STREAM_THRESHOLD, compression=True, content_types=None, hot_swap=True,
+                 watcher_max_wait=DEFAULT_WATCHER_MAX_WAIT, watch_include=None, watch_exclude=None,
+                 watch_gitignore=False, verify_changes=False, watcher_backend=BACKEND_NATIVE,
+                 watcher_poll_interval=DEFAULT_POLL_INTERVAL, watcher_snapshot_dir=None, on_reload_timeout=None,
+                 on_reload_blocking=False, on_reload_changes=False, build_rules=None,
+                 build_concurrency=DEFAULT_BUILD_CONCURRENCY,
+                 max_client_buffer=DEFAULT_MAX_CLIENT_BUFFER, websocket_ping_interval=DEFAULT_WEBSOCKET_PING_INTERVAL,
+                 websocket_ping_timeout=None, max_clients=None, websocket_compression=False, workers=1, sendfile=True,
+                 io_workers=DEFAULT_IO_WORKERS, watcher_max_events=DEFAULT_MAX_PENDING_EVENTS, metrics=False,
+                 **kwargs):
         """Constructor for the HTTP watcher server.
 
         Args:
             static_root: The root path from which to serve static files.
             watch_paths: One or more paths to watch for changes. If not specified, it will be assumed that the
                 static root is to be monitored for changes.
-            on_reload: An optional callback to call prior to triggering the reload operation in connected clients.
+            on_reload: An optional callback to call prior to triggering the reload operation in connected clients
+                (e.g. to rebuild the site). It may be a coroutine (or return a Future), in which case clients
+                are only reloaded once it has completed. If it raises an exception, clients aren't reloaded.
             host: The host IP address to which to bind.
             port: The port to which to bind.
             server_base_path: If a non-standard base path is required for the server's static root, specify it here.
-            watcher_interval: The maximum refresh rate of the watcher server, in seconds.
+            watcher_interval: The period of quiet (in seconds) to wait for after the last file system change
+                before reloading, so that a burst of changes (e.g. a build) results in a single reload.
             recursive: Should the watch paths be monitored recursively?
             open_browser: Should this watcher server attempt to automatically open the user's default web browser
                 at the root of the project?
             open_browser_delay: The number of seconds to wait until attempting to open the user's browser.
+            content_cache_size: The maximum number of bytes of file content to keep cached in memory between
+                requests. Set to 0 to disable content caching.
+            stream_threshold: Files larger than this number of bytes (other than HTML files) are streamed to
+                clients in chunks instead of being read into memory.
+            compression: Should responses be compressed (gzip, or brotli if available) for clients that accept
+                compressed content? Precompressed ".br"/".gz" siblings of requested files are served if present.
+            content_types: An optional dictionary mapping file name extensions (e.g. ".scss") to the content
+                types with which to serve them, extending/overriding the built-in table.
+            hot_swap: Should changed stylesheets and images be swapped in place in connected clients, instead of
+                reloading the whole page?
+            watcher_max_wait: The maximum time (in seconds) for which to delay a reload while file system
+                changes keep arriving.
+            watch_include: An optional list of glob patterns. If given, only changes to files matching at least
+                one of them trigger a reload.
+            watch_exclude: An optional list of glob patterns of paths whose changes are to be ignored, in addition
+                to version control folders, node_modules, editor swap files, etc. (see PathFilter).
+            watch_gitignore: Should changes to paths ignored by each watch path's .gitignore file be ignored?
+            verify_changes: Should modified files be hashed (in the background) to verify that their contents
+                have actually changed before reloading?
+            watcher_backend: How to watch for changes: "native" (the operating system's file system
+                notifications), "polling" or "hybrid" (native, except for watch paths on network file systems,
+                which are polled). Paths that can't be watched natively due to watch limits are always polled.
+            watcher_poll_interval: The interval (in seconds) at which to poll watch paths that are being polled.
+            watcher_snapshot_dir: An optional folder in which to persist snapshots of polled watch paths, so that
+                they needn't be walked in full again when the server restarts.
+            on_reload_timeout: The maximum time (in seconds) for which to wait for the on_reload callback to
+                complete. If it takes any longer, clients aren't reloaded.
+            on_reload_blocking: Should the on_reload callback be run on a worker thread, instead of on the I/O
+                loop? Set this for callbacks that block (e.g. by running a build synchronously), so that the
+                server keeps serving requests in the meantime.
+            on_reload_changes: Should the on_reload callback be passed the ChangeSet of file system changes (or
+                None if unknown) as its only argument? Otherwise it's called without any arguments.
+            build_rules: An optional list of BuildRules, whose commands are run for matching changed source files
+                before the on_reload callback is called. If any of them fail, clients aren't reloaded.
+            build_concurrency: The maximum number of build commands to run at once.
+            max_client_buffer: WebSocket clients with more than this many bytes of messages still waiting to be
+                sent to them (e.g. because they're stalled on a bad connection) are disconnected when the next
+                reload is broadcast, rather than having even more queued up for them.
+            websocket_ping_interval: How often (in seconds) to ping WebSocket clients. Clients that don't respond
+                in time (e.g. because their laptop went to sleep) are disconnected. Set to 0 to disable pings.
+            websocket_ping_timeout: How long (in seconds) to wait for a response to a ping before disconnecting a
+                client. Defaults to three times the ping interval (but at least 30 seconds).
+            max_clients: An optional maximum number of connected WebSocket clients. When a new client connects
+                and there are already this many, the one we've heard from least recently is disconnected.
+            websocket_compression: Should messages to WebSocket clients be compressed (permessage-deflate) for
+                clients that support it?
+            workers: The number of processes from which to serve requests. If more than 1, listen() forks this many
+                worker processes, which share the listening socket, while the original (master) process watches for
+                changes and sends them to the workers to reload their clients. Only supported on platforms with
+                fork(), and listen() must then be called before the I/O loop is created.
+            sendfile: Should files that don't need to be modified (i.e. other than HTML files and content that is
+                compressed on the fly) and aren't held in memory be sent using the operating system's sendfile()
+                call, where available? Otherwise they're read and sent in chunks.
+            io_workers: The number of threads on which to access the file system (to resolve, stat and read files)
+                while serving requests, so that slow disks or network file systems don't hold up other requests
+                and reloads. Set to 0 to access the file system on the I/O loop's thread.
+            watcher_max_events: The maximum number of raw file system events to keep track of between reloads.
+                If more than this arrive at once, they're discarded, all cached content is evicted and clients
+                are told to reload everything.
+            metrics: Should statistics about requests, caches, the file system watcher and broadcasts be
+                collected, and served from /httpwatcher/metrics (in Prometheus' text format, or as JSON)? In
+                multi-process mode, each worker process serves its own statistics, and the file system watcher's
+                (which runs in the master process) aren't available.
         """
         self.static_root = os.path.abspath(static_root)
         if not os.path.exists(self.static_root) or not os.path.isdir(self.static_root):
             raise MissingFolderError(self.static_root)
 
-        self.watch_paths = watch_paths if watch_paths is not None else [static_root]
+        if watch_paths is None:
+            watch_paths = [static_root]
+        elif isinstance(watch_paths, basestring):
+            watch_paths = [watch_paths]
+        self.watch_paths = [os.path.abspath(path) for path in watch_paths]
 
         if on_reload is not None:
             if not callable(on_reload):
@@ -60,6 +175,18 @@ class HttpWatcherServer(tornado.web.Application):
                     "If a callback is supplied for HttpWatcherServer, it must be callable"
                 )
         self.on_reload = on_reload
+        self.on_reload_timeout = on_reload_timeout
+        self.on_reload_changes = on_reload_changes
+        self.reload_executor = ThreadPoolExecutor(max_workers=1) if on_reload_blocking else None
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers) if io_workers else None
+        # sendfile() blocks, as it's only able to wait for the (non-blocking) client socket using select()
+        self.sendfile_executor = ThreadPoolExecutor(max_workers=DEFAULT_SENDFILE_WORKERS) \
+            if sendfile and hasattr(os, "sendfile") else None
+        self.build_pipeline = BuildPipeline(build_rules, max_concurrency=build_concurrency) if build_rules else None
+        # changes that have arrived while the on_reload callback was running, which are coalesced into a single
+        # subsequent run
+        self.pending_reloads = []
+        self.reload_running = False
 
         self.host = host
         self.port = port
@@ -67,9 +194,11 @@ class HttpWatcherServer(tornado.web.Application):
         self.server_base_path = ("/%s/" % self.server_base_path) \
             if self.server_base_path else "/"
         self.watcher_interval = watcher_interval
+        self.watcher_max_wait = watcher_max_wait
         self.recursive = recursive
         self.open_browser = open_browser
         self.open_browser_delay = open_browser_delay
+        self.hot_swap = hot_swap
         self.httpwatcher_js_path = os.path.abspath(
             os.path.realpath(
                 pkg_resources.resource_filename(
@@ -79,36 +208,89 @@ class HttpWatcherServer(tornado.web.Application):
             )
         )
         logger.debug("httpwatcher.min.js path: %s", self.httpwatcher_js_path)
+        self.httpwatcher_js = HttpWatcherScript(self.httpwatcher_js_path)
+        self.content_type_map = ContentTypeMap(content_types) if content_types else DEFAULT_CONTENT_TYPE_MAP
+        self.content_cache = ContentCache(max_size=content_cache_size) if content_cache_size else None
+        # file system lookups can only be cached if we'll be notified of changes to the static root
+        self.path_cache = PathCache() if self.is_watched(self.static_root) else None
+        self.metrics = ServerMetrics(self) if metrics else None
 
         handlers = [
             (r"/httpwatcher.min.js", HttpWatcherStaticScriptHandler, {
-                "path": self.httpwatcher_js_path
+                "script": self.httpwatcher_js
             }),
             (r"/httpwatcher", HttpWatcherWebSocketHandler, {
                 "watcher_server": self
             }),
+        ]
+        if self.metrics is not None:
+            handlers.append((r"/httpwatcher/metrics", HttpWatcherMetricsHandler, {
+                "metrics": self.metrics
+            }))
+        handlers += [
             (r"%s(.*)" % self.server_base_path, HttpWatcherStaticFileHandler, {
                 "path": self.static_root,
-                "httpwatcher_script_url": "http://%s:%d/httpwatcher.min.js" % (
-                    self.host, self.port
+                "httpwatcher_script_url": "http://%s:%d/httpwatcher.min.js?v=%s" % (
+                    self.host, self.port, self.httpwatcher_js.version
                 ),
                 "websocket_url": "ws://%s:%d/httpwatcher" % (self.host, self.port),
-                "server_base_path": self.server_base_path
+                "server_base_path": self.server_base_path,
+                "content_cache": self.content_cache,
+                "path_cache": self.path_cache,
+                "content_type_map": self.content_type_map,
+                "stream_threshold": stream_threshold,
+                "compression": compression,
+                "sendfile_executor": self.sendfile_executor,
+                "io_executor": self.io_executor
             })
         ]
+        kwargs.setdefault("websocket_ping_interval", websocket_ping_interval)
+        kwargs.setdefault("websocket_ping_timeout", websocket_ping_timeout)
         super(HttpWatcherServer, self).__init__(handlers, **kwargs)
         # create our watcher instance for the watch path
         self.watcher = FileSystemWatcher(
             self.watch_paths,
             on_changed=self.trigger_reload,
             interval=self.watcher_interval,
-            recursive=recursive
+            recursive=recursive,
+            max_wait=self.watcher_max_wait,
+            include=watch_include,
+            exclude=watch_exclude,
+            gitignore=watch_gitignore,
+            verify_changes=verify_changes,
+            backend=watcher_backend,
+            poll_interval=watcher_poll_interval,
+            snapshot_dir=watcher_snapshot_dir,
+            max_pending_events=watcher_max_events,
+            # our caches have to be kept up to date even for the files whose changes don't cause reloads, and
+            # mustn't go on serving files that are changing while we wait for the changes to settle
+            on_excluded=self.invalidate_changed_paths,
+            on_touched=self.invalidate_changed_paths
         )
         self.connected_clients = set()
+        self.max_client_buffer = max_client_buffer
+        self.max_clients = max_clients
+        self.websocket_compression = websocket_compression
+        self.workers = workers
+        # in multi-process mode, the number of this worker process (or None in the master process), and the
+        # channel over which the master sends changes to the workers
+        self.worker_id = None
+        self.worker_channel = None
+        self.worker_check_callback = None
+
+    @property
+    def is_master(self):
+        """Are we the master process of a multi-process server (which has no clients or caches of its own)?"""
+        return self.worker_channel is not None and self.worker_id is None
 
     def listen(self, **kwargs):
-        super(HttpWatcherServer, self).listen(self.port, address=self.host, **kwargs)
-        self.watcher.start()
+        if self.workers > 1:
+            self.listen_workers(**kwargs)
+            if self.worker_id is not None:
+                return
+        else:
+            super(HttpWatcherServer, self).listen(self.port, address=self.host, **kwargs)
+            self.watcher.start()
         logger.info(
             "Started HTTP watcher server at http://%s:%d%s",
             self.host, self.port, self.server_base_path
@@ -120,6 +302,53 @@ class HttpWatcherServer(tornado.web.Application):
                 self.trigger_browser_open
             )
 
+    def listen_workers(self, **kwargs):
+        """Binds our listening sockets and forks our worker processes. Workers serve requests from the shared
+        sockets, while the master process watches for changes."""
+        sockets = tornado.netutil.bind_sockets(self.port, address=self.host)
+        self.worker_id, self.worker_channel = fork_workers(self.workers)
+        if self.worker_id is not None:
+            tornado.httpserver.HTTPServer(self, **kwargs).add_sockets(sockets)
+            self.worker_channel.receive(self.on_master_message).add_done_callback(self.on_master_closed)
+            logger.debug("Worker process %d (PID %d) serving requests", self.worker_id, os.getpid())
+            return
+
+        # the master only watches for changes
+        for sock in sockets:
+            sock.close()
+        self.worker_channel.start()
+        self.worker_check_callback = tornado.ioloop.PeriodicCallback(
+            self.check_workers,
+            DEFAULT_WORKER_CHECK_INTERVAL * 1000
+        )
+        self.worker_check_callback.start()
+        self.watcher.start()
+        logger.info("Serving requests from %d worker processes", self.workers)
+
+    def check_workers(self):
+        """Reaps any of our worker processes that have exited (in the master process). Workers only exit by
+        themselves if something went wrong, in which case we shut down (along with the remaining workers) rather
+        than carrying on with fewer of them."""
+        exited = self.worker_channel.reap()
+        if not exited:
+            return
+        for pid, status in exited:
+            logger.error("Worker process (PID %d) exited unexpectedly (%s)", pid, describe_exit_status(status))
+        self.shutdown()
+        tornado.ioloop.IOLoop.current().stop()
+
+    def on_master_message(self, msg):
+        """Handles a message from the master process (in a worker process)."""
+        if "invalidate" in msg:
+            paths = msg["invalidate"]
+            self.invalidate_paths([(path, recursive) for path, recursive in paths] if paths is not None else None)
+        if "broadcast" in msg:
+            self.broadcast_to_clients(msg["broadcast"])
+
+    def on_master_closed(self, future):
+        logger.debug("Master process has gone away - stopping worker process %d", self.worker_id)
+        tornado.ioloop.IOLoop.current().stop()
+
     @gen.coroutine
     def trigger_browser_open(self):
         url = "http://%s:%d%s" % (self.host, self.port, self.server_base_path)
@@ -134,9 +363,38 @@ class HttpWatcherServer(tornado.web.Application):
         terminates."""
         logger.info("Shutting down HTTP watcher server...")
         self.watcher.shutdown()
+        if self.worker_check_callback is not None:
+            self.worker_check_callback.stop()
+        if self.worker_channel is not None:
+            self.worker_channel.close()
+        if self.reload_executor is not None:
+            self.reload_executor.shutdown(wait=False)
+        if self.sendfile_executor is not None:
+            self.sendfile_executor.shutdown(wait=False)
+        if self.io_executor is not None:
+            self.io_executor.shutdown(wait=False)
         logger.info("HTTP watcher server terminated")
 
+    def log_request(self, handler):
+        super(HttpWatcherServer, self).log_request(handler)
+        if self.metrics is not None:
+            self.metrics.record_request(
+                getattr(handler, "metrics_route", "other"),
+                handler.get_status(),
+                handler.request.request_time(),
+                bytes_sent=getattr(handler, "bytes_sent", 0)
+            )
+
     def register_client(self, client):
+        if self.max_clients is not None:
+            while self.connected_clients and len(self.connected_clients) >= self.max_clients:
+                stalest = min(self.connected_clients, key=lambda c: c.last_seen)
+                logger.info(
+                    "Too many WebSocket clients (%d) - disconnecting the one last heard from %.0fs ago",
+                    len(self.connected_clients), time.time() - stalest.last_seen
+                )
+                self.deregister_client(stalest)
+                stalest.close()
         self.connected_clients.add(client)
 
     def deregister_client(self, client):
@@ -144,29 +402,329 @@ class HttpWatcherServer(tornado.web.Application):
             self.connected_clients.remove(client)
 
     def broadcast_to_clients(self, msg):
+        """Sends the given message to all connected clients at once, without waiting for any of them to receive
+        it. Clients that have been disconnected, or that still haven't received more than max_client_buffer bytes
+        of previous messages, are dropped."""
+        if self.is_master:
+            # we're the master: our workers have the clients
+            logger.debug("Sending message to %d worker process(es)", len(self.worker_channel))
+            self.worker_channel.send({"broadcast": msg})
+            return
         logger.debug(
             "Broadcasting message to %d connected client(s)",
             len(self.connected_clients)
         )
-        for client in self.connected_clients:
-            client.write_message(msg)
+        started = time.time()
+        if isinstance(msg, dict):
+            # encode the message once, rather than once per client
+            msg = tornado.escape.utf8(tornado.escape.json_encode(msg))
+        # clients may disconnect (and deregister themselves) while we're busy
+        for client in list(self.connected_clients):
+            buffered = client.get_write_buffer_size()
+            if buffered > self.max_client_buffer:
+                logger.warning(
+                    "Disconnecting WebSocket client, which still has %d bytes of messages waiting to be sent to it",
+                    buffered
+                )
+                self.deregister_client(client)
+                client.close()
+                continue
+            try:
+                future = client.write_message(msg)
+            except (tornado.websocket.WebSocketClosedError, tornado.iostream.StreamClosedError):
+                logger.debug("WebSocket client disconnected before the message could be sent to it")
+                self.deregister_client(client)
+                continue
+            if future is not None:
+                future.add_done_callback(lambda f, client=client: self.on_client_write_done(client, f))
+        if self.metrics is not None:
+            self.metrics.record_broadcast(time.time() - started)
+
+    def on_client_write_done(self, client, future):
+        if future.exception() is not None:
+            logger.debug("Failed to send message to WebSocket client: %s", future.exception())
+            self.deregister_client(client)
+
+    def is_watched(self, path):
+        """Checks whether changes to the given folder (and everything beneath it) will be picked up by the
+        file system watcher."""
+        path = os.path.abspath(path)
+        for watch_path in self.watch_paths:
+            if path == watch_path:
+                return self.recursive
+            if self.recursive and path.startswith(watch_path.rstrip(os.sep) + os.sep):
+                return True
+        return False
+
+    def invalidate_caches(self, events):
+        """Evicts cached content and file system lookups for all of the files affected by the given file
+        system events (or everything, if the events are None)."""
+        if events is None:
+            if self.is_master:
+                self.worker_channel.send({"invalidate": None})
+            else:
+                self.invalidate_paths(None)
+            return
+        paths = []
+        for event in events:
+            for path in [p for p in [event.src_path, getattr(event, "dest_path", None)] if p]:
+                paths.append((os.path.abspath(path), event.is_directory))
+        self.invalidate_changed_paths(paths)
+
+    def invalidate_changed_paths(self, paths):
+        """Evicts cached content and file system lookups for the given list of changed (path, is directory)
+        tuples (or everything, if the list is None). The watcher also calls this for changes to excluded paths,
+        which are still served, and as soon as changes arrive."""
+        if paths is not None:
+            paths = [(os.path.abspath(path), is_directory) for path, is_directory in paths]
+        if self.is_master:
+            # we're the master: our workers have the caches
+            self.worker_channel.send({"invalidate": paths})
+            return
+        self.invalidate_paths(paths)
+
+    def invalidate_paths(self, paths):
+        """Evicts cached content and file system lookups for the given list of (path, recursive) tuples, or
+        everything if the list is None."""
+        caches = [cache for cache in (self.content_cache, self.path_cache) if cache is not None]
+        if paths is None:
+            for cache in caches:
+                cache.clear()
+            return
+        for path, recursive in paths:
+            for cache in caches:
+                cache.invalidate(path, recursive=recursive)
+
+    def get_changed_urls(self, events):
+        """Maps the given file system events to the URL paths of the resources they affect.
+
+        Returns:
+            A tuple containing the list of URL paths of changed files and the list of URL paths of changed
+            folders (everything beneath which may have changed), or (None, None) if any of the changes fall
+            outside of the static root (in which case anything might have changed).
+        """
+        paths, folders = set(), set()
+        static_root = self.static_root.rstrip(os.sep) + os.sep
+        for event in events:
+            # modifications to a folder's listing are also reported for the files in the folder themselves
+            if event.is_directory and event.event_type == "modified":
+                continue
+            for path in [p for p in [event.src_path, getattr(event, "dest_path", None)] if p]:
+                path = os.path.abspath(path)
+                if path == self.static_root:
+                    return None, None
+                if not path.startswith(static_root):
+                    return None, None
+
+                url = self.server_base_path + "/".join(os.path.relpath(path, self.static_root).split(os.sep))
+                if event.is_directory:
+                    folders.add(url + "/")
+                    continue
+                paths.add(url)
+                # a changed index file also changes its folder's URL
+                folder_url, _, filename = url.rpartition("/")
+                if filename in HttpWatcherStaticFileHandler.default_filenames:
+                    paths.add(folder_url + "/")
+        return sorted(paths), sorted(folders)
+
+    @gen.coroutine
+    def trigger_reload(self, events=None):
+        # if we don't know what's changed, everything has to be invalidated
+        if events is None or len(events) > 0:
+            self.invalidate_caches(events)
+
+        if not callable(self.on_reload) and self.build_pipeline is None:
+            self.broadcast_to_clients(self.build_reload_message(events))
+            return
+
+        self.pending_reloads.append(events)
+        if self.reload_running:
+            logger.debug("Build/on_reload callback is still running - coalescing changes into its next run")
+            return
+
+        self.reload_running = True
+        # the changes for which to reload clients once there's nothing left to build
+        reloads = []
+        try:
+            while self.pending_reloads:
+                changes = merge_changes(self.pending_reloads)
+                self.pending_reloads = []
+                # run our build rules and callback first
+                build = yield self.run_builds(changes)
+                succeeded = bool(build)
+                if succeeded and callable(self.on_reload):
+                    succeeded = yield self.run_on_reload(changes)
+                if succeeded:
+                    reloads.append(self.get_unbuilt_changes(changes, build.paths))
+                if self.pending_reloads and self.build_pipeline is not None:
+                    # changes that arrived in the meantime, but that don't match any build rule, are most likely
+                    # the builds' own output: they only need to be reloaded, rather than built all over again
+                    arrived = merge_changes(self.pending_reloads)
+                    if arrived is not None:
+                        sources, outputs = self.split_build_sources(arrived)
+                        self.pending_reloads = [sources] if sources else []
+                        if outputs:
+                            reloads.append(outputs)
+            if reloads:
+                changes = merge_changes(reloads)
+                if changes is None or changes:
+                    self.broadcast_to_clients(self.build_reload_message(changes))
+        finally:
+            self.reload_running = False
+
+    @gen.coroutine
+    def run_builds(self, changes):
+        """Runs the build rules matching the given changes (if any).
+
+        Returns:
+            A BuildResult.
+        """
+        if self.build_pipeline is None or changes is None:
+            raise gen.Return(BuildResult())
+        result = yield self.build_pipeline.run(changes)
+        if not result:
+            logger.error("Build failed - not reloading clients")
+        raise gen.Return(result)
+
+    def split_build_sources(self, changes):
+        """Splits the given changes into those to source files matched by our build rules, and the rest.
+
+        Returns:
+            A (sources, others) tuple of ChangeSets.
+        """
+        matched = set()
+        for paths in self.build_pipeline.match(changes).values():
+            matched.update(paths)
+        sources, others = ChangeSet(), ChangeSet()
+        for event in changes:
+            path = getattr(event, "dest_path", None) or event.src_path
+            (sources if path in matched else others).add(event)
+        return sources, others
+
+    def get_unbuilt_changes(self, changes, built_paths):
+        """Removes the changes to the given source files, which have been consumed by build rules, from the
+        given changes. If the static root is being watched, the changes to the builds' output files are picked
+        up (and reloaded) separately; otherwise we can't tell what the builds changed, so everything is reloaded.
+
+        Returns:
+            A ChangeSet, or None if everything is to be reloaded.
+        """
+        if changes is None or not built_paths:
+            return changes
+        if not self.is_watched(self.static_root):
+            return None
+        remaining = ChangeSet(changes)
+        for path in built_paths:
+            remaining.discard(path)
+        return remaining
 
     @gen.coroutine
-    def trigger_reload(self, *args):
-        # call our callback first
-        if callable(self.on_reload):
-            self.on_reload()
+    def run_on_reload(self, changes):
+        """Runs the on_reload callback, waiting for it to complete if it's asynchronous (or blocking).
 
-        self.broadcast_to_clients({"command": "reload"})
+        Returns:
+            True if the callback succeeded, or False if it raised an exception or timed out.
+        """
+        args = (changes,) if self.on_reload_changes else ()
+        try:
+            if self.reload_executor is not None:
+                result = self.reload_executor.submit(self.on_reload, *args)
+            else:
+                result = self.on_reload(*args)
+
+            if gen.is_future(result) or is_awaitable(result):
+                result = gen.convert_yielded(result)
+                if self.on_reload_timeout is not None:
+                    result = gen.with_timeout(datetime.timedelta(seconds=self.on_reload_timeout), result)
+                yield result
+        except gen.TimeoutError:
+            logger.error("on_reload callback timed out after %.1fs - not reloading clients", self.on_reload_timeout)
+            raise gen.Return(False)
+        except Exception:
+            logger.exception("on_reload callback failed - not reloading clients")
+            raise gen.Return(False)
+        raise gen.Return(True)
+
+    def build_reload_message(self, events):
+        """Builds the reload command to send to clients for the given file system events. If the changes can be
+        mapped to URL paths, clients are told which paths (and their content types) have changed so that they
+        only reload when necessary, and can hot-swap stylesheets and images in place."""
+        msg = {"command": "reload"}
+        paths, folders = self.get_changed_urls(events) if events else (None, None)
+        if paths is not None:
+            msg["paths"] = paths
+            msg["folders"] = folders
+            msg["content_types"] = dict([(path, self.content_type_map.guess(path)) for path in paths])
+            msg["hot_swap"] = self.hot_swap
+        return msg
+
+
+def is_awaitable(obj):
+    isawaitable = getattr(inspect, "isawaitable", None)
+    return isawaitable is not None and isawaitable(obj)
+
+
+def set_vary_accept_encoding(handler):
+    """Tells caches that the handler's response depends on the request's Accept-Encoding header, unless
+    Tornado's own gzip transform (enabled through the application's "compress_response" setting) is going to."""
+    transforms = getattr(handler, "_transforms", None) or []
+    if not any(isinstance(transform, tornado.web.GZipContentEncoding) for transform in transforms):
+        handler.set_header("Vary", "Accept-Encoding")
+
+
+def send_file_range(sock_fd, file_fd, offset, count):
+    """Sends the given range of the given open file to the given (non-blocking) socket using sendfile(), waiting
+    for the socket to become writable whenever its buffer is full. Blocks, so must be called on a worker thread.
+
+    Returns:
+        A tuple containing the number of bytes sent and the error that stopped us from sending the rest (if any).
+    """
+    sent = 0
+    try:
+        while sent < count:
+            try:
+                n = os.sendfile(sock_fd, file_fd, offset + sent, count - sent)
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    raise
+                _, writable, _ = select.select([], [sock_fd], [], SENDFILE_TIMEOUT)
+                if not writable:
+                    raise IOError(errno.ETIMEDOUT, "Timed out waiting for the client to accept more data")
+                continue
+            if n == 0:
+                # the file has been truncated
+                break
+            sent += n
+    except (IOError, OSError) as e:
+        return sent, e
+    return sent, None
+
+
+def merge_changes(batches):
+    """Merges the given list of change sets into one. If any of them is None (i.e. the changes are unknown), the
+    result is None too."""
+    if any(batch is None for batch in batches):
+        return None
+    if len(batches) == 1:
+        return batches[0]
+    changes = ChangeSet()
+    for batch in batches:
+        for event in batch:
+            changes.add(event)
+    return changes
 
 
 class HttpWatcherStaticFileHandler(tornado.web.RequestHandler):
-    """Similar to tornado.web.StaticFileHandler, but without all of the caching mechanisms and with the
-    WebSocket JavaScript injection ability."""
+    """Similar to tornado.web.StaticFileHandler, but with the WebSocket JavaScript injection ability. Unlike
+    Tornado's handler, responses are never considered fresh by the browser: every request is revalidated
+    using ETags/modification times, so that unchanged files are answered with 304 Not Modified while
+    changed files are always re-fetched after a reload."""
+
+    CHUNK_SIZE = 64 * 1024
+    MIN_COMPRESS_SIZE = 256
 
     WEBSOCKET_JS_TEMPLATE = '<script type="application/javascript" src="{httpwatcher_script_url}"></script>\n' \
-                            '<script type="application/javascript">httpwatcher("{websocket_url}");</script>\n' \
-                            '</body>'
+                            '<script type="application/javascript">httpwatcher("{websocket_url}");</script>\n'
 
     static_path = None
     default_filenames = ["index.html", "index.htm"]
@@ -178,6 +736,25 @@ class HttpWatcherStaticFileHandler(tornado.web.RequestHandler):
     content_type = None
 
     stat_result = None
+    content_cache = None
+    path_cache = None
+    content_type_map = DEFAULT_CONTENT_TYPE_MAP
+    content = None
+    stream_threshold = DEFAULT_STREAM_THRESHOLD
+    request_range = None
+    websocket_js_digest = None
+    script_injector = None
+    compression = True
+    content_abspath = None
+    content_stat = None
+    content_encoding = None
+    precompressed = False
+    sendfile_executor = None
+    use_sendfile = False
+    io_executor = None
+    content_file = None
+    metrics_route = "static"
+    bytes_sent = 0
 
     def initialize(self, **kwargs):
         for param in ["path", "httpwatcher_script_url", "websocket_url", "server_base_path"]:
@@ -205,7 +782,16 @@ class HttpWatcherStaticFileHandler(tornado.web.RequestHandler):
             httpwatcher_script_url=self.httpwatcher_script_url,
             websocket_url=self.websocket_url
         ).encode("utf-8")
+        self.websocket_js_digest = hashlib.sha1(self.websocket_js_template).hexdigest()[:8]
+        self.script_injector = ScriptInjector(self.websocket_js_template)
         self.server_base_path = kwargs.pop('server_base_path')
+        self.content_cache = kwargs.pop('content_cache', None)
+        self.path_cache = kwargs.pop('path_cache', None)
+        self.content_type_map = kwargs.pop('content_type_map', DEFAULT_CONTENT_TYPE_MAP)
+        self.stream_threshold = kwargs.pop('stream_threshold', DEFAULT_STREAM_THRESHOLD)
+        self.compression = kwargs.pop('compression', True)
+        self.sendfile_executor = kwargs.pop('sendfile_executor', None)
+        self.io_executor = kwargs.pop('io_executor', None) or dummy_executor
 
     def head(self, path):
         return self.get(path, include_body=False)
@@ -215,7 +801,7 @@ class HttpWatcherStaticFileHandler(tornado.web.RequestHandler):
         if path == "":
             path = "/"
 
-        abspath = self.validate_path(
+        abspath = yield self.validate_path(
             path,
             os.path.join(self.static_path, self.parse_url_path(path))
         )
@@ -223,65 +809,258 @@ class HttpWatcherStaticFileHandler(tornado.web.RequestHandler):
             return
 
         self.request_abspath = abspath
-        self.stat_file()
+        yield self.stat_file()
         self.set_modified_time()
         self.set_content_type()
+        yield self.select_content_encoding()
+        self.set_etag_header()
+        self.set_header("Cache-Control", "no-cache")
+        if self.should_return_304():
+            self.set_status(304)
+            return
+
+        self.use_sendfile = self.can_sendfile()
+        if not self.should_stream() and not self.use_sendfile:
+            yield self.load_content()
+
+        size = self.get_content_size()
+        self.request_range = self.get_request_range(size)
+        if self.request_range is False:
+            self.set_status(416)
+            self.set_header("Content-Type", "text/plain")
+            self.set_header("Content-Range", "bytes */%d" % size)
+            return
+        if include_body and self.content is None:
+            # the file is opened before any headers are sent, so that a file that has just been deleted results
+            # in a 404 rather than a truncated response
+            self.content_file = yield self.open_content_file()
         self.set_headers()
 
         if include_body:
-            content = self.get_content(self.request_abspath)
-            if isinstance(content, bytes):
-                content = [content]
-            for chunk in content:
-                try:
+            start, end = self.request_range or (None, None)
+            if self.use_sendfile:
+                start, end = start or 0, self.content_stat.st_size if end is None else end
+                sent = yield self.send_file(self.content_file, start, end)
+                if sent is None:
+                    return
+                # sendfile() turned out not to be supported, so send the rest of the file the usual way
+                chunks = self.get_content(self.content_file, start + sent, end)
+            elif self.content is not None:
+                chunks = iter([self.content[start:end] if self.request_range else self.content])
+            elif self.content_type == "text/html":
+                chunks = self.get_injected_content(self.content_file, start, end)
+            else:
+                chunks = self.get_content(self.content_file, start, end)
+
+            try:
+                while True:
+                    # chunks are read from disk on the I/O executor
+                    chunk = next(chunks, None) if self.content is not None else \
+                        (yield self.io_executor.submit(next, chunks, None))
+                    if chunk is None:
+                        break
                     self.write(chunk)
+                    self.bytes_sent += len(chunk)
+                    # wait for each chunk to be written to the socket before reading the next one
                     yield self.flush()
-                except tornado.iostream.StreamClosedError:
-                    return
+            except tornado.iostream.StreamClosedError:
+                return
+            finally:
+                if hasattr(chunks, "close"):
+                    chunks.close()
         else:
             assert self.request.method == "HEAD"
 
+    def can_sendfile(self):
+        """Checks whether the response's content can be sent straight from the file to the client's socket by
+        the operating system, which is only possible for unmodified files sent over plain (non-TLS) HTTP/1.x
+        connections. Files small enough to be cached in memory are served from the cache instead."""
+        if self.sendfile_executor is None or self.content_type == "text/html":
+            return False
+        # output transforms (e.g. Tornado's gzip transform, enabled through the "compress_response" setting)
+        # may rewrite the response's body, which sendfile() would bypass
+        if self._transforms:
+            return False
+        if self.content_encoding is not None and not self.precompressed:
+            return False
+        if not self.should_stream() and self.content_cache is not None:
+            return False
+        connection = self.request.connection
+        stream = getattr(connection, "stream", None)
+        return isinstance(stream, tornado.iostream.IOStream) and \
+            not isinstance(stream, tornado.iostream.SSLIOStream) and \
+            hasattr(connection, "_expected_content_remaining")
+
+    def on_finish(self):
+        if self.content_file is not None:
+            self.content_file.close()
+            self.content_file = None
+
+    @gen.coroutine
+    def open_content_file(self):
+        """Opens the file whose content is to be sent (on the I/O executor). If it can't be opened, our cached
+        lookups must be out of date, so they're evicted and the request fails with a 404."""
+        try:
+            content_file = yield self.io_executor.submit(open, self.content_abspath, "rb")
+        except (IOError, OSError) as e:
+            self.evict_missing_file(e)
+            raise tornado.web.HTTPError(404)
+        raise gen.Return(content_file)
+
+    def evict_missing_file(self, error):
+        """Evicts the cached lookups and content of the requested file, which turned out to be missing (or
+        unreadable) when it came to reading it."""
+        logger.debug("Failed to open %s (%s) - evicting it from our caches", self.content_abspath, error)
+        for cache in (self.path_cache, self.content_cache):
+            if cache is not None:
+                cache.invalidate(self.request_abspath)
+                cache.invalidate(self.content_abspath)
+
+    @gen.coroutine
+    def send_file(self, file, start, end):
+        """Sends the given range of the given open file to the client using sendfile(), once the response
+        headers have been written.
+
+        Returns:
+            The number of bytes sent if sendfile() turned out not to be supported, or not to be possible for the
+            response (in which case the rest of the file is still to be sent), or None once done.
+        """
+        try:
+            yield self.flush()
+        except tornado.iostream.StreamClosedError:
+            return
+        connection = self.request.connection
+        if connection._expected_content_remaining is None:
+            # the connection is framing the response's body itself (e.g. using chunked encoding)
+            raise gen.Return(0)
+        # our own copy of the socket, in case the connection is closed (and its file descriptor reused) meanwhile
+        sock_fd = os.dup(connection.stream.socket.fileno())
+        try:
+            sent, error = yield self.sendfile_executor.submit(
+                send_file_range, sock_fd, file.fileno(), start, end - start
+            )
+        finally:
+            os.close(sock_fd)
+        # we've bypassed the connection's accounting of the response's body
+        connection._expected_content_remaining -= sent
+        self.bytes_sent += sent
+        if error is None and sent == end - start:
+            return
+        if sent == 0 and getattr(error, "errno", None) in SENDFILE_UNSUPPORTED_ERRNOS:
+            logger.debug(
+                "sendfile() isn't supported for %s (%s) - sending it in chunks instead", self.content_abspath, error
+            )
+            raise gen.Return(sent)
+        logger.debug("Failed to send %s: %s", self.content_abspath, error or "file was truncated")
+        connection.stream.close()
+
+    @gen.coroutine
     def validate_path(self, url_path, abspath):
         if ".." in url_path or "~" in url_path:
             raise tornado.web.HTTPError(403, "Invalid request URI")
 
-        # if it's an existing directory
-        if os.path.exists(abspath) and os.path.isdir(abspath):
-            if not url_path.endswith("/"):
-                self.redirect(
-                    "%s%s/" % (self.server_base_path, url_path.strip('/')),
-                    permanent=True
-                )
-                return
-
-            abspath = self.find_first_default_file(abspath)
+        resolved = yield self.resolve_path(url_path, abspath)
+        # if it's an existing directory without a trailing slash
+        if resolved.status == 301:
+            self.redirect(
+                "%s%s/" % (self.server_base_path, url_path.strip('/')),
+                permanent=True
+            )
+            return
 
-        if not os.path.exists(abspath):
+        if resolved.status == 404:
             raise tornado.web.HTTPError(404)
 
-        if not os.path.isfile(abspath):
+        if resolved.status == 403:
             raise tornado.web.HTTPError(403, "%s is not a file", url_path)
 
-        return abspath
+        self.stat_result = resolved.stat_result
+        self.content_type = resolved.content_type
+        raise gen.Return(resolved.abspath)
+
+    @gen.coroutine
+    def resolve_path(self, url_path, abspath):
+        """Resolves the given URL path to a file, consulting the path cache (if the static root is being
+        watched) before the file system, which is accessed on the I/O executor."""
+        if self.path_cache is None:
+            resolved = yield self.io_executor.submit(self.resolve_path_from_disk, url_path, abspath)
+            raise gen.Return(resolved)
+
+        key = ("url", url_path)
+        resolved = self.path_cache.get(key)
+        if resolved is PathCache.MISS:
+            # results are discarded if anything is invalidated while we're busy, as they may be out of date
+            generation = self.path_cache.generation
+            resolved = yield self.io_executor.submit(self.resolve_path_from_disk, url_path, abspath, generation)
+            self.path_cache.put(key, resolved, [abspath, resolved.abspath], generation=generation)
+        raise gen.Return(resolved)
+
+    def resolve_path_from_disk(self, url_path, abspath, generation=None):
+        """Resolves the given URL path to a file, using a single stat call per candidate file."""
+        stat_result = self.stat_path(abspath, generation)
+        if stat_result is not None and stat.S_ISDIR(stat_result.st_mode):
+            if not url_path.endswith("/"):
+                return ResolvedPath(301, abspath, None, None)
+            abspath, stat_result = self.find_first_default_file(abspath, generation)
+
+        if stat_result is None:
+            return ResolvedPath(404, abspath, None, None)
+
+        if not stat.S_ISREG(stat_result.st_mode):
+            return ResolvedPath(403, abspath, None, None)
 
-    def find_first_default_file(self, base_path):
+        return ResolvedPath(200, abspath, stat_result, self.content_type_map.guess(abspath))
+
+    def find_first_default_file(self, base_path, generation=None):
         for filename in self.default_filenames:
             abspath = os.path.join(base_path, filename)
-            if os.path.exists(abspath) and os.path.isfile(abspath):
-                return abspath
-        raise tornado.web.HTTPError(404)
+            stat_result = self.stat_path(abspath, generation)
+            if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+                return abspath, stat_result
+        return base_path, None
+
+    @gen.coroutine
+    def stat_path_async(self, abspath):
+        """Looks up the stat result for the given path in the path cache (if available), or stats it on the I/O
+        executor."""
+        if self.path_cache is not None:
+            stat_result = self.path_cache.get(("stat", abspath))
+            if stat_result is not PathCache.MISS:
+                raise gen.Return(stat_result)
+        generation = self.path_cache.generation if self.path_cache is not None else None
+        stat_result = yield self.io_executor.submit(self.stat_path, abspath, generation)
+        raise gen.Return(stat_result)
+
+    def stat_path(self, abspath, generation=None):
+        """Returns the stat result for the given path, or None if it does not exist. Results are cached in the
+        path cache, if available (unless it has been invalidated since the given generation)."""
+        if self.path_cache is not None:
+            stat_result = self.path_cache.get(("stat", abspath))
+            if stat_result is not PathCache.MISS:
+                return stat_result
+
+        try:
+            stat_result = os.stat(abspath)
+        except OSError:
+            stat_result = None
+
+        if self.path_cache is not None:
+            self.path_cache.put(("stat", abspath), stat_result, [abspath], generation=generation)
+        return stat_result
 
     def set_modified_time(self):
         self.modified = datetime.datetime.utcfromtimestamp(
             self.stat_result[stat.ST_MTIME]
         )
 
+    @gen.coroutine
     def stat_file(self):
         if self.stat_result is None:
-            self.stat_result = os.stat(self.request_abspath)
+            self.stat_result = yield self.io_executor.submit(os.stat, self.request_abspath)
 
     def set_content_type(self):
-        self.content_type = self.guess_content_type(self.request_abspath)
+        if self.content_type is None:
+            self.content_type = self.content_type_map.guess(self.request_abspath)
 
     def set_headers(self):
         if self.modified is not None:
@@ -290,25 +1069,294 @@ class HttpWatcherStaticFileHandler(tornado.web.RequestHandler):
         if self.content_type is not None:
             self.set_header("Content-Type", self.content_type)
 
-        self.set_header("Content-Length", self.get_content_size())
+        if self.content_encoding is not None:
+            self.set_header("Content-Encoding", self.content_encoding)
 
-    def get_content_size(self):
-        if self.content_type == "text/html":
-            return len([h for h in self.get_content(self.request_abspath)][0])
+        self.set_header("Accept-Ranges", "bytes")
+        size = self.get_content_size()
+        if self.request_range:
+            start, end = self.request_range
+            self.set_status(206)
+            self.set_header("Content-Range", "bytes %d-%d/%d" % (start, end - 1, size))
+            self.set_header("Content-Length", end - start)
         else:
-            return self.stat_result[stat.ST_SIZE]
+            self.set_header("Content-Length", size)
 
-    def get_content(self, abspath, start=None, end=None):
-        # if it's an HTML file
+    def get_content_size(self):
+        if self.content is not None:
+            return len(self.content)
         if self.content_type == "text/html":
-            # read it all into memory at once, and insert our script tag
-            with open(abspath, "rb") as file:
-                yield file.read().replace(b"</body>", self.websocket_js_template)
+            return self.script_injector.injected_size(self.content_stat.st_size)
+        return self.content_stat.st_size
+
+    def should_stream(self):
+        """Large files are streamed from disk in chunks rather than being loaded into memory."""
+        return self.content_stat.st_size > self.stream_threshold
+
+    @gen.coroutine
+    def select_content_encoding(self):
+        """Negotiates the response's content encoding with the client through its Accept-Encoding header.
+        A precompressed sibling of the requested file (e.g. "style.css.br" or "style.css.gz") that is at
+        least as recent as the file itself is preferred. Otherwise compressible content that is small enough
+        to be held in memory is compressed on the fly. Range requests are always served uncompressed."""
+        self.content_abspath = self.request_abspath
+        self.content_stat = self.stat_result
+        self.content_encoding = None
+        self.precompressed = False
+        if not self.compression:
             return
-        else:
-            with open(abspath, "rb") as file:
-                yield file.read()
+
+        set_vary_accept_encoding(self)
+        if "Range" in self.request.headers:
+            return
+        accepted = self.parse_accept_encoding(self.request.headers.get("Accept-Encoding", ""))
+        if not accepted:
+            return
+
+        # precompressed files can't have our script injected
+        if self.content_type != "text/html":
+            for encoding, extension in compression.PRECOMPRESSED_EXTENSIONS.items():
+                if encoding not in accepted:
+                    continue
+                sibling_stat = yield self.stat_path_async(self.request_abspath + extension)
+                if sibling_stat is None:
+                    continue
+                if stat.S_ISREG(sibling_stat.st_mode) and sibling_stat.st_mtime >= self.stat_result.st_mtime:
+                    self.content_abspath = self.request_abspath + extension
+                    self.content_stat = sibling_stat
+                    self.content_encoding = encoding
+                    self.precompressed = True
+                    return
+
+        if not compression.is_compressible(self.content_type) or self.should_stream() or \
+                self.stat_result.st_size < self.MIN_COMPRESS_SIZE:
             return
+        for encoding in compression.supported_encodings():
+            if encoding in accepted:
+                self.content_encoding = encoding
+                return
+
+    def get_request_range(self, size):
+        """Works out which part of the content has been requested through the Range header, if any.
+
+        Returns:
+            A (start, end) tuple (where end is exclusive) for a satisfiable single-range request, None if
+            the full content must be served, or False if the requested range cannot be satisfied.
+        """
+        range_header = self.request.headers.get("Range")
+        if range_header is None or not self.check_if_range_header():
+            return None
+        return self.parse_range_header(range_header, size)
+
+    def check_if_range_header(self):
+        """If the Range request is conditional (If-Range), the range only applies if the representation
+        is unchanged - otherwise the full content must be served."""
+        if_range = self.request.headers.get("If-Range")
+        if if_range is None:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"'):
+            # strong comparison is required for If-Range
+            return if_range == self._headers.get("Etag")
+        if_range_date = self.parse_http_date(if_range)
+        return if_range_date is not None and self.modified is not None and if_range_date == self.modified
+
+    def compute_etag(self):
+        """Computes a strong ETag for the requested file from its inode, size and modification time, without
+        having to read the file's contents. Injected HTML has its own ETag, as its contents differ from the
+        file on disk."""
+        if self.content_stat is None:
+            return None
+        mtime_ns = getattr(self.content_stat, "st_mtime_ns", None)
+        if mtime_ns is None:
+            mtime_ns = int(self.content_stat.st_mtime * 1e9)
+        etag = "%x-%x-%x" % (self.content_stat.st_ino, self.content_stat.st_size, mtime_ns)
+        if self.content_type == "text/html":
+            etag += "-%s" % self.websocket_js_digest
+        if self.content_encoding is not None:
+            etag += "-%s" % self.content_encoding
+        return '"%s"' % etag
+
+    def should_return_304(self):
+        """Checks the request's conditional headers against the requested file. If-None-Match takes
+        precedence over If-Modified-Since, as per RFC 7232."""
+        if self.request.headers.get("If-None-Match"):
+            return self.check_etag_header()
+
+        if_modified_since = self.parse_http_date(self.request.headers.get("If-Modified-Since"))
+        if if_modified_since is not None and self.modified is not None:
+            return if_modified_since >= self.modified
+        return False
+
+    def get_content_signature(self):
+        """Cached content is only considered valid while the file's size and modification time are unchanged."""
+        return self.content_stat.st_size, self.content_stat.st_mtime
+
+    @gen.coroutine
+    def load_content(self):
+        """Loads the full response body for the requested file, preferring the in-memory content cache over
+        the disk. HTML files are cached with the WebSocket script already injected, and content compressed
+        on the fly is cached alongside the uncompressed content."""
+        variant = "html" if self.content_type == "text/html" else "raw"
+        compress_on_the_fly = self.content_encoding is not None and not self.precompressed
+        if compress_on_the_fly:
+            self.content = self.get_cached_content("%s.%s" % (variant, self.content_encoding))
+            if self.content is not None:
+                return
+
+        self.content = self.get_cached_content(variant)
+        if self.content is None:
+            try:
+                self.content = yield self.io_executor.submit(self.load_content_from_disk, self.content_abspath)
+            except (IOError, OSError) as e:
+                self.evict_missing_file(e)
+                raise tornado.web.HTTPError(404)
+            self.put_cached_content(variant, self.content)
+
+        if compress_on_the_fly:
+            self.content = yield self.io_executor.submit(compression.compress, self.content, self.content_encoding)
+            self.put_cached_content("%s.%s" % (variant, self.content_encoding), self.content)
+
+    def get_cached_content(self, variant):
+        if self.content_cache is None:
+            return None
+        return self.content_cache.get(
+            self.content_abspath,
+            variant=variant,
+            signature=self.get_content_signature()
+        )
+
+    def put_cached_content(self, variant, content):
+        if self.content_cache is not None:
+            self.content_cache.put(
+                self.content_abspath,
+                content,
+                variant=variant,
+                signature=self.get_content_signature()
+            )
+
+    def load_content_from_disk(self, abspath):
+        with open(abspath, "rb") as file:
+            content = file.read()
+        # if it's an HTML file, insert our script tags
+        if self.content_type == "text/html":
+            content = self.script_injector.inject(content)
+        return content
+
+    def get_injected_content(self, file, start=None, end=None):
+        """Generator that streams the given HTML file in chunks, with our script tags injected, without ever
+        holding the whole document in memory.
+
+        Args:
+            file: The HTML file to read, open in binary mode.
+            start: The offset within the injected document from which to start.
+            end: The offset (exclusive) within the injected document at which to stop.
+        """
+        size = self.content_stat.st_size
+        offset = self.script_injector.find_offset_in_file(file, size)
+
+        snippet = self.script_injector.snippet
+        start = start or 0
+        end = self.script_injector.injected_size(size) if end is None else end
+        snippet_end = offset + len(snippet)
+
+        # the document up until the injection point
+        if start < offset:
+            for chunk in self.get_content(file, start, min(end, offset)):
+                yield chunk
+        # the injected snippet itself
+        if start < snippet_end and end > offset:
+            yield snippet[max(start - offset, 0):min(end - offset, len(snippet))]
+        # the rest of the document
+        if end > snippet_end:
+            for chunk in self.get_content(file, max(start, snippet_end) - len(snippet), end - len(snippet)):
+                yield chunk
+
+    def get_content(self, file, start=None, end=None):
+        """Generator that reads the raw contents of the given file in chunks of at most CHUNK_SIZE bytes.
+
+        Args:
+            file: The file to read, open in binary mode.
+            start: The offset from which to start reading (default: the start of the file).
+            end: The offset (exclusive) at which to stop reading (default: the end of the file).
+        """
+        file.seek(start or 0)
+        remaining = (end - (start or 0)) if end is not None else None
+        while remaining is None or remaining > 0:
+            chunk_size = self.CHUNK_SIZE if remaining is None else min(remaining, self.CHUNK_SIZE)
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+    @classmethod
+    def parse_range_header(cls, range_header, size):
+        """Parses an HTTP Range header (RFC 7233) for content of the given size. Only single byte ranges are
+        supported - any other kind of range specification results in the full content being served.
+
+        Returns:
+            A (start, end) tuple (where end is exclusive), None if the header is to be ignored, or False if
+            the range cannot be satisfied.
+        """
+        unit, _, spec = range_header.partition("=")
+        if unit.strip() != "bytes" or "," in spec:
+            return None
+
+        start, sep, end = spec.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            start = int(start) if start else None
+            end = int(end) if end else None
+        except ValueError:
+            return None
+
+        if start is None:
+            # suffix range, e.g. "bytes=-500" for the last 500 bytes
+            if end is None or end == 0 or size == 0:
+                return False
+            return max(size - end, 0), size
+
+        if end is not None and end < start:
+            return None
+        if start >= size:
+            return False
+        return start, size if end is None else min(end + 1, size)
+
+    @classmethod
+    def parse_accept_encoding(cls, accept_encoding):
+        """Parses an Accept-Encoding header into the set of content codings acceptable to the client."""
+        accepted = set()
+        for part in accept_encoding.split(","):
+            coding, _, params = part.partition(";")
+            coding = coding.strip().lower()
+            if not coding:
+                continue
+            quality = 1.0
+            for param in params.split(";"):
+                name, _, value = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            if quality > 0:
+                accepted.add(coding)
+        if "*" in accepted:
+            accepted.update(compression.PRECOMPRESSED_EXTENSIONS.keys())
+        return accepted
+
+    @classmethod
+    def parse_http_date(cls, value):
+        """Parses an HTTP date header value into a naive UTC datetime, or None if it cannot be parsed."""
+        if not value:
+            return None
+        date_tuple = email.utils.parsedate(value)
+        if date_tuple is None:
+            return None
+        return datetime.datetime(*date_tuple[:6])
 
     @classmethod
     def parse_url_path(cls, path):
@@ -316,40 +1364,87 @@ class HttpWatcherStaticFileHandler(tornado.web.RequestHandler):
 
     @classmethod
     def guess_content_type(cls, abspath):
-        mime_type, encoding = mimetypes.guess_type(abspath)
-        if encoding == "gzip":
-            return "application/gzip"
-        elif encoding is not None:
-            return "application/octet-stream"
-        elif mime_type is not None:
-            return mime_type
-        else:
-            return "application/octet-stream"
-
+        return DEFAULT_CONTENT_TYPE_MAP.guess(abspath)
 
-class HttpWatcherStaticScriptHandler(tornado.web.RequestHandler):
 
-    path = None
-    contents = None
+class HttpWatcherScript(object):
+    """The httpwatcher.min.js client script, read from disk once and held in memory (along with its compressed
+    variants) for the lifetime of the process."""
 
-    def initialize(self, **kwargs):
-        if "path" not in kwargs or not os.path.exists(kwargs['path']) or \
-                not os.path.isabs(kwargs['path']) or not os.path.isfile(kwargs['path']):
+    def __init__(self, path):
+        if not os.path.isabs(path) or not os.path.isfile(path):
             raise ValueError(
-                "HttpWatcherStaticScriptHandler expects an absolute filesystem path for the " +
-                "httpwatcher.min.js script file"
+                "HttpWatcherScript expects an absolute filesystem path for the httpwatcher.min.js script file"
             )
-        self.path = kwargs['path']
+        self.path = path
         with open(self.path, "rb") as f:
-            self.contents = f.read()
+            self.content = f.read()
+        self.version = hashlib.sha1(self.content).hexdigest()[:12]
+        self.etag = '"%s"' % self.version
+        self.compressed = dict([
+            (encoding, compression.compress(self.content, encoding))
+            for encoding in compression.supported_encodings()
+        ])
+
+
+class HttpWatcherStaticScriptHandler(tornado.web.RequestHandler):
+    """Serves the in-memory httpwatcher.min.js script. Requests for the versioned URL (with the script's
+    content hash in the "v" query parameter) may be cached by browsers indefinitely."""
+
+    MAX_AGE = 365 * 24 * 60 * 60
+
+    script = None
+    content_encoding = None
+    metrics_route = "script"
+    bytes_sent = 0
+
+    def initialize(self, **kwargs):
+        if "script" not in kwargs:
+            raise ValueError("HttpWatcherStaticScriptHandler expects an HttpWatcherScript instance")
+        self.script = kwargs["script"]
+
+    def compute_etag(self):
+        if self.content_encoding is not None:
+            return '"%s-%s"' % (self.script.version, self.content_encoding)
+        return self.script.etag
+
+    def head(self, *args, **kwargs):
+        return self.get(*args, include_body=False)
 
     @gen.coroutine
     def get(self, *args, **kwargs):
         self.set_header("Content-Type", "application/javascript")
-        self.set_header("Content-Length", len(self.contents))
+        set_vary_accept_encoding(self)
+        if self.get_query_argument("v", None) == self.script.version:
+            self.set_header("Cache-Control", "public, max-age=%d, immutable" % self.MAX_AGE)
+        else:
+            self.set_header("Cache-Control", "no-cache")
+
+        accepted = HttpWatcherStaticFileHandler.parse_accept_encoding(
+            self.request.headers.get("Accept-Encoding", "")
+        )
+        for encoding in compression.supported_encodings():
+            if encoding in accepted:
+                self.content_encoding = encoding
+                break
+
+        self.set_etag_header()
+        if self.check_etag_header():
+            self.set_status(304)
+            return
 
+        if self.content_encoding is not None:
+            contents = self.script.compressed[self.content_encoding]
+            self.set_header("Content-Encoding", self.content_encoding)
+        else:
+            contents = self.script.content
+        self.set_header("Content-Length", len(contents))
+
+        if not kwargs.get("include_body", True):
+            return
         try:
-            self.write(self.contents)
+            self.write(contents)
+            self.bytes_sent = len(contents)
             yield self.flush()
         except tornado.iostream.StreamClosedError:
             return
@@ -358,6 +1453,9 @@ class HttpWatcherStaticScriptHandler(tornado.web.RequestHandler):
 class HttpWatcherWebSocketHandler(tornado.websocket.WebSocketHandler):
 
     watcher_server = None
+    metrics_route = "websocket"
+    # when we last heard from the client (by way of its connection, a message or a response to a ping)
+    last_seen = 0
 
     def initialize(self, **kwargs):
         if "watcher_server" not in kwargs:
@@ -365,13 +1463,60 @@ class HttpWatcherWebSocketHandler(tornado.websocket.WebSocketHandler):
         self.watcher_server = kwargs.pop('watcher_server')
         super(HttpWatcherWebSocketHandler, self).initialize()
 
+    def get_compression_options(self):
+        # an empty dictionary enables compression with Tornado's default settings
+        return {} if self.watcher_server.websocket_compression else None
+
     def open(self, *args, **kwargs):
+        self.last_seen = time.time()
         self.watcher_server.register_client(self)
         logger.debug("Client WebSocket connection opened")
 
+    def on_pong(self, data):
+        self.last_seen = time.time()
+
     def on_close(self):
         self.watcher_server.deregister_client(self)
         logger.debug("Client WebSocket connection closed")
 
     def on_message(self, message):
+        self.last_seen = time.time()
         logger.debug("Ignoring message from WebSocket client: %s", message)
+
+    def get_write_buffer_size(self):
+        """Returns the number of bytes of messages that have been written to this client, but not sent yet."""
+        if self.ws_connection is None or self.ws_connection.stream is None:
+            return 0
+        # private in Tornado's IOStream, so fall back to nothing buffered
+        return getattr(self.ws_connection.stream, "_write_buffer_size", 0)
+
+
+class HttpWatcherMetricsHandler(tornado.web.RequestHandler):
+    """Serves the server's metrics in Prometheus' text exposition format, or as JSON if asked for (using the
+    "format" query parameter or the Accept header)."""
+
+    metrics = None
+    metrics_route = "metrics"
+    bytes_sent = 0
+
+    def initialize(self, **kwargs):
+        if "metrics" not in kwargs:
+            raise ValueError("HttpWatcherMetricsHandler expects a ServerMetrics instance")
+        self.metrics = kwargs["metrics"]
+
+    def get(self):
+        output_format = self.get_query_argument("format", None)
+        if output_format is None:
+            output_format = "json" if "application/json" in self.request.headers.get("Accept", "") else "prometheus"
+        if output_format == "json":
+            self.set_header("Content-Type", "application/json")
+            content = tornado.escape.json_encode(self.metrics.to_dict())
+        elif output_format == "prometheus":
+            self.set_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            content = self.metrics.to_prometheus()
+        else:
+            raise tornado.web.HTTPError(400, "Unsupported metrics format: %s" % output_format)
+        content = tornado.escape.utf8(content)
+        self.set_header("Cache-Control", "no-cache")
+        self.write(content)
+        self.bytes_sent = len(content)
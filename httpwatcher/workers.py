@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import errno
+import os
+
+from tornado import gen
+from tornado.escape import json_encode, json_decode, utf8
+from tornado.iostream import PipeIOStream, StreamClosedError
+import tornado.ioloop
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "fork_workers",
+    "describe_exit_status",
+    "MasterChannel",
+    "WorkerChannel",
+    "DEFAULT_WORKER_CHECK_INTERVAL"
+]
+
+# how often (in seconds) the master process checks whether any of its worker processes have exited
+DEFAULT_WORKER_CHECK_INTERVAL = 1.0
+
+
+def fork_workers(num_workers):
+    """Forks the given number of worker processes, each of which is connected to this (the master) process by a
+    pipe over which the master sends it messages. Like tornado.process.fork_processes, this must be called before
+    the I/O loop has been created, and any listening sockets are to be bound beforehand so that they're shared by
+    all of the workers.
+
+    Returns:
+        A (worker ID, channel) tuple. In the workers, the ID is a number between 0 and num_workers - 1, and the
+        channel is a WorkerChannel. In the master, the ID is None and the channel is a MasterChannel.
+    """
+    if not hasattr(os, "fork"):
+        raise RuntimeError("Multiple worker processes are not supported on this platform")
+    if tornado.ioloop.IOLoop.initialized():
+        raise RuntimeError("Cannot fork worker processes once the I/O loop has been created")
+
+    write_fds = dict()
+    for worker_id in range(num_workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            # we're the worker: we only need our own pipe's read end
+            os.close(write_fd)
+            for fd in write_fds.values():
+                os.close(fd)
+            return worker_id, WorkerChannel(read_fd)
+        os.close(read_fd)
+        write_fds[pid] = write_fd
+        logger.debug("Forked worker process %d (PID %d)", worker_id, pid)
+    return None, MasterChannel(write_fds)
+
+
+def describe_exit_status(status):
+    """Describes the given exit status (as returned by os.waitpid()) of a process."""
+    if os.WIFSIGNALED(status):
+        return "killed by signal %d" % os.WTERMSIG(status)
+    return "exit code %d" % os.WEXITSTATUS(status)
+
+
+class MasterChannel(object):
+    """Sends messages (JSON-serialisable objects) from the master process to all of its worker processes."""
+
+    def __init__(self, write_fds):
+        """Constructor.
+
+        Args:
+            write_fds: A dictionary mapping the workers' process IDs to the write ends of their pipes.
+        """
+        self.write_fds = write_fds
+        self.streams = dict()
+
+    def __len__(self):
+        return len(self.write_fds)
+
+    def start(self):
+        # the streams are only created once the master's I/O loop is running
+        self.streams = dict([(pid, PipeIOStream(fd)) for pid, fd in self.write_fds.items()])
+
+    def send(self, msg):
+        # encode the message once, rather than once per worker
+        data = utf8(json_encode(msg)) + b"\n"
+        for pid, stream in list(self.streams.items()):
+            try:
+                stream.write(data)
+            except StreamClosedError:
+                logger.warning("Worker process %d has exited - no longer sending it changes", pid)
+                del self.streams[pid]
+
+    def reap(self):
+        """Collects the exit statuses of any of our worker processes that have exited (so that they don't linger
+        as zombies), and stops sending them messages. Doesn't block.
+
+        Returns:
+            A list of (process ID, exit status) tuples, where each exit status is as returned by os.waitpid().
+        """
+        exited = []
+        for pid in list(self.write_fds.keys()):
+            try:
+                reaped_pid, status = os.waitpid(pid, os.WNOHANG)
+            except OSError as e:
+                if e.errno != errno.ECHILD:
+                    raise
+                # someone else has already reaped it
+                reaped_pid, status = pid, 0
+            if reaped_pid == 0:
+                continue
+            exited.append((pid, status))
+            # once started, the streams own the write ends of the pipes
+            stream = self.streams.pop(pid, None)
+            if stream is not None:
+                stream.close()
+            else:
+                os.close(self.write_fds[pid])
+            del self.write_fds[pid]
+        return exited
+
+    def close(self):
+        # workers shut down as soon as their pipes are closed
+        for stream in self.streams.values():
+            stream.close()
+        self.streams = dict()
+
+
+class WorkerChannel(object):
+    """Receives the messages sent to a worker process by the master process."""
+
+    def __init__(self, read_fd):
+        self.read_fd = read_fd
+        self.stream = None
+
+    @gen.coroutine
+    def receive(self, on_message):
+        """Calls the given callback with each of the messages received from the master process until its end of
+        the pipe is closed."""
+        self.stream = PipeIOStream(self.read_fd)
+        while True:
+            try:
+                line = yield self.stream.read_until(b"\n")
+            except StreamClosedError:
+                break
+            try:
+                on_message(json_decode(line))
+            except Exception:
+                logger.exception("Failed to handle message from master process")
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
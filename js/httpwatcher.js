@@ -65,6 +65,145 @@ function saveWindowScrollPosition() {
     storageSet('scroll-y', coords.y);
 }
 
+function getResourcePath(url) {
+    if (typeof(url) !== 'string' || url.length == 0) {
+        return null;
+    }
+    var a = document.createElement('a');
+    a.href = url;
+    // we only serve resources from our own host
+    if (a.host && a.host != window.location.host) {
+        return null;
+    }
+    var path = (a.pathname.charAt(0) == '/') ? a.pathname : '/' + a.pathname;
+    try {
+        return decodeURIComponent(path);
+    } catch (e) {
+        return path;
+    }
+}
+
+function getLoadedResourcePaths() {
+    var paths = {};
+    var addPath = function(url) {
+        var path = getResourcePath(url);
+        if (path !== null) {
+            paths[path] = true;
+        }
+    };
+    var i;
+
+    addPath(window.location.href);
+    if (window.performance && typeof(window.performance.getEntriesByType) == 'function') {
+        var entries = window.performance.getEntriesByType('resource');
+        for (i = 0; i < entries.length; i++) {
+            addPath(entries[i].name);
+        }
+    }
+    var elements = document.querySelectorAll(
+        'link[href], script[src], img[src], source[src], iframe[src], video[src], audio[src], embed[src]'
+    );
+    for (i = 0; i < elements.length; i++) {
+        addPath(elements[i].getAttribute('href') || elements[i].getAttribute('src'));
+    }
+    return paths;
+}
+
+function shouldReload(msg) {
+    // if the server can't tell us what's changed, we have to assume the worst
+    if (!msg.paths) {
+        return true;
+    }
+    var loaded = getLoadedResourcePaths();
+    var i, path;
+    for (i = 0; i < msg.paths.length; i++) {
+        if (loaded[msg.paths[i]]) {
+            return true;
+        }
+    }
+    for (i = 0; i < (msg.folders || []).length; i++) {
+        for (path in loaded) {
+            if (loaded.hasOwnProperty(path) && path.indexOf(msg.folders[i]) == 0) {
+                return true;
+            }
+        }
+    }
+    return false;
+}
+
+function isHotSwappable(contentType) {
+    return typeof(contentType) == 'string' && (contentType == 'text/css' || contentType.indexOf('image/') == 0);
+}
+
+function cacheBust(url) {
+    var hashIndex = url.indexOf('#');
+    var hash = (hashIndex >= 0) ? url.substring(hashIndex) : '';
+    var base = (hashIndex >= 0) ? url.substring(0, hashIndex) : url;
+    base = base.replace(/([?&])httpwatcher=\d+(&|$)/, '$1').replace(/[?&]$/, '');
+    return base + (base.indexOf('?') >= 0 ? '&' : '?') + 'httpwatcher=' + new Date().getTime() + hash;
+}
+
+function swapStylesheet(link) {
+    // load the new stylesheet before removing the old one, to avoid a flash of unstyled content
+    var replacement = link.cloneNode(false);
+    replacement.setAttribute('href', cacheBust(link.getAttribute('href')));
+    replacement.onload = replacement.onerror = function() {
+        if (link.parentNode) {
+            link.parentNode.removeChild(link);
+        }
+    };
+    link.parentNode.insertBefore(replacement, link.nextSibling);
+}
+
+function swapImage(img) {
+    img.setAttribute('src', cacheBust(img.getAttribute('src')));
+}
+
+// Attempts to apply the given changes without reloading the page, by re-fetching the affected stylesheets
+// and images in place. Returns false if any of the page's changed resources can't be swapped in place.
+function hotSwap(msg) {
+    if (!msg.hot_swap || !msg.paths || (msg.folders && msg.folders.length > 0)) {
+        return false;
+    }
+    var loaded = getLoadedResourcePaths();
+    var contentTypes = msg.content_types || {};
+    var changed = {}, i, path;
+    for (i = 0; i < msg.paths.length; i++) {
+        path = msg.paths[i];
+        if (loaded[path]) {
+            if (!isHotSwappable(contentTypes[path])) {
+                return false;
+            }
+            changed[path] = true;
+        }
+    }
+
+    var swaps = [], swapped = {};
+    var findSwaps = function(selector, attr, swap) {
+        var elements = document.querySelectorAll(selector);
+        for (var j = 0; j < elements.length; j++) {
+            var elementPath = getResourcePath(elements[j].getAttribute(attr));
+            if (elementPath !== null && changed[elementPath]) {
+                swaps.push({element: elements[j], swap: swap});
+                swapped[elementPath] = true;
+            }
+        }
+    };
+    findSwaps('link[rel~="stylesheet"][href]', 'href', swapStylesheet);
+    findSwaps('img[src]', 'src', swapImage);
+
+    // resources we can't find in the document (e.g. images referenced from stylesheets) need a full reload
+    for (path in changed) {
+        if (changed.hasOwnProperty(path) && !swapped[path]) {
+            return false;
+        }
+    }
+    for (i = 0; i < swaps.length; i++) {
+        swaps[i].swap(swaps[i].element);
+    }
+    return true;
+}
+
 function httpwatcher(webSocketUrl) {
     if (connection == null) {
         connection = new ReconnectingWebSocket(webSocketUrl);
@@ -73,7 +212,7 @@ function httpwatcher(webSocketUrl) {
         };
         connection.onmessage = function(m) {
             msg = JSON.parse(m.data);
-            if (msg.command && msg.command == "reload") {
+            if (msg.command && msg.command == "reload" && shouldReload(msg) && !hotSwap(msg)) {
                 // first we save our scroll position
                 saveWindowScrollPosition();
                 // then we do a hard reload
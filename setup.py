@@ -33,6 +33,10 @@ setup(
     author_email="connect@thanethomson.com",
     url="https://github.com/thanethomson/httpwatcher",
     install_requires=[r.strip() for r in read_file('requirements.txt') if len(r.strip()) > 0],
+    extras_require={
+        'brotli': ['brotli'],
+        'xxhash': ['xxhash'],
+    },
     entry_points={
         'console_scripts': [
             'httpwatcher = httpwatcher.cmdline:main',
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import errno
+import os.path
+import logging
+import unittest
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+from tornado.testing import ExpectLog
+
+from httpwatcher import WatcherBackend, merge_watch_paths, is_network_mount, BACKEND_NATIVE, BACKEND_POLLING, \
+    BACKEND_HYBRID
+from .utils import *
+
+
+class WatchLimitObserver(Observer):
+
+    def schedule(self, event_handler, path, recursive=False):
+        raise OSError(errno.ENOSPC, "inotify watch limit reached")
+
+
+class TestWatcherBackends(unittest.TestCase):
+
+    def test_merge_watch_paths(self):
+        site = os.path.join(os.sep, "site")
+        paths = [site, os.path.join(site, "css"), os.path.join(os.sep, "site2"), site + os.sep, site + "-src"]
+        self.assertEqual(
+            [site, os.path.join(os.sep, "site2"), site + "-src"],
+            merge_watch_paths(paths)
+        )
+        self.assertEqual(
+            [site, os.path.join(site, "css"), os.path.join(os.sep, "site2"), site + "-src"],
+            merge_watch_paths(paths, recursive=False)
+        )
+
+    def test_is_network_mount(self):
+        mounts = [("/", "ext4"), ("/mnt/share", "nfs4"), ("/mnt/share/local", "ext4"), ("/mnt/shared", "ext4")]
+        self.assertFalse(is_network_mount("/home/user/site", mounts))
+        self.assertTrue(is_network_mount("/mnt/share", mounts))
+        self.assertTrue(is_network_mount("/mnt/share/site", mounts))
+        self.assertFalse(is_network_mount("/mnt/share/local/site", mounts))
+        self.assertFalse(is_network_mount("/mnt/shared/site", mounts))
+
+    def test_backend_selection(self):
+        temp_path = init_temp_path()
+        handlers = [(temp_path, FileSystemEventHandler())]
+        for backend, expected_method in [(BACKEND_NATIVE, BACKEND_NATIVE), (BACKEND_POLLING, BACKEND_POLLING),
+                                         (BACKEND_HYBRID, BACKEND_NATIVE)]:
+            watcher_backend = WatcherBackend(backend=backend, poll_interval=0.1)
+            watcher_backend.start(handlers)
+            self.assertEqual({temp_path: expected_method}, watcher_backend.methods)
+            watcher_backend.stop()
+
+        with self.assertRaises(ValueError):
+            WatcherBackend(backend="magic")
+
+    def test_watch_limit_fallback(self):
+        temp_path = init_temp_path()
+        watcher_backend = WatcherBackend(poll_interval=0.1)
+        watcher_backend.native_observer_class = WatchLimitObserver
+        with ExpectLog(logging.getLogger("httpwatcher.backends"), "Unable to watch .* natively"):
+            watcher_backend.start([(temp_path, FileSystemEventHandler())])
+        self.assertEqual({temp_path: BACKEND_POLLING}, watcher_backend.methods)
+        watcher_backend.stop()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import logging
+import os
+import os.path
+import sys
+import time
+
+from tornado.testing import AsyncTestCase, ExpectLog, gen_test
+from tornado import gen
+from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileMovedEvent, FileDeletedEvent
+
+from httpwatcher import BuildRule, BuildPipeline, ChangeSet, parse_build_rules, load_build_config
+from .utils import *
+
+# appends the paths passed to it, one per line, to build.log
+LOG_PATHS_SCRIPT = "import sys; f = open('build.log', 'a'); f.write(''.join(p + '\\n' for p in sys.argv[1:]))"
+
+
+class TestBuildRules(AsyncTestCase):
+
+    def setUp(self):
+        super(TestBuildRules, self).setUp()
+        self.temp_path = init_temp_path()
+
+    def path(self, *parts):
+        return os.path.join(self.temp_path, *parts)
+
+    def read_log(self):
+        with open(self.path("build.log"), "rt") as f:
+            return [line for line in f.read().split("\n") if line]
+
+    def test_matching(self):
+        rule = BuildRule(["*.scss", "!_*.scss", "docs/**/*.rst"], "make", cwd=self.temp_path)
+        self.assertTrue(rule.matches(self.path("style.scss")))
+        self.assertTrue(rule.matches(self.path("css", "style.scss")))
+        self.assertFalse(rule.matches(self.path("_partial.scss")))
+        self.assertTrue(rule.matches(self.path("docs", "api", "index.rst")))
+        self.assertFalse(rule.matches(self.path("index.rst")))
+        # paths outside of the rule's working folder never match
+        self.assertFalse(rule.matches(os.path.join(os.path.dirname(self.temp_path), "style.scss")))
+
+        pipeline = BuildPipeline([rule])
+        matches = pipeline.match(ChangeSet([
+            FileModifiedEvent(self.path("style.scss")),
+            FileCreatedEvent(self.path("docs", "index.rst")),
+            FileMovedEvent(self.path("a.txt"), self.path("b.scss")),
+            FileDeletedEvent(self.path("old.scss")),
+            FileModifiedEvent(self.path("index.html"))
+        ]))
+        self.assertEqual(
+            {rule: {self.path("style.scss"), self.path("docs", "index.rst"), self.path("b.scss")}},
+            matches
+        )
+
+    def test_commands(self):
+        paths = ["/src/b c.scss", "/src/a.scss"]
+        self.assertEqual(["sass '/src/b c.scss'"], BuildRule("*", "sass {path}").get_commands(paths[:1]))
+        self.assertEqual(["lint /src/a.scss '/src/b c.scss'"], BuildRule("*", "lint {paths}").get_commands(paths))
+        self.assertEqual(["make"], BuildRule("*", "make").get_commands(paths))
+        self.assertEqual(
+            [["sass", "/src/a.scss"], ["sass", "/src/b c.scss"]],
+            BuildRule("*", ["sass", "{path}"]).get_commands(paths)
+        )
+        self.assertEqual(
+            [["lint", "-q", "/src/a.scss", "/src/b c.scss"]],
+            BuildRule("*", ["lint", "-q", "{paths}"]).get_commands(paths)
+        )
+
+    def test_parse_build_rules(self):
+        rules = parse_build_rules(["*.scss = sass style.scss style.css", "*.ts=tsc"], cwd=self.temp_path)
+        self.assertEqual(2, len(rules))
+        self.assertEqual(["*.scss"], rules[0].patterns)
+        self.assertEqual("sass style.scss style.css", rules[0].command)
+        self.assertEqual(self.temp_path, rules[1].cwd)
+        for invalid in ["*.scss", "=make", "*.scss="]:
+            with self.assertRaises(ValueError):
+                parse_build_rules([invalid])
+
+    def test_load_build_config(self):
+        write_file(self.temp_path, "httpwatcher.json", "%s" % json.dumps({
+            "concurrency": 3,
+            "rules": [
+                {"name": "styles", "patterns": ["*.scss"], "command": "sass {path}", "debounce": 0.1},
+                {"pattern": "*.rst", "command": ["sphinx-build", "docs", "_build"], "cwd": "docs", "timeout": 60}
+            ]
+        }))
+        rules, concurrency = load_build_config(self.path("httpwatcher.json"))
+        self.assertEqual(3, concurrency)
+        self.assertEqual("styles", rules[0].name)
+        self.assertEqual(0.1, rules[0].debounce)
+        self.assertEqual(self.temp_path, rules[0].cwd)
+        self.assertEqual(["*.rst"], rules[1].patterns)
+        self.assertEqual(self.path("docs"), rules[1].cwd)
+        self.assertEqual(60.0, rules[1].timeout)
+
+        write_file(self.temp_path, "invalid.json", "%s" % json.dumps({"rules": [{"patterns": ["*.scss"]}]}))
+        with self.assertRaises(ValueError):
+            load_build_config(self.path("invalid.json"))
+
+    @gen_test
+    def test_pipeline(self):
+        rule = BuildRule("*.scss", [sys.executable, "-c", LOG_PATHS_SCRIPT, "{paths}"], cwd=self.temp_path)
+        pipeline = BuildPipeline([rule])
+
+        result = yield pipeline.run([FileModifiedEvent(self.path("index.html"))])
+        self.assertTrue(result)
+        self.assertEqual(set(), result.paths)
+        self.assertFalse(os.path.exists(self.path("build.log")))
+
+        result = yield pipeline.run([FileModifiedEvent(self.path("a.scss")), FileCreatedEvent(self.path("b.scss"))])
+        self.assertTrue(result)
+        self.assertEqual({self.path("a.scss"), self.path("b.scss")}, result.paths)
+        self.assertEqual([self.path("a.scss"), self.path("b.scss")], self.read_log())
+
+    @gen_test
+    def test_coalescing(self):
+        rule = BuildRule(
+            "*.scss",
+            [sys.executable, "-c", "import time; time.sleep(0.3); " + LOG_PATHS_SCRIPT, "{paths}"],
+            cwd=self.temp_path
+        )
+        pipeline = BuildPipeline([rule])
+
+        first = pipeline.run([FileModifiedEvent(self.path("a.scss"))])
+        yield gen.sleep(0.1)
+        # these arrive while the first build is running, and are built together by a single subsequent run
+        second = pipeline.run([FileModifiedEvent(self.path("b.scss"))])
+        third = pipeline.run([FileModifiedEvent(self.path("c.scss"))])
+        results = yield [first, second, third]
+        self.assertTrue(all(results))
+        self.assertEqual([self.path("a.scss"), self.path("b.scss"), self.path("c.scss")], self.read_log())
+
+    @gen_test
+    def test_debouncing(self):
+        rule = BuildRule("*.scss", [sys.executable, "-c", LOG_PATHS_SCRIPT, "{paths}"], cwd=self.temp_path,
+                         debounce=0.2)
+        pipeline = BuildPipeline([rule])
+
+        started = time.time()
+        first = pipeline.run([FileModifiedEvent(self.path("a.scss"))])
+        yield gen.sleep(0.1)
+        second = pipeline.run([FileModifiedEvent(self.path("b.scss"))])
+        yield [first, second]
+        self.assertGreaterEqual(time.time() - started, 0.3)
+        # both changes were built by a single run
+        self.assertEqual([self.path("a.scss"), self.path("b.scss")], self.read_log())
+
+    @gen_test
+    def test_failures(self):
+        pipeline = BuildPipeline([
+            BuildRule("*.scss", [sys.executable, "-c", "import sys; sys.exit(1)"], cwd=self.temp_path),
+            BuildRule("*.ts", [sys.executable, "-c", "import time; time.sleep(5)"], cwd=self.temp_path, timeout=0.2),
+            BuildRule("*.md", [self.path("missing-command")], cwd=self.temp_path)
+        ])
+        for filename, expected_log in [("style.scss", "Build command .* failed with exit code 1"),
+                                       ("app.ts", "Build command .* timed out"),
+                                       ("README.md", "Unable to run build command")]:
+            with ExpectLog(logging.getLogger("httpwatcher.builds"), expected_log):
+                result = yield pipeline.run([FileModifiedEvent(self.path(filename))])
+            self.assertFalse(result)
+            self.assertEqual({self.path(filename)}, result.paths)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os.path
+import unittest
+
+from httpwatcher import ContentCache, PathCache
+
+
+class TestContentCache(unittest.TestCase):
+
+    def test_lru_eviction_by_size(self):
+        cache = ContentCache(max_size=10, max_entry_size=10)
+        self.assertTrue(cache.put("/a", b"aaaa"))
+        self.assertTrue(cache.put("/b", b"bbbb"))
+        # touch /a so that /b becomes the least recently used entry
+        self.assertEqual(b"aaaa", cache.get("/a"))
+        self.assertTrue(cache.put("/c", b"cccc"))
+
+        self.assertEqual(b"aaaa", cache.get("/a"))
+        self.assertIsNone(cache.get("/b"))
+        self.assertEqual(b"cccc", cache.get("/c"))
+        self.assertEqual(8, cache.size)
+
+        # too large to cache
+        self.assertFalse(cache.put("/d", b"d" * 11))
+        self.assertIsNone(cache.get("/d"))
+
+    def test_signature_mismatch(self):
+        cache = ContentCache()
+        cache.put("/a", b"old", signature=(3, 1.0))
+        self.assertEqual(b"old", cache.get("/a", signature=(3, 1.0)))
+        self.assertIsNone(cache.get("/a", signature=(3, 2.0)))
+        self.assertEqual(0, cache.size)
+
+    def test_invalidation(self):
+        cache = ContentCache()
+        folder = os.path.join(os.sep, "site", "folder")
+        cache.put(os.path.join(folder, "index.html"), b"<html></html>", variant="html")
+        cache.put(os.path.join(folder, "index.html"), b"<html></html>")
+        cache.put(os.path.join(folder, "sub", "style.css"), b"body {}")
+        cache.put(os.path.join(os.sep, "site", "folder2", "style.css"), b"body {}")
+
+        self.assertEqual(2, cache.invalidate(os.path.join(folder, "index.html")))
+        self.assertIsNone(cache.get(os.path.join(folder, "index.html"), variant="html"))
+        self.assertEqual(1, cache.invalidate(folder, recursive=True))
+        self.assertEqual(1, len(cache))
+        self.assertEqual(7, cache.size)
+
+
+class TestPathCache(unittest.TestCase):
+
+    def test_lookups(self):
+        cache = PathCache(max_entries=2)
+        self.assertIs(PathCache.MISS, cache.get("a"))
+        cache.put("a", None, [os.path.join(os.sep, "site", "a")])
+        self.assertIsNone(cache.get("a"))
+        cache.put("b", 2, [])
+        cache.put("c", 3, [])
+        # "a" was the least recently used entry
+        self.assertIs(PathCache.MISS, cache.get("a"))
+        self.assertEqual(2, len(cache))
+
+    def test_invalidation(self):
+        cache = PathCache()
+        site = os.path.join(os.sep, "site")
+        cache.put("folder/", "index", [os.path.join(site, "folder"), os.path.join(site, "folder", "index.html")])
+        cache.put("folder/style.css", "style", [os.path.join(site, "folder", "style.css")])
+        cache.put("other.css", "other", [os.path.join(site, "other.css")])
+
+        # a new file in a folder affects the folder's resolution
+        self.assertEqual(1, cache.invalidate(os.path.join(site, "folder", "index.htm")))
+        self.assertIs(PathCache.MISS, cache.get("folder/"))
+        self.assertEqual("style", cache.get("folder/style.css"))
+
+        self.assertEqual(1, cache.invalidate(os.path.join(site, "folder"), recursive=True))
+        self.assertEqual(["other.css"], list(cache.entries.keys()))
+
+    def test_generations(self):
+        cache = PathCache()
+        path = os.path.join(os.sep, "site", "style.css")
+        generation = cache.generation
+        cache.put("style.css", "old", [path], generation=generation)
+        self.assertEqual("old", cache.get("style.css"))
+
+        # a lookup that was under way while the file changed doesn't get cached
+        generation = cache.generation
+        cache.invalidate(path)
+        cache.put("style.css", "outdated", [path], generation=generation)
+        self.assertIs(PathCache.MISS, cache.get("style.css"))
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os.path
+import unittest
+
+from httpwatcher import PathFilter
+from .utils import *
+
+
+class TestPathFilter(unittest.TestCase):
+
+    root = os.path.join(os.sep, "project")
+
+    def is_excluded(self, path_filter, path, is_directory=False):
+        return path_filter.is_excluded(os.path.join(self.root, *path.split("/")), is_directory)
+
+    def test_default_exclusions(self):
+        path_filter = PathFilter(self.root)
+        self.assertTrue(self.is_excluded(path_filter, ".git", is_directory=True))
+        self.assertTrue(self.is_excluded(path_filter, ".git/objects/ab/cdef"))
+        self.assertTrue(self.is_excluded(path_filter, "site/node_modules/lib/index.js"))
+        self.assertTrue(self.is_excluded(path_filter, "src/__pycache__/module.cpython-36.pyc"))
+        self.assertTrue(self.is_excluded(path_filter, "site/.index.html.swp"))
+        self.assertTrue(self.is_excluded(path_filter, "site/index.html~"))
+        self.assertFalse(self.is_excluded(path_filter, "site/index.html"))
+        self.assertFalse(self.is_excluded(path_filter, "site/git/index.html"))
+        # the root itself is never excluded
+        self.assertFalse(path_filter.is_excluded(self.root, True))
+
+    def test_patterns(self):
+        path_filter = PathFilter(
+            self.root,
+            exclude=["/build/", "docs/*.tmp", "**/cache/**", "!node_modules/", "drafts", "*.log", "!keep.log"]
+        )
+        # anchored to the root
+        self.assertTrue(self.is_excluded(path_filter, "build", is_directory=True))
+        self.assertTrue(self.is_excluded(path_filter, "build/index.html"))
+        self.assertFalse(self.is_excluded(path_filter, "site/build/index.html"))
+        # a trailing slash only matches folders
+        self.assertFalse(self.is_excluded(path_filter, "build"))
+        self.assertTrue(self.is_excluded(path_filter, "docs/page.tmp"))
+        self.assertFalse(self.is_excluded(path_filter, "docs/sub/page.tmp"))
+        self.assertTrue(self.is_excluded(path_filter, "a/b/cache/c/d.css"))
+        # re-included
+        self.assertFalse(self.is_excluded(path_filter, "node_modules/lib/index.js"))
+        self.assertTrue(self.is_excluded(path_filter, "site/drafts/post.html"))
+        self.assertTrue(self.is_excluded(path_filter, "logs/server.log"))
+        self.assertFalse(self.is_excluded(path_filter, "logs/keep.log"))
+
+    def test_include_patterns(self):
+        path_filter = PathFilter(self.root, include=["*.html", "css/*.css"])
+        self.assertFalse(self.is_excluded(path_filter, "site/index.html"))
+        self.assertFalse(self.is_excluded(path_filter, "css/style.css"))
+        self.assertTrue(self.is_excluded(path_filter, "site/css/style.css"))
+        self.assertTrue(self.is_excluded(path_filter, "README.md"))
+        # folders aren't subject to include patterns
+        self.assertFalse(self.is_excluded(path_filter, "site", is_directory=True))
+        self.assertTrue(self.is_excluded(path_filter, ".git/index.html"))
+
+    def test_gitignore(self):
+        temp_path = init_temp_path()
+        write_file(temp_path, ".gitignore", "# build output\n_site/\n*.bak\n\n!important.bak\n")
+        path_filter = PathFilter(temp_path, gitignore=True)
+        self.assertTrue(path_filter.is_excluded(os.path.join(temp_path, "_site", "index.html")))
+        self.assertTrue(path_filter.is_excluded(os.path.join(temp_path, "page.bak")))
+        self.assertFalse(path_filter.is_excluded(os.path.join(temp_path, "important.bak")))
+        self.assertFalse(path_filter.is_excluded(os.path.join(temp_path, "index.html")))
+        self.assertFalse(PathFilter(temp_path).is_excluded(os.path.join(temp_path, "page.bak")))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import os.path
+
+from tornado.testing import AsyncTestCase, gen_test
+from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileMovedEvent, FileDeletedEvent
+
+from httpwatcher import ChangeVerifier, ChangeSet, PathFilter
+from .utils import *
+
+
+class TestChangeVerifier(AsyncTestCase):
+
+    def setUp(self):
+        super(TestChangeVerifier, self).setUp()
+        self.temp_path = init_temp_path()
+        write_file(self.temp_path, "index.html", "<html><body>Hello world!</body></html>")
+        write_file(self.temp_path, "style.css", "body { color: black; }")
+        write_file(os.path.join(self.temp_path, "node_modules", "lib"), "index.js", "module.exports = {};")
+
+    def path(self, filename):
+        return os.path.join(self.temp_path, filename)
+
+    def touch(self, filename):
+        st = os.stat(self.path(filename))
+        os.utime(self.path(filename), (st.st_atime + 10, st.st_mtime + 10))
+
+    @gen_test
+    def test_verification(self):
+        verifier = ChangeVerifier(max_workers=2)
+        yield verifier.scan(self.temp_path, path_filter=PathFilter(self.temp_path))
+        self.assertEqual(
+            sorted([self.path("index.html"), self.path("style.css")]),
+            sorted(verifier.fingerprints.keys())
+        )
+
+        # touched, and rewritten with identical contents
+        self.touch("index.html")
+        write_file(self.temp_path, "style.css", "body { color: black; }")
+        changes = yield verifier.verify(ChangeSet([
+            FileModifiedEvent(self.path("index.html")),
+            FileModifiedEvent(self.path("style.css"))
+        ]))
+        self.assertEqual(0, len(changes))
+        self.assertEqual(2, verifier.suppressed)
+
+        # a real change, and a new file (which can't be verified)
+        write_file(self.temp_path, "style.css", "body { color: white; }")
+        write_file(self.temp_path, "new.css", "body { color: white; }")
+        changes = yield verifier.verify(ChangeSet([
+            FileModifiedEvent(self.path("style.css")),
+            FileCreatedEvent(self.path("new.css"))
+        ]))
+        self.assertEqual([self.path("style.css"), self.path("new.css")], [e.src_path for e in changes])
+
+        # fingerprints follow moves, and are forgotten on deletion
+        os.rename(self.path("new.css"), self.path("moved.css"))
+        os.remove(self.path("style.css"))
+        changes = yield verifier.verify(ChangeSet([
+            FileMovedEvent(self.path("new.css"), self.path("moved.css")),
+            FileDeletedEvent(self.path("style.css"))
+        ]))
+        self.assertEqual(2, len(changes))
+        self.assertEqual(
+            sorted([self.path("index.html"), self.path("moved.css")]),
+            sorted(verifier.fingerprints.keys())
+        )
+        self.touch("moved.css")
+        changes = yield verifier.verify(ChangeSet([FileModifiedEvent(self.path("moved.css"))]))
+        self.assertEqual(0, len(changes))
+
+    @gen_test
+    def test_large_files(self):
+        verifier = ChangeVerifier(max_file_size=8)
+        yield verifier.scan(self.temp_path)
+        self.touch("style.css")
+        changes = yield verifier.verify(ChangeSet([FileModifiedEvent(self.path("style.css"))]))
+        self.assertEqual(1, len(changes))
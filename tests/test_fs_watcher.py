@@ -4,11 +4,15 @@ from __future__ import unicode_literals
 
 import os
 import os.path
+import unittest
 
 from tornado.ioloop import IOLoop
-from tornado.testing import AsyncTestCase
+from tornado.testing import AsyncTestCase, ExpectLog, gen_test
+from tornado import gen
 
-from httpwatcher import FileSystemWatcher
+from httpwatcher import FileSystemWatcher, ChangeSet, BACKEND_POLLING
+from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileDeletedEvent, FileMovedEvent, \
+    DirModifiedEvent
 from .utils import *
 
 import logging
@@ -119,3 +123,268 @@ class TestFileSystemWatcher(AsyncTestCase):
         self.check_for_fs_events()
 
         watcher.shutdown()
+
+    def test_polling_backend(self):
+        watch_paths = [self.temp_path, os.path.join(self.temp_path, "nested")]
+        os.makedirs(watch_paths[1])
+        watcher = FileSystemWatcher(
+            watch_paths,
+            on_changed=lambda events: self.track_change_events(events),
+            interval=WATCHER_INTERVAL,
+            backend="polling",
+            poll_interval=0.05
+        )
+        # the nested watch path is covered by its parent
+        self.assertEqual([self.temp_path], watcher.watch_paths)
+        watcher.start()
+        # the baseline snapshot is taken in the background
+        self.assertTrue(watcher.backend.observers[BACKEND_POLLING].wait_for_baselines(timeout=5.0))
+
+        logger.debug("Creating 1 file in the nested directory")
+        write_file(watch_paths[1], "file1", "Test file 1 contents")
+        self.check_for_fs_events()
+
+        logger.debug("Doing nothing...")
+        self.check_for_fs_events(True)
+
+        watcher.shutdown()
+
+    def test_path_filtering(self):
+        os.makedirs(os.path.join(self.temp_path, ".git"))
+        watcher = FileSystemWatcher(
+            self.temp_path,
+            on_changed=lambda events: self.track_change_events(events),
+            interval=WATCHER_INTERVAL,
+            exclude=["*.log"]
+        )
+        watcher.start()
+
+        logger.debug("Creating ignored files...")
+        write_file(self.temp_path, os.path.join(".git", "HEAD"), "ref: refs/heads/master")
+        write_file(self.temp_path, ".index.html.swp", "Swap file contents")
+        write_file(self.temp_path, "server.log", "Log file contents")
+        self.check_for_fs_events(True)
+
+        logger.debug("Moving an ignored file into place...")
+        os.rename(os.path.join(self.temp_path, ".index.html.swp"), os.path.join(self.temp_path, "index.html"))
+        self.check_for_fs_events()
+
+        watcher.shutdown()
+
+    @gen_test
+    def test_excluded_changes(self):
+        notifications, excluded = [], []
+        watcher = FileSystemWatcher(
+            self.temp_path,
+            on_changed=lambda changes: notifications.append(changes),
+            interval=WATCHER_INTERVAL,
+            exclude=["*.log"],
+            on_excluded=lambda paths: excluded.extend(paths)
+        )
+        watcher.start()
+
+        write_file(self.temp_path, "server.log", "Log file contents")
+        yield gen.sleep(CHECK_DELAY * 2)
+        self.assertEqual([], notifications)
+        self.assertIn((os.path.join(self.temp_path, "server.log"), False), excluded)
+        watcher.shutdown()
+
+    @gen_test
+    def test_touched_paths(self):
+        notifications, touched = [], []
+        watcher = FileSystemWatcher(
+            self.temp_path,
+            on_changed=lambda changes: notifications.append(changes),
+            interval=1.0,
+            exclude=["*.log"],
+            on_touched=lambda paths: touched.extend(paths)
+        )
+        watcher.start()
+
+        write_file(self.temp_path, "README", "This file has changed")
+        write_file(self.temp_path, "server.log", "Log file contents")
+        yield gen.sleep(CHECK_DELAY * 2)
+        # the affected paths (excluded ones included) are passed on while we wait for the changes to settle
+        self.assertEqual([], notifications)
+        self.assertIn((os.path.join(self.temp_path, "README"), False), touched)
+        self.assertIn((os.path.join(self.temp_path, "server.log"), False), touched)
+        watcher.shutdown()
+
+    def test_change_verification(self):
+        watcher = FileSystemWatcher(
+            self.temp_path,
+            on_changed=lambda events: self.track_change_events(events),
+            interval=WATCHER_INTERVAL,
+            verify_changes=True
+        )
+        watcher.start()
+        # wait for the initial scan
+        self.check_for_fs_events(True)
+
+        logger.debug("Rewriting a file with identical contents...")
+        write_file(self.temp_path, "README", "This will be the first and only file in the temporary folder (for now)")
+        self.check_for_fs_events(True)
+
+        logger.debug("Modifying a file...")
+        write_file(self.temp_path, "README", "This file has changed")
+        self.check_for_fs_events()
+
+        watcher.shutdown()
+
+    @gen_test(timeout=10)
+    def test_debouncing(self):
+        notifications = []
+        watcher = FileSystemWatcher(
+            self.temp_path,
+            on_changed=lambda changes: notifications.append(changes),
+            interval=0.3,
+            max_wait=5.0
+        )
+        watcher.start()
+
+        # a burst of changes, each arriving before the quiet period has elapsed, results in a single notification
+        for i in range(5):
+            write_file(self.temp_path, "file%d" % i, "Test file %d contents" % i)
+            yield gen.sleep(0.1)
+        self.assertEqual(0, len(notifications))
+        yield gen.sleep(0.5)
+        self.assertEqual(1, len(notifications))
+        self.assertGreaterEqual(len(notifications[0]), 5)
+
+        # nothing happens while the file system is quiet
+        yield gen.sleep(0.5)
+        self.assertEqual(1, len(notifications))
+        watcher.shutdown()
+
+    @gen_test(timeout=10)
+    def test_max_wait(self):
+        notifications = []
+        watcher = FileSystemWatcher(
+            self.temp_path,
+            on_changed=lambda changes: notifications.append(changes),
+            interval=0.3,
+            max_wait=0.5
+        )
+        watcher.start()
+
+        # changes that never settle still result in notifications at least every max_wait seconds
+        for i in range(15):
+            write_file(self.temp_path, "file%d" % i, "Test file %d contents" % i)
+            yield gen.sleep(0.1)
+        self.assertGreaterEqual(len(notifications), 2)
+        watcher.shutdown()
+
+    @gen_test
+    def test_event_overflow(self):
+        notifications = []
+        watcher = FileSystemWatcher(
+            self.temp_path,
+            on_changed=lambda changes: notifications.append(changes),
+            interval=0.2,
+            max_pending_events=10
+        )
+        watcher.start()
+
+        # too many events are collapsed into a single notification that anything may have changed
+        with ExpectLog(logging.getLogger("httpwatcher.filesystem"), "More than 10 file system events"):
+            for i in range(20):
+                write_file(self.temp_path, "file%d" % i, "Test file %d contents" % i)
+            yield gen.sleep(0.5)
+        self.assertEqual([None], notifications)
+        self.assertEqual([], watcher.pending_events)
+
+        # ...after which events are tracked as usual again
+        write_file(self.temp_path, "file0", "Changed contents")
+        yield gen.sleep(0.5)
+        self.assertEqual(2, len(notifications))
+        self.assertEqual([os.path.join(self.temp_path, "file0")], notifications[1].paths)
+        watcher.shutdown()
+
+    @gen_test
+    def test_excluded_event_overflow(self):
+        notifications, excluded = [], []
+        watcher = FileSystemWatcher(
+            self.temp_path,
+            on_changed=lambda changes: notifications.append(changes),
+            interval=0.2,
+            exclude=["*.log"],
+            max_pending_events=10,
+            on_excluded=excluded.append
+        )
+        watcher.start()
+
+        # too many changes to excluded paths are reported as such, but don't concern on_changed
+        for i in range(20):
+            write_file(self.temp_path, "file%d.log" % i, "Log file %d contents" % i)
+        yield gen.sleep(0.5)
+        self.assertEqual([], notifications)
+        self.assertEqual([None], excluded)
+        self.assertEqual(0, watcher.overflows)
+
+        write_file(self.temp_path, "file0.log", "Changed contents")
+        yield gen.sleep(0.5)
+        self.assertEqual([None, [(os.path.join(self.temp_path, "file0.log"), False)]], excluded)
+        watcher.shutdown()
+
+
+class TestChangeSet(unittest.TestCase):
+
+    def assertChanges(self, expected, changes):
+        self.assertEqual(
+            expected,
+            [(e.event_type, e.src_path, getattr(e, "dest_path", None)) for e in changes]
+        )
+
+    def test_collapsing(self):
+        changes = ChangeSet([
+            FileCreatedEvent("/site/a"),
+            FileModifiedEvent("/site/a"),
+            FileModifiedEvent("/site/a"),
+            FileDeletedEvent("/site/a"),
+            FileModifiedEvent("/site/b"),
+            FileModifiedEvent("/site/b"),
+            DirModifiedEvent("/site"),
+            FileDeletedEvent("/site/c"),
+            FileCreatedEvent("/site/c"),
+            FileCreatedEvent("/site/d"),
+            FileModifiedEvent("/site/d")
+        ])
+        self.assertEqual(11, changes.raw_event_count)
+        self.assertChanges([
+            ("modified", "/site/b", None),
+            ("modified", "/site", None),
+            ("modified", "/site/c", None),
+            ("created", "/site/d", None)
+        ], changes)
+        self.assertFalse(ChangeSet([FileCreatedEvent("/site/a"), FileDeletedEvent("/site/a")]))
+
+    def test_moves(self):
+        # editors often save by writing a temporary file and moving it over the original
+        self.assertChanges([("created", "/site/a", None)], ChangeSet([
+            FileCreatedEvent("/site/a.tmp"),
+            FileModifiedEvent("/site/a.tmp"),
+            FileMovedEvent("/site/a.tmp", "/site/a")
+        ]))
+        self.assertChanges([("moved", "/site/a", "/site/c")], ChangeSet([
+            FileMovedEvent("/site/a", "/site/b"),
+            FileMovedEvent("/site/b", "/site/c")
+        ]))
+        # intermediate paths are only reported as deleted if they're known to have existed before the batch
+        self.assertChanges([("deleted", "/site/b", None), ("moved", "/site/a", "/site/c")], ChangeSet([
+            FileModifiedEvent("/site/b"),
+            FileMovedEvent("/site/a", "/site/b"),
+            FileMovedEvent("/site/b", "/site/c")
+        ]))
+        self.assertChanges([("deleted", "/site/a", None)], ChangeSet([
+            FileMovedEvent("/site/a", "/site/b"),
+            FileDeletedEvent("/site/b")
+        ]))
+        self.assertChanges([("deleted", "/site/b", None), ("deleted", "/site/a", None)], ChangeSet([
+            FileModifiedEvent("/site/b"),
+            FileMovedEvent("/site/a", "/site/b"),
+            FileDeletedEvent("/site/b")
+        ]))
+        self.assertChanges([("moved", "/site/a", "/site/b"), ("modified", "/site/a", None)], ChangeSet([
+            FileMovedEvent("/site/a", "/site/b"),
+            FileCreatedEvent("/site/a")
+        ]))
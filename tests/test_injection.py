@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import unittest
+from io import BytesIO
+
+from httpwatcher import ScriptInjector
+
+
+class TestScriptInjector(unittest.TestCase):
+
+    def setUp(self):
+        self.injector = ScriptInjector(b"<script></script>")
+
+    def test_injects_before_last_closing_body_tag(self):
+        html = b"<html><body><script>var s = '</body>';</script>Test</BODY ></html>"
+        self.assertEqual(
+            b"<html><body><script>var s = '</body>';</script>Test<script></script></BODY ></html>",
+            self.injector.inject(html)
+        )
+
+    def test_fallbacks(self):
+        self.assertEqual(
+            b"<html>Test<script></script></html>",
+            self.injector.inject(b"<html>Test</html>")
+        )
+        self.assertEqual(b"Test<script></script>", self.injector.inject(b"Test"))
+        self.assertEqual(b"<script></script>", self.injector.inject(b""))
+
+    def test_block_boundaries(self):
+        injector = ScriptInjector(b"<script></script>")
+        injector.BLOCK_SIZE = 4
+        for padding in range(8):
+            html = b"x" * padding + b"<body>Test</body>" + b"y" * 30 + b"</html>"
+            offset = html.index(b"</body>")
+            self.assertEqual(offset, injector.find_offset(html))
+            self.assertEqual(offset, injector.find_offset_in_file(BytesIO(html), len(html)))
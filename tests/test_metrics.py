@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import unittest
+
+from httpwatcher import Histogram
+from httpwatcher.metrics import format_value, format_labels
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        hist = Histogram([1.0, 0.1, 0.5])
+        for value in [0.05, 0.1, 0.3, 2.0]:
+            hist.observe(value)
+        self.assertEqual(4, hist.count)
+        self.assertAlmostEqual(2.45, hist.sum)
+        # each bucket counts the values less than or equal to its upper bound
+        self.assertEqual([(0.1, 2), (0.5, 3), (1.0, 3), ("+Inf", 4)], hist.cumulative_counts())
+        self.assertEqual({"0.1": 2, "0.5": 3, "1": 3, "+Inf": 4}, hist.to_dict()["buckets"])
+
+    def test_formatting(self):
+        self.assertEqual("1", format_value(1.0))
+        self.assertEqual("0.25", format_value(0.25))
+        self.assertEqual("+Inf", format_value("+Inf"))
+        self.assertEqual("", format_labels({}))
+        self.assertEqual('{code="200",route="static"}', format_labels({"route": "static", "code": "200"}))
+        self.assertEqual('{path="a\\\\b \\"c\\"\\n"}', format_labels({"path": 'a\\b "c"\n'}))
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import unittest
+
+from httpwatcher import ContentTypeMap, parse_content_type_mappings
+
+
+class TestContentTypeMap(unittest.TestCase):
+
+    def test_defaults(self):
+        content_types = ContentTypeMap()
+        self.assertEqual("text/html", content_types.guess("/site/index.html"))
+        self.assertEqual("text/html", content_types.guess("/site/INDEX.HTM"))
+        self.assertEqual("application/wasm", content_types.guess("/site/app.wasm"))
+        self.assertEqual("application/javascript", content_types.guess("/site/module.mjs"))
+        self.assertEqual("image/avif", content_types.guess("/site/image.avif"))
+        self.assertEqual("application/manifest+json", content_types.guess("/site/site.webmanifest"))
+        self.assertEqual("application/gzip", content_types.guess("/site/archive.tar.gz"))
+        self.assertEqual("application/octet-stream", content_types.guess("/site/unknown.extension"))
+        self.assertEqual("application/octet-stream", content_types.guess("/site/README"))
+        self.assertEqual("application/octet-stream", ContentTypeMap(default_content_type="text/plain").guess(
+            "/site/archive.tar.Z"
+        ))
+
+    def test_custom_mappings(self):
+        content_types = ContentTypeMap(parse_content_type_mappings([".scss=text/x-scss", "JS = text/javascript"]))
+        self.assertEqual("text/x-scss", content_types.guess("/site/style.scss"))
+        self.assertEqual("text/javascript", content_types.guess("/site/app.js"))
+        self.assertRaises(ValueError, parse_content_type_mappings, ["scss"])
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from watchdog.events import FileSystemEventHandler
+
+import httpwatcher.polling
+from httpwatcher import Snapshot, SnapshotPollingObserver, PathFilter, take_snapshot, diff_snapshots
+from .utils import *
+
+
+def backdate(*paths):
+    # folders modified within the last couple of seconds are always re-listed, so make them look older
+    for path in paths:
+        t = time.time() - 60
+        os.utime(path, (t, t))
+
+
+def describe(events):
+    return sorted([(e.event_type, e.src_path, getattr(e, "dest_path", None)) for e in events])
+
+
+class EventCollector(FileSystemEventHandler):
+
+    def __init__(self):
+        super(EventCollector, self).__init__()
+        self.events = []
+
+    def on_any_event(self, event):
+        self.events.append(event)
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = init_temp_path()
+        self.snapshot_dir = tempfile.mkdtemp(prefix="httpwatcher-snapshots")
+        self.addCleanup(shutil.rmtree, self.snapshot_dir)
+        write_file(self.temp_path, "index.html", "<html></html>")
+        write_file(os.path.join(self.temp_path, "css"), "style.css", "body {}")
+        write_file(os.path.join(self.temp_path, ".git"), "HEAD", "ref: refs/heads/master")
+        backdate(self.temp_path, os.path.join(self.temp_path, "css"))
+
+    def path(self, *parts):
+        return os.path.join(self.temp_path, *parts)
+
+    def test_snapshot_diffs(self):
+        snapshot = take_snapshot(self.temp_path, path_filter=PathFilter(self.temp_path))
+        self.assertEqual(
+            sorted([self.temp_path, self.path("index.html"), self.path("css"), self.path("css", "style.css")]),
+            sorted(snapshot.paths)
+        )
+        self.assertEqual([], diff_snapshots(snapshot, take_snapshot(self.temp_path, previous=snapshot)))
+
+        write_file(self.temp_path, "index.html", "<html><body></body></html>")
+        os.rename(self.path("css", "style.css"), self.path("css", "main.css"))
+        write_file(self.temp_path, "about.html", "<html></html>")
+        os.remove(self.path(".git", "HEAD"))
+        new_snapshot = take_snapshot(self.temp_path, previous=snapshot, path_filter=PathFilter(self.temp_path))
+        self.assertEqual([
+            ("created", self.path("about.html"), None),
+            ("modified", self.temp_path, None),
+            ("modified", self.path("css"), None),
+            ("modified", self.path("index.html"), None),
+            ("moved", self.path("css", "style.css"), self.path("css", "main.css"))
+        ], describe(diff_snapshots(snapshot, new_snapshot)))
+
+    def test_unchanged_folders_are_not_listed(self):
+        snapshot = take_snapshot(self.temp_path)
+        listed = []
+        list_folder = httpwatcher.polling.list_folder
+
+        def tracking_list_folder(folder):
+            listed.append(folder)
+            return list_folder(folder)
+
+        httpwatcher.polling.list_folder = tracking_list_folder
+        try:
+            # only the contents of the files are modified, which doesn't change their folders' listings
+            write_file(self.path("css"), "style.css", "body { color: black; }")
+            new_snapshot = take_snapshot(self.temp_path, previous=snapshot)
+            self.assertEqual(
+                [("modified", self.path("css", "style.css"), None)],
+                describe(diff_snapshots(snapshot, new_snapshot))
+            )
+            # .git was modified within the last couple of seconds, so it can't be trusted yet
+            self.assertEqual([self.path(".git")], listed)
+        finally:
+            httpwatcher.polling.list_folder = list_folder
+
+    def test_persistence(self):
+        snapshot_dir = self.snapshot_dir
+        snapshot = take_snapshot(self.temp_path)
+        snapshot.save(os.path.join(snapshot_dir, "snapshot.json"))
+        loaded = Snapshot.load(os.path.join(snapshot_dir, "snapshot.json"), self.temp_path)
+        self.assertEqual(snapshot.paths, loaded.paths)
+        self.assertEqual(list(snapshot.mtimes), list(loaded.mtimes))
+        self.assertEqual(sorted(snapshot.children[self.temp_path]), sorted(loaded.children[self.temp_path]))
+        self.assertEqual([], diff_snapshots(loaded, take_snapshot(self.temp_path, previous=loaded)))
+        # snapshots of other folders aren't used
+        self.assertIsNone(Snapshot.load(os.path.join(snapshot_dir, "snapshot.json"), self.path("css")))
+
+    def test_polling_observer(self):
+        snapshot_dir = self.snapshot_dir
+
+        def poll(changes=None):
+            handler = EventCollector()
+            observer = SnapshotPollingObserver(timeout=0.05, snapshot_dir=snapshot_dir)
+            observer.start()
+            observer.schedule(handler, self.temp_path, recursive=True)
+            self.assertTrue(observer.wait_for_baselines(timeout=5.0))
+            time.sleep(0.2)
+            if changes is not None:
+                changes()
+                time.sleep(0.2)
+            observer.stop()
+            observer.join()
+            return handler.events
+
+        self.assertEqual([], poll())
+        self.assertEqual(1, len(os.listdir(snapshot_dir)))
+        self.assertIn(
+            ("created", self.path("about.html"), None),
+            describe(poll(lambda: write_file(self.temp_path, "about.html", "<html></html>")))
+        )
+        # changes made while we weren't polling are picked up from the persisted snapshot
+        write_file(self.temp_path, "contact.html", "<html></html>")
+        self.assertIn(("created", self.path("contact.html"), None), describe(poll()))
@@ -4,20 +4,48 @@ from __future__ import unicode_literals
 
 import os
 import os.path
+from io import BytesIO
 
-from tornado.testing import AsyncTestCase
+from tornado.testing import AsyncTestCase, ExpectLog, gen_test
+from tornado import gen
 from tornado.httpclient import AsyncHTTPClient
-from tornado.websocket import websocket_connect
+from tornado.websocket import websocket_connect, WebSocketClosedError
 from tornado.ioloop import IOLoop
 from tornado.queues import Queue
 import html5lib
 
-from httpwatcher import HttpWatcherServer
+from httpwatcher import HttpWatcherServer, BuildRule, ChangeSet, BACKEND_POLLING
+from httpwatcher import server
+from httpwatcher.server import HttpWatcherStaticFileHandler
+from watchdog.events import FileModifiedEvent, FileMovedEvent, DirMovedEvent, DirModifiedEvent
 
 from .utils import *
 
+import contextlib
+import datetime
+import errno
+import gzip
 import json
 import logging
+import sys
+import threading
+import time
+import unittest
+
+# copies the given file to style.css
+COPY_TO_CSS_SCRIPT = "import shutil, sys; shutil.copyfile(sys.argv[1], 'style.css')"
+# ...and keeps running for a while afterwards
+SLOW_COPY_TO_CSS_SCRIPT = COPY_TO_CSS_SCRIPT + "; import time; time.sleep(0.8)"
+
+
+@contextlib.contextmanager
+def mock_attribute(obj, name, value):
+    original = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, original)
 
 
 class TestHttpWatcherServer(AsyncTestCase):
@@ -65,6 +93,16 @@ class TestHttpWatcherServer(AsyncTestCase):
         )
         self.reload_tracker_queue = Queue()
 
+    def connect_websocket(self):
+        websocket_connect("ws://localhost:5555/httpwatcher").add_done_callback(
+            lambda future: self.stop(future.result())
+        )
+        return self.wait()
+
+    def wait_for_reload(self, websocket_client):
+        websocket_client.read_message(lambda future: self.stop(future.result()))
+        return json.loads(self.wait(timeout=5.0))
+
     def test_watching(self):
         self.watcher_server = HttpWatcherServer(
             self.temp_path,
@@ -108,6 +146,890 @@ class TestHttpWatcherServer(AsyncTestCase):
         self.assertGreater(self.reload_tracker_queue.qsize(), 0)
         self.watcher_server.shutdown()
 
+    @gen_test
+    def test_async_reload_callback(self):
+        calls = []
+
+        @gen.coroutine
+        def rebuild(changes):
+            calls.append(changes)
+            yield gen.sleep(0.2)
+            if len(calls) == 1:
+                # meanwhile, more changes arrive
+                self.watcher_server.trigger_reload([FileModifiedEvent(os.path.join(self.temp_path, "b.css"))])
+                self.watcher_server.trigger_reload([FileModifiedEvent(os.path.join(self.temp_path, "c.css"))])
+
+        self.watcher_server = HttpWatcherServer(self.temp_path, on_reload=rebuild, on_reload_changes=True,
+                                                host="localhost", port=5555)
+        self.watcher_server.listen()
+        ws = yield websocket_connect("ws://localhost:5555/httpwatcher")
+
+        yield self.watcher_server.trigger_reload([FileModifiedEvent(os.path.join(self.temp_path, "a.css"))])
+        # the changes that arrived while the callback was running were coalesced into a single, final run (without
+        # those that the first run already dealt with)
+        self.assertEqual(2, len(calls))
+        self.assertEqual(
+            sorted([os.path.join(self.temp_path, name) for name in ["b.css", "c.css"]]),
+            sorted(calls[1].paths)
+        )
+        # ...after which clients are reloaded once, for all of the changes
+        msg = json.loads((yield ws.read_message()))
+        self.assertEqual(["/a.css", "/b.css", "/c.css"], msg["paths"])
+        ws.close()
+        self.watcher_server.shutdown()
+
+    @gen_test
+    def test_reload_callback_arguments(self):
+        calls = []
+
+        def rebuild(force=False):
+            calls.append(force)
+
+        # changes are only passed to the callback if asked for
+        self.watcher_server = HttpWatcherServer(self.temp_path, on_reload=rebuild)
+        self.assertTrue((yield self.watcher_server.run_on_reload(ChangeSet())))
+        self.watcher_server = HttpWatcherServer(self.temp_path, on_reload=rebuild, on_reload_changes=True)
+        changes = ChangeSet([FileModifiedEvent(os.path.join(self.temp_path, "a.css"))])
+        self.assertTrue((yield self.watcher_server.run_on_reload(changes)))
+        self.assertEqual([False, changes], calls)
+
+    @gen_test
+    def test_failing_reload_callbacks(self):
+        @gen.coroutine
+        def slow_rebuild():
+            yield gen.sleep(1.0)
+
+        def failing_rebuild():
+            raise ValueError("Build failed")
+
+        for on_reload, expected_log in [(slow_rebuild, "on_reload callback timed out"),
+                                        (failing_rebuild, "on_reload callback failed")]:
+            self.watcher_server = HttpWatcherServer(
+                self.temp_path,
+                on_reload=on_reload,
+                on_reload_timeout=0.1
+            )
+            with ExpectLog(logging.getLogger("httpwatcher.server"), expected_log):
+                self.assertFalse((yield self.watcher_server.run_on_reload(None)))
+
+    @gen_test
+    def test_blocking_reload_callback(self):
+        threads = []
+
+        def rebuild():
+            threads.append(threading.current_thread())
+            time.sleep(0.2)
+
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            on_reload=rebuild,
+            on_reload_blocking=True,
+            host="localhost",
+            port=5555
+        )
+        self.watcher_server.listen()
+        reload_future = self.watcher_server.trigger_reload([FileModifiedEvent(os.path.join(self.temp_path, "a.css"))])
+        # the server keeps serving requests while the callback runs
+        response = yield AsyncHTTPClient().fetch("http://localhost:5555/")
+        self.assertEqual(200, response.code)
+        self.assertFalse(reload_future.done())
+        yield reload_future
+        self.assertEqual(1, len(threads))
+        self.assertIsNot(threading.current_thread(), threads[0])
+        self.watcher_server.shutdown()
+
+    @gen_test
+    def test_build_rules(self):
+        write_file(self.temp_path, "style.scss", "body { color: black; }")
+        write_file(self.temp_path, "style.css", "body { color: black; }")
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1,
+            build_rules=[
+                BuildRule("*.scss", [sys.executable, "-c", COPY_TO_CSS_SCRIPT, "{path}"], cwd=self.temp_path)
+            ]
+        )
+        self.watcher_server.listen()
+        ws = yield websocket_connect("ws://localhost:5555/httpwatcher")
+
+        write_file(self.temp_path, "style.scss", "body { color: red; }")
+        # clients are reloaded for the build's output, rather than its source
+        msg = json.loads((yield gen.with_timeout(datetime.timedelta(seconds=5), ws.read_message())))
+        self.assertEqual(["/style.css"], msg["paths"])
+        response = yield AsyncHTTPClient().fetch("http://localhost:5555/style.css")
+        self.assertEqual(b"body { color: red; }", response.body)
+
+        # failed builds don't reload clients
+        self.watcher_server.build_pipeline.rules[0].command = [sys.executable, "-c", "import sys; sys.exit(1)"]
+        with ExpectLog(logging.getLogger("httpwatcher.server"), "Build failed"):
+            with ExpectLog(logging.getLogger("httpwatcher.builds"), "Build command .* failed"):
+                yield self.watcher_server.trigger_reload(
+                    [FileModifiedEvent(os.path.join(self.temp_path, "style.scss"))]
+                )
+        ws.close()
+        self.watcher_server.shutdown()
+
+    @gen_test(timeout=10)
+    def test_build_output_during_build(self):
+        write_file(self.temp_path, "style.scss", "body { color: black; }")
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1,
+            build_rules=[
+                BuildRule("*.scss", [sys.executable, "-c", SLOW_COPY_TO_CSS_SCRIPT, "{path}"], cwd=self.temp_path)
+            ]
+        )
+        self.watcher_server.listen()
+        ws = yield websocket_connect("ws://localhost:5555/httpwatcher")
+        runs = []
+        original_run = self.watcher_server.build_pipeline.run
+
+        def run(changes):
+            runs.append(changes)
+            return original_run(changes)
+
+        with mock_attribute(self.watcher_server.build_pipeline, "run", run):
+            write_file(self.temp_path, "style.scss", "body { color: red; }")
+            # the build's output arrives while it's still running, and is reloaded without building again
+            msg = json.loads((yield gen.with_timeout(datetime.timedelta(seconds=5), ws.read_message())))
+            self.assertEqual(["/style.css"], msg["paths"])
+            yield gen.sleep(0.5)
+            self.assertFalse(self.watcher_server.reload_running)
+            self.assertEqual(1, len(runs))
+        ws.close()
+        self.watcher_server.shutdown()
+
+    @gen_test
+    def test_excluded_path_caching(self):
+        write_file(os.path.join(self.temp_path, "node_modules"), "lib.js", "var version = 1;")
+        write_file(self.temp_path, "server.log", "First")
+        self.watcher_server = HttpWatcherServer(self.temp_path, host="localhost", port=5555, watcher_interval=0.1,
+                                                watch_exclude=["*.log"], watcher_max_events=20)
+        self.watcher_server.listen()
+        broadcasts = []
+        self.watcher_server.broadcast_to_clients = broadcasts.append
+        client = AsyncHTTPClient()
+        for url in ["http://localhost:5555/node_modules/lib.js", "http://localhost:5555/server.log"]:
+            yield client.fetch(url)
+
+        # changes to excluded paths don't reload clients, but what's served is still kept up to date
+        write_file(os.path.join(self.temp_path, "node_modules"), "lib.js", "var version = 22;")
+        write_file(self.temp_path, "server.log", "Second")
+        yield gen.sleep(0.5)
+        response = yield client.fetch("http://localhost:5555/node_modules/lib.js")
+        self.assertEqual(b"var version = 22;", response.body)
+        response = yield client.fetch("http://localhost:5555/server.log")
+        self.assertEqual(b"Second", response.body)
+
+        # ...even when too many of them change at once to keep track of
+        for i in range(30):
+            write_file(os.path.join(self.temp_path, "node_modules"), "module%d.js" % i, "var module = %d;" % i)
+        write_file(os.path.join(self.temp_path, "node_modules"), "lib.js", "var version = 333;")
+        yield gen.sleep(0.5)
+        response = yield client.fetch("http://localhost:5555/node_modules/lib.js")
+        self.assertEqual(b"var version = 333;", response.body)
+        self.assertEqual([], broadcasts)
+        self.watcher_server.shutdown()
+
+    @gen_test
+    def test_excluded_path_caching_when_polling(self):
+        write_file(os.path.join(self.temp_path, "node_modules"), "lib.js", "var version = 1;")
+        self.watcher_server = HttpWatcherServer(self.temp_path, host="localhost", port=5555, watcher_interval=0.1,
+                                                watcher_backend="polling", watcher_poll_interval=0.1)
+        self.watcher_server.listen()
+        self.assertTrue(self.watcher_server.watcher.backend.observers[BACKEND_POLLING].wait_for_baselines(5.0))
+        broadcasts = []
+        self.watcher_server.broadcast_to_clients = broadcasts.append
+        client = AsyncHTTPClient()
+        yield client.fetch("http://localhost:5555/node_modules/lib.js")
+
+        # excluded paths are polled too, so that what's served is kept up to date
+        write_file(os.path.join(self.temp_path, "node_modules"), "lib.js", "var version = 22;")
+        yield gen.sleep(0.5)
+        response = yield client.fetch("http://localhost:5555/node_modules/lib.js")
+        self.assertEqual(b"var version = 22;", response.body)
+        self.assertEqual([], broadcasts)
+        self.watcher_server.shutdown()
+
+    @gen_test
+    def test_broadcast(self):
+        class StalledClient(object):
+            closed = False
+
+            def get_write_buffer_size(self):
+                return 2 * 1024 * 1024
+
+            def write_message(self, msg):
+                raise AssertionError("Stalled clients shouldn't be written to")
+
+            def close(self):
+                self.closed = True
+
+        class ClosedClient(object):
+
+            def get_write_buffer_size(self):
+                return 0
+
+            def write_message(self, msg):
+                raise WebSocketClosedError()
+
+        self.watcher_server = HttpWatcherServer(self.temp_path, host="localhost", port=5555)
+        self.watcher_server.listen()
+        ws = yield websocket_connect("ws://localhost:5555/httpwatcher")
+        # wait for the server to register the client
+        while not self.watcher_server.connected_clients:
+            yield gen.sleep(0.01)
+        stalled, closed = StalledClient(), ClosedClient()
+        self.watcher_server.register_client(stalled)
+        self.watcher_server.register_client(closed)
+
+        with ExpectLog(logging.getLogger("httpwatcher.server"), "Disconnecting WebSocket client"):
+            self.watcher_server.broadcast_to_clients({"command": "reload"})
+        self.assertEqual({"command": "reload"}, json.loads((yield ws.read_message())))
+        self.assertTrue(stalled.closed)
+        self.assertEqual(1, len(self.watcher_server.connected_clients))
+        ws.close()
+        self.watcher_server.shutdown()
+
+    @gen_test
+    def test_websocket_heartbeat(self):
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            websocket_ping_interval=0.1,
+            max_clients=1,
+            websocket_compression=True
+        )
+        self.watcher_server.listen()
+        first = yield websocket_connect("ws://localhost:5555/httpwatcher", compression_options={})
+        while not self.watcher_server.connected_clients:
+            yield gen.sleep(0.01)
+        client = list(self.watcher_server.connected_clients)[0]
+        connected_at = client.last_seen
+        # messages are compressed for clients that support it
+        self.assertIsNotNone(client.ws_connection._compressor)
+
+        # clients' responses to pings keep them alive
+        yield gen.sleep(0.3)
+        self.assertGreater(client.last_seen, connected_at)
+
+        # the client we've heard from least recently is disconnected to make way for new ones
+        client.last_seen = connected_at
+        second = yield websocket_connect("ws://localhost:5555/httpwatcher")
+        self.assertIsNone((yield first.read_message()))
+        self.assertEqual(1, len(self.watcher_server.connected_clients))
+        self.assertNotIn(client, self.watcher_server.connected_clients)
+        second.close()
+        self.watcher_server.shutdown()
+
+    def test_content_cache(self):
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+        client.fetch("http://localhost:5555/", self.stop)
+        first_response = self.wait()
+        self.assertEqual(200, first_response.code)
+        self.assertEqual(1, len(self.watcher_server.content_cache))
+
+        # the second request must be served from the cache
+        client.fetch("http://localhost:5555/", self.stop)
+        response = self.wait()
+        self.assertEqual(first_response.body, response.body)
+        self.assertEqual(1, self.watcher_server.content_cache.hits)
+
+        websocket_client = self.connect_websocket()
+        write_file(
+            self.temp_path,
+            "index.html",
+            "<!DOCTYPE html><html><head><title>Changed</title></head><body>Test</body></html>"
+        )
+        self.wait_for_reload(websocket_client)
+        self.assertEqual(0, len(self.watcher_server.content_cache))
+
+        client.fetch("http://localhost:5555/", self.stop)
+        response = self.wait()
+        html = html5lib.parse(response.body)
+        ns = get_html_namespace(html)
+        self.assertEqual("Changed", html_findall(html, ns, "./{ns}head/{ns}title")[0].text.strip())
+        self.watcher_server.shutdown()
+
+    def test_path_cache(self):
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1
+        )
+        self.watcher_server.listen()
+        path_cache = self.watcher_server.path_cache
+        self.assertIsNotNone(path_cache)
+        client = AsyncHTTPClient()
+
+        client.fetch("http://localhost:5555/subfolder/new.html", self.stop)
+        self.assertEqual(404, self.wait().code)
+        client.fetch("http://localhost:5555/subfolder/", self.stop)
+        self.assertEqual(200, self.wait().code)
+        misses = path_cache.misses
+
+        # served purely from the path cache
+        client.fetch("http://localhost:5555/subfolder/", self.stop)
+        self.assertEqual(200, self.wait().code)
+        client.fetch("http://localhost:5555/subfolder/new.html", self.stop)
+        self.assertEqual(404, self.wait().code)
+        self.assertEqual(misses, path_cache.misses)
+
+        websocket_client = self.connect_websocket()
+        write_file(self.subfolder_path, "new.html", "<html><body>New</body></html>")
+        self.wait_for_reload(websocket_client)
+        client.fetch("http://localhost:5555/subfolder/new.html", self.stop)
+        self.assertEqual(200, self.wait().code)
+
+        os.remove(os.path.join(self.subfolder_path, "index.html"))
+        self.wait_for_reload(websocket_client)
+        client.fetch("http://localhost:5555/subfolder/", self.stop)
+        self.assertEqual(404, self.wait().code)
+        self.watcher_server.shutdown()
+
+    def test_deleted_files(self):
+        write_file(self.temp_path, "a.css", "body { color: black; }")
+        write_file(self.temp_path, "large.css", "body { color: black; }\n" * 1000)
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.5,
+            stream_threshold=1024
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+        for url in ["http://localhost:5555/a.css", "http://localhost:5555/large.css"]:
+            client.fetch(url, self.stop)
+            self.assertEqual(200, self.wait().code)
+
+        # cached lookups are evicted as soon as a change is noticed, rather than once the changes have settled
+        os.remove(os.path.join(self.temp_path, "a.css"))
+        self.io_loop.call_later(0.1, self.stop)
+        self.wait()
+        client.fetch("http://localhost:5555/a.css", self.stop)
+        self.assertEqual(404, self.wait().code)
+
+        # files that have gone by the time they're read result in a 404, rather than a truncated response
+        self.watcher_server.watcher.shutdown()
+        os.remove(os.path.join(self.temp_path, "large.css"))
+        client.fetch("http://localhost:5555/large.css", self.stop)
+        self.assertEqual(404, self.wait().code)
+        self.assertEqual(0, self.watcher_server.path_cache.invalidate(os.path.join(self.temp_path, "large.css")))
+        self.watcher_server.shutdown()
+
+    def test_path_cache_requires_watched_root(self):
+        other_path = os.path.join(self.temp_path, "other")
+        os.makedirs(other_path)
+        self.watcher_server = HttpWatcherServer(self.subfolder_path, watch_paths=[other_path])
+        self.assertIsNone(self.watcher_server.path_cache)
+        self.watcher_server = HttpWatcherServer(self.subfolder_path, watch_paths=[self.temp_path])
+        self.assertIsNotNone(self.watcher_server.path_cache)
+        self.watcher_server = HttpWatcherServer(self.subfolder_path, watch_paths=[self.temp_path], recursive=False)
+        self.assertIsNone(self.watcher_server.path_cache)
+        # a single watch path can be given as a string
+        self.watcher_server = HttpWatcherServer(self.subfolder_path, watch_paths=other_path)
+        self.assertIsNone(self.watcher_server.path_cache)
+        self.watcher_server = HttpWatcherServer(self.subfolder_path, watch_paths=self.temp_path)
+        self.assertIsNotNone(self.watcher_server.path_cache)
+
+    def test_streaming_and_ranges(self):
+        contents = "".join(["%08d\n" % i for i in range(20000)])
+        write_file(self.temp_path, "large.txt", contents)
+        contents = contents.encode("utf-8")
+
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1,
+            stream_threshold=1024
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+
+        client.fetch("http://localhost:5555/large.txt", self.stop)
+        response = self.wait()
+        self.assertEqual(200, response.code)
+        self.assertEqual("bytes", response.headers["Accept-Ranges"])
+        self.assertEqual(contents, response.body)
+        # streamed files are never cached
+        self.assertEqual(0, len(self.watcher_server.content_cache))
+
+        client.fetch("http://localhost:5555/large.txt", self.stop, headers={"Range": "bytes=90000-90017"})
+        response = self.wait()
+        self.assertEqual(206, response.code)
+        self.assertEqual("bytes 90000-90017/%d" % len(contents), response.headers["Content-Range"])
+        self.assertEqual(contents[90000:90018], response.body)
+
+        client.fetch("http://localhost:5555/large.txt", self.stop, headers={"Range": "bytes=-9"})
+        response = self.wait()
+        self.assertEqual(206, response.code)
+        self.assertEqual(contents[-9:], response.body)
+
+        client.fetch("http://localhost:5555/large.txt", self.stop, headers={"Range": "bytes=%d-" % len(contents)})
+        response = self.wait()
+        self.assertEqual(416, response.code)
+        self.assertEqual("bytes */%d" % len(contents), response.headers["Content-Range"])
+
+        # ranges of in-memory content
+        client.fetch("http://localhost:5555/", self.stop, headers={"Range": "bytes=0-14"})
+        response = self.wait()
+        self.assertEqual(206, response.code)
+        self.assertEqual(b"<!DOCTYPE html>", response.body)
+        self.watcher_server.shutdown()
+
+    @unittest.skipIf(not hasattr(os, "sendfile"), "os.sendfile not available")
+    def test_sendfile(self):
+        contents = "".join(["%08d\n" % i for i in range(20000)])
+        write_file(self.temp_path, "large.txt", contents)
+        contents = contents.encode("utf-8")
+        calls = []
+        original_send_file_range = server.send_file_range
+
+        def send_file_range(sock_fd, file_fd, offset, count):
+            calls.append((offset, count))
+            if len(calls) > 2:
+                # as if sendfile() isn't supported for the file
+                return 0, OSError(errno.EINVAL, "Invalid argument")
+            return original_send_file_range(sock_fd, file_fd, offset, count)
+
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            stream_threshold=1024
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+        with mock_attribute(server, "send_file_range", send_file_range):
+            client.fetch("http://localhost:5555/large.txt", self.stop)
+            response = self.wait()
+            self.assertEqual(contents, response.body)
+            self.assertEqual([(0, len(contents))], calls)
+
+            client.fetch("http://localhost:5555/large.txt", self.stop, headers={"Range": "bytes=90000-90017"})
+            response = self.wait()
+            self.assertEqual(206, response.code)
+            self.assertEqual(contents[90000:90018], response.body)
+            self.assertEqual((90000, 18), calls[1])
+
+            # falls back to sending the file in chunks
+            client.fetch("http://localhost:5555/large.txt", self.stop)
+            response = self.wait()
+            self.assertEqual(contents, response.body)
+            self.assertEqual(3, len(calls))
+
+            # HTML files have our script injected, so can't be sent as they are
+            client.fetch("http://localhost:5555/", self.stop)
+            self.assertEqual(200, self.wait().code)
+            self.assertEqual(3, len(calls))
+        self.watcher_server.shutdown()
+
+    @unittest.skipIf(not hasattr(os, "sendfile"), "os.sendfile not available")
+    def test_sendfile_with_compress_response(self):
+        contents = "".join(["%08d\n" % i for i in range(20000)])
+        write_file(self.temp_path, "large.css", contents)
+        contents = contents.encode("utf-8")
+        calls = []
+
+        def send_file_range(sock_fd, file_fd, offset, count):
+            calls.append((offset, count))
+            return 0, None
+
+        # Tornado's gzip transform compresses the response's body, so it can't be sent using sendfile()
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            stream_threshold=1024,
+            compress_response=True
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+        with mock_attribute(server, "send_file_range", send_file_range):
+            client.fetch("http://localhost:5555/large.css", self.stop, headers={"Accept-Encoding": "gzip"},
+                         decompress_response=False)
+            response = self.wait()
+            self.assertEqual(200, response.code)
+            self.assertEqual("gzip", response.headers["Content-Encoding"])
+            self.assertEqual(contents, gzip.GzipFile(fileobj=BytesIO(response.body)).read())
+            self.assertEqual([], calls)
+        self.watcher_server.shutdown()
+
+    @gen_test
+    def test_io_executor(self):
+        write_file(self.temp_path, "slow.css", "body { color: black; }")
+        original_load_content_from_disk = HttpWatcherStaticFileHandler.load_content_from_disk
+
+        def load_content_from_disk(handler, abspath):
+            # as if the file were on a very slow disk
+            if abspath.endswith("slow.css"):
+                time.sleep(0.5)
+            return original_load_content_from_disk(handler, abspath)
+
+        self.watcher_server = HttpWatcherServer(self.temp_path, host="localhost", port=5555, io_workers=2)
+        self.watcher_server.listen()
+        with mock_attribute(HttpWatcherStaticFileHandler, "load_content_from_disk", load_content_from_disk):
+            client = AsyncHTTPClient()
+            slow = client.fetch("http://localhost:5555/slow.css")
+            # other requests are served in the meantime
+            response = yield client.fetch("http://localhost:5555/")
+            self.assertEqual(200, response.code)
+            self.assertFalse(slow.done())
+            response = yield slow
+            self.assertEqual(b"body { color: black; }", response.body)
+        self.watcher_server.shutdown()
+
+    @gen_test
+    def test_metrics(self):
+        write_file(self.temp_path, "style.css", "body { color: black; }")
+        self.watcher_server = HttpWatcherServer(self.temp_path, host="localhost", port=5555, watcher_interval=0.1,
+                                                metrics=True)
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+        yield client.fetch("http://localhost:5555/style.css")
+        yield client.fetch("http://localhost:5555/style.css")
+        response = yield client.fetch("http://localhost:5555/missing.css", raise_error=False)
+        self.assertEqual(404, response.code)
+        websocket_client = yield websocket_connect("ws://localhost:5555/httpwatcher")
+        yield gen.sleep(0.2)
+        write_file(self.temp_path, "style.css", "body { color: white; }")
+        yield websocket_client.read_message()
+
+        response = yield client.fetch("http://localhost:5555/httpwatcher/metrics?format=json")
+        self.assertEqual("application/json", response.headers["Content-Type"])
+        metrics = json.loads(response.body.decode("utf-8"))
+        self.assertEqual({"200": 2, "404": 1}, metrics["requests"]["static"]["statuses"])
+        self.assertEqual(2 * len("body { color: black; }"), metrics["requests"]["static"]["bytes_served"])
+        self.assertEqual(3, metrics["requests"]["static"]["duration_seconds"]["count"])
+        self.assertEqual({"101": 1}, metrics["requests"]["websocket"]["statuses"])
+        self.assertGreaterEqual(metrics["watcher"]["raw_events"], metrics["watcher"]["changes"])
+        self.assertEqual(1, metrics["watcher"]["changes"])
+        self.assertEqual(1, metrics["clients"]["connected"])
+        self.assertEqual(1, metrics["broadcasts"]["duration_seconds"]["count"])
+        self.assertEqual(1, metrics["caches"]["content"]["hits"])
+
+        response = yield client.fetch("http://localhost:5555/httpwatcher/metrics")
+        self.assertTrue(response.headers["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.body.decode("utf-8")
+        self.assertIn('httpwatcher_requests_total{code="200",route="static"} 2\n', text)
+        self.assertIn('httpwatcher_requests_total{code="200",route="metrics"} 1\n', text)
+        self.assertIn('httpwatcher_request_duration_seconds_count{route="static"} 3\n', text)
+        self.assertIn("httpwatcher_connected_clients 1\n", text)
+        self.assertIn("# TYPE httpwatcher_fs_event_drain_size histogram\n", text)
+        websocket_client.close()
+        self.watcher_server.shutdown()
+
+        # metrics are opt-in
+        self.watcher_server = HttpWatcherServer(self.temp_path, host="localhost", port=5556)
+        self.watcher_server.listen()
+        self.assertIsNone(self.watcher_server.metrics)
+        response = yield client.fetch("http://localhost:5556/httpwatcher/metrics", raise_error=False)
+        self.assertEqual(404, response.code)
+        self.watcher_server.shutdown()
+
+    def test_streamed_html_injection(self):
+        write_file(
+            self.temp_path,
+            "large.html",
+            "<!DOCTYPE html><html><head><title>Large</title></head><body>%s</body></html>" % ("<p>Test</p>" * 10000)
+        )
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1,
+            stream_threshold=1024
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+
+        client.fetch("http://localhost:5555/large.html", self.stop)
+        response = self.wait()
+        self.assertEqual(200, response.code)
+        self.assertEqual(len(response.body), int(response.headers["Content-Length"]))
+        html = html5lib.parse(response.body)
+        ns = get_html_namespace(html)
+        self.assertEqual(10000, len(html_findall(html, ns, "./{ns}body/{ns}p")))
+        self.assertEqual(2, len(html_findall(html, ns, "./{ns}body/{ns}script")))
+        self.assertTrue(response.body.endswith(b"</script>\n</body></html>"))
+
+        # ranges spanning the injected scripts
+        client.fetch("http://localhost:5555/large.html", self.stop, headers={"Range": "bytes=110000-"})
+        range_response = self.wait()
+        self.assertEqual(206, range_response.code)
+        self.assertEqual(response.body[110000:], range_response.body)
+        self.watcher_server.shutdown()
+
+    def test_conditional_requests(self):
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+
+        client.fetch("http://localhost:5555/", self.stop)
+        response = self.wait()
+        self.assertEqual(200, response.code)
+        self.assertEqual("no-cache", response.headers["Cache-Control"])
+        etag = response.headers["Etag"]
+        last_modified = response.headers["Last-Modified"]
+
+        client.fetch("http://localhost:5555/", self.stop, headers={"If-None-Match": etag})
+        response = self.wait()
+        self.assertEqual(304, response.code)
+        self.assertEqual(etag, response.headers["Etag"])
+
+        client.fetch("http://localhost:5555/", self.stop, headers={"If-Modified-Since": last_modified})
+        response = self.wait()
+        self.assertEqual(304, response.code)
+
+        # If-None-Match takes precedence over If-Modified-Since
+        client.fetch("http://localhost:5555/", self.stop, headers={
+            "If-None-Match": '"something-else"',
+            "If-Modified-Since": last_modified
+        })
+        response = self.wait()
+        self.assertEqual(200, response.code)
+
+        # ranges only apply if the If-Range validator matches
+        client.fetch("http://localhost:5555/", self.stop, headers={"Range": "bytes=0-14", "If-Range": etag})
+        response = self.wait()
+        self.assertEqual(206, response.code)
+        client.fetch("http://localhost:5555/", self.stop, headers={"Range": "bytes=0-14", "If-Range": '"stale"'})
+        response = self.wait()
+        self.assertEqual(200, response.code)
+
+        websocket_client = self.connect_websocket()
+        write_file(
+            self.temp_path,
+            "index.html",
+            "<!DOCTYPE html><html><head><title>Changed</title></head><body>Changed test</body></html>"
+        )
+        self.wait_for_reload(websocket_client)
+        client.fetch("http://localhost:5555/", self.stop, headers={"If-None-Match": etag})
+        response = self.wait()
+        self.assertEqual(200, response.code)
+        self.assertNotEqual(etag, response.headers["Etag"])
+        self.watcher_server.shutdown()
+
+    def test_compression(self):
+        stylesheet = "body { color: black; }\n" * 100
+        write_file(self.temp_path, "style.css", stylesheet)
+        write_file(self.temp_path, "precompressed.css", stylesheet)
+        with gzip.open(os.path.join(self.temp_path, "precompressed.css.gz"), "wb") as f:
+            f.write(b"precompressed")
+        write_file(
+            self.temp_path,
+            "index.html",
+            "<!DOCTYPE html><html><head><title>Hello world</title></head>" +
+            "<body>%s</body></html>" % ("<p>Test</p>" * 100)
+        )
+
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+        gzip_headers = {"Accept-Encoding": "gzip"}
+
+        client.fetch("http://localhost:5555/style.css", self.stop, headers=gzip_headers, decompress_response=False)
+        response = self.wait()
+        self.assertEqual(200, response.code)
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertEqual("Accept-Encoding", response.headers["Vary"])
+        self.assertLess(len(response.body), len(stylesheet))
+        self.assertEqual(stylesheet.encode("utf-8"), gzip.GzipFile(fileobj=BytesIO(response.body)).read())
+        gzip_etag = response.headers["Etag"]
+
+        # compressed variants are cached alongside the uncompressed content
+        self.assertIsNotNone(self.watcher_server.content_cache.get(
+            os.path.join(self.temp_path, "style.css"),
+            variant="raw.gzip"
+        ))
+
+        client.fetch(
+            "http://localhost:5555/style.css",
+            self.stop,
+            headers={"Accept-Encoding": "identity"},
+            decompress_response=False
+        )
+        response = self.wait()
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertNotEqual(gzip_etag, response.headers["Etag"])
+        self.assertEqual(stylesheet.encode("utf-8"), response.body)
+
+        client.fetch("http://localhost:5555/", self.stop, headers=gzip_headers, decompress_response=False)
+        response = self.wait()
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertIn(b"httpwatcher.min.js", gzip.GzipFile(fileobj=BytesIO(response.body)).read())
+
+        client.fetch("http://localhost:5555/precompressed.css", self.stop, headers=gzip_headers)
+        response = self.wait()
+        self.assertEqual(b"precompressed", response.body)
+
+        # stale precompressed siblings are ignored
+        websocket_client = self.connect_websocket()
+        os.utime(os.path.join(self.temp_path, "precompressed.css.gz"), (0, 0))
+        self.wait_for_reload(websocket_client)
+        client.fetch("http://localhost:5555/precompressed.css", self.stop, headers=gzip_headers)
+        response = self.wait()
+        self.assertEqual(stylesheet.encode("utf-8"), response.body)
+        self.watcher_server.shutdown()
+
+    def test_compress_response(self):
+        write_file(self.temp_path, "style.css", "body { color: black; }\n" * 100)
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1,
+            compress_response=True
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+
+        # Tornado's gzip transform adds its own "Vary: Accept-Encoding" header
+        for url in ["http://localhost:5555/style.css", "http://localhost:5555/httpwatcher.min.js"]:
+            client.fetch(url, self.stop, headers={"Accept-Encoding": "gzip"}, decompress_response=False)
+            response = self.wait()
+            self.assertEqual(200, response.code)
+            self.assertEqual("gzip", response.headers["Content-Encoding"])
+            self.assertEqual("Accept-Encoding", response.headers["Vary"])
+        self.watcher_server.shutdown()
+
+    def test_httpwatcher_script_caching(self):
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1
+        )
+        self.watcher_server.listen()
+        client = AsyncHTTPClient()
+        versioned_url = "http://localhost:5555/httpwatcher.min.js?v=%s" % self.watcher_server.httpwatcher_js.version
+
+        client.fetch(versioned_url, self.stop, headers={"Accept-Encoding": "gzip"}, decompress_response=False)
+        response = self.wait()
+        self.assertEqual(200, response.code)
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertEqual("gzip", response.headers["Content-Encoding"])
+        self.assertEqual(self.expected_httpwatcher_js, gzip.GzipFile(fileobj=BytesIO(response.body)).read())
+
+        client.fetch(versioned_url, self.stop, headers={"If-None-Match": response.headers["Etag"]})
+        response = self.wait()
+        self.assertEqual(304, response.code)
+
+        # the unversioned URL must always be revalidated
+        client.fetch("http://localhost:5555/httpwatcher.min.js", self.stop)
+        response = self.wait()
+        self.assertEqual("no-cache", response.headers["Cache-Control"])
+        self.assertEqual(self.expected_httpwatcher_js, response.body)
+        self.watcher_server.shutdown()
+
+    def test_changed_urls(self):
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            watch_paths=[os.path.dirname(self.temp_path)],
+            server_base_path="/blog/"
+        )
+        paths, folders = self.watcher_server.get_changed_urls([
+            FileModifiedEvent(os.path.join(self.temp_path, "style.css")),
+            FileModifiedEvent(os.path.join(self.subfolder_path, "index.html")),
+            FileMovedEvent(
+                os.path.join(self.temp_path, "old.html"),
+                os.path.join(self.subsubfolder_path, "new.html")
+            ),
+            DirMovedEvent(os.path.join(self.temp_path, "images"), os.path.join(self.temp_path, "img")),
+            DirModifiedEvent(self.temp_path)
+        ])
+        self.assertEqual([
+            "/blog/old.html",
+            "/blog/style.css",
+            "/blog/subfolder/",
+            "/blog/subfolder/index.html",
+            "/blog/subfolder/subsubfolder/new.html"
+        ], paths)
+        self.assertEqual(["/blog/images/", "/blog/img/"], folders)
+
+        # changes outside of the static root could affect anything
+        outside_events = [
+            FileModifiedEvent(os.path.join(self.temp_path, "style.css")),
+            FileModifiedEvent(os.path.join(os.path.dirname(self.temp_path), "template.html"))
+        ]
+        self.assertEqual((None, None), self.watcher_server.get_changed_urls(outside_events))
+        self.assertEqual({"command": "reload"}, self.watcher_server.build_reload_message(outside_events))
+
+    def test_reload_message(self):
+        self.watcher_server = HttpWatcherServer(self.temp_path, hot_swap=False)
+        msg = self.watcher_server.build_reload_message([
+            FileModifiedEvent(os.path.join(self.temp_path, "style.css")),
+            FileModifiedEvent(os.path.join(self.temp_path, "logo.png"))
+        ])
+        self.assertEqual({
+            "command": "reload",
+            "paths": ["/logo.png", "/style.css"],
+            "folders": [],
+            "content_types": {"/logo.png": "image/png", "/style.css": "text/css"},
+            "hot_swap": False
+        }, msg)
+
+    def test_custom_content_types(self):
+        write_file(self.temp_path, "style.scss", "body { color: black; }")
+        self.watcher_server = HttpWatcherServer(
+            self.temp_path,
+            host="localhost",
+            port=5555,
+            watcher_interval=0.1,
+            content_types={".scss": "text/x-scss"}
+        )
+        self.watcher_server.listen()
+        AsyncHTTPClient().fetch("http://localhost:5555/style.scss", self.stop)
+        response = self.wait()
+        self.assertEqual("text/x-scss", response.headers["Content-Type"])
+        self.watcher_server.shutdown()
+
+    def test_parse_accept_encoding(self):
+        parse = HttpWatcherStaticFileHandler.parse_accept_encoding
+        self.assertEqual({"gzip", "br"}, parse("gzip, deflate;q=0, br;q=0.5"))
+        self.assertEqual({"gzip", "br", "*"}, parse("*"))
+        self.assertEqual(set(), parse("gzip;q=0"))
+        self.assertEqual(set(), parse(""))
+
+    def test_parse_range_header(self):
+        parse = HttpWatcherStaticFileHandler.parse_range_header
+        self.assertEqual((0, 100), parse("bytes=0-", 100))
+        self.assertEqual((10, 21), parse("bytes=10-20", 100))
+        self.assertEqual((10, 100), parse("bytes=10-200", 100))
+        self.assertEqual((90, 100), parse("bytes=-10", 100))
+        self.assertEqual((0, 100), parse("bytes=-200", 100))
+        self.assertFalse(parse("bytes=100-", 100))
+        self.assertFalse(parse("bytes=-0", 100))
+        self.assertIsNone(parse("bytes=0-10,20-30", 100))
+        self.assertIsNone(parse("items=0-10", 100))
+        self.assertIsNone(parse("bytes=20-10", 100))
+        self.assertIsNone(parse("bytes=abc", 100))
+
     def exec_watch_server_tests(self, base_path):
         _base_path = base_path.strip('/')
         if _base_path:
@@ -123,7 +1045,10 @@ class TestHttpWatcherServer(AsyncTestCase):
 
         script_tags = html_findall(html, ns, "./{ns}body/{ns}script")
         self.assertEqual(2, len(script_tags))
-        self.assertEqual("http://localhost:5555/httpwatcher.min.js", script_tags[0].attrib['src'])
+        self.assertEqual(
+            "http://localhost:5555/httpwatcher.min.js?v=%s" % self.watcher_server.httpwatcher_js.version,
+            script_tags[0].attrib['src']
+        )
         self.assertEqual('httpwatcher("ws://localhost:5555/httpwatcher");', script_tags[1].text.strip())
 
         # if it's a non-standard base path
@@ -200,3 +1125,6 @@ class TestHttpWatcherServer(AsyncTestCase):
         msg = json.loads(self.wait())
         self.assertIn("command", msg)
         self.assertEqual("reload", msg["command"])
+        self.assertIn("%sREADME.txt" % self.watcher_server.server_base_path, msg["paths"])
+        self.assertEqual("text/plain", msg["content_types"]["%sREADME.txt" % self.watcher_server.server_base_path])
+        self.assertTrue(msg["hot_swap"])
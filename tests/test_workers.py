@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import json
+import os
+import os.path
+import signal
+import subprocess
+import sys
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPError
+from tornado.websocket import websocket_connect
+
+from httpwatcher import MasterChannel, WorkerChannel, describe_exit_status
+from .utils import *
+
+# serves the given folder from 2 worker processes
+SERVER_SCRIPT = "import httpwatcher, sys; httpwatcher.watch(sys.argv[1], port=5557, watcher_interval=0.1, " \
+                "open_browser=False, workers=2)"
+
+
+class TestWorkers(AsyncTestCase):
+
+    @gen_test
+    def test_channels(self):
+        read_fd, write_fd = os.pipe()
+        master, worker = MasterChannel({0: write_fd}), WorkerChannel(read_fd)
+        master.start()
+        messages = []
+        receiving = worker.receive(messages.append)
+
+        master.send({"invalidate": [["/tmp/index.html", False]]})
+        master.send({"broadcast": {"command": "reload"}})
+        master.close()
+        # workers stop receiving once the master's end of the pipe has been closed
+        yield receiving
+        self.assertEqual([{"invalidate": [["/tmp/index.html", False]]}, {"broadcast": {"command": "reload"}}], messages)
+
+    @unittest.skipIf(not hasattr(os, "fork"), "fork() is not supported on this platform")
+    @gen_test
+    def test_reaping(self):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(3)
+        os.close(read_fd)
+        master = MasterChannel({pid: write_fd})
+        master.start()
+        for _ in range(50):
+            exited = master.reap()
+            if exited:
+                break
+            yield gen.sleep(0.1)
+        self.assertEqual([pid], [exited_pid for exited_pid, _ in exited])
+        self.assertEqual("exit code 3", describe_exit_status(exited[0][1]))
+        # ...and it's no longer sent messages
+        self.assertEqual(0, len(master))
+        master.send({"broadcast": {"command": "reload"}})
+        master.close()
+
+    @unittest.skipIf(not hasattr(os, "fork"), "fork() is not supported on this platform")
+    @gen_test(timeout=20)
+    def test_multi_process_server(self):
+        temp_path = init_temp_path()
+        write_file(temp_path, "index.html", "<html><body>Hello world!</body></html>")
+        # in its own process group, so that the master and its workers can be terminated together
+        process = subprocess.Popen(
+            [sys.executable, "-c", SERVER_SCRIPT, temp_path],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            preexec_fn=os.setsid
+        )
+        try:
+            # wait for the workers to start serving requests
+            for _ in range(100):
+                try:
+                    response = yield AsyncHTTPClient().fetch("http://localhost:5557/")
+                    break
+                except (HTTPError, IOError, OSError):
+                    yield gen.sleep(0.1)
+            self.assertIn(b"Hello world!", response.body)
+
+            clients = []
+            for _ in range(4):
+                clients.append((yield websocket_connect("ws://localhost:5557/httpwatcher")))
+            yield gen.sleep(0.5)
+            write_file(temp_path, "index.html", "<html><body>Changed!</body></html>")
+
+            # whichever worker each client is connected to, the master's changes reach it
+            for client in clients:
+                msg = json.loads((yield client.read_message()))
+                self.assertEqual("reload", msg["command"])
+                self.assertEqual(["/", "/index.html"], msg["paths"])
+                client.close()
+            # ...and the workers' caches were invalidated
+            response = yield AsyncHTTPClient().fetch("http://localhost:5557/")
+            self.assertIn(b"Changed!", response.body)
+        finally:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+
+    @unittest.skipIf(not os.path.exists("/proc/self/task"), "can't find child processes on this platform")
+    @gen_test(timeout=20)
+    def test_worker_exit(self):
+        temp_path = init_temp_path()
+        write_file(temp_path, "index.html", "<html><body>Hello world!</body></html>")
+        process = subprocess.Popen(
+            [sys.executable, "-c", SERVER_SCRIPT, temp_path],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            preexec_fn=os.setsid
+        )
+        try:
+            for _ in range(100):
+                try:
+                    yield AsyncHTTPClient().fetch("http://localhost:5557/")
+                    break
+                except (HTTPError, IOError, OSError):
+                    yield gen.sleep(0.1)
+            with open("/proc/%d/task/%d/children" % (process.pid, process.pid)) as f:
+                worker_pids = [int(pid) for pid in f.read().split()]
+            self.assertEqual(2, len(worker_pids))
+
+            # when a worker crashes, the master shuts down rather than leaving it a zombie
+            os.kill(worker_pids[0], signal.SIGKILL)
+            for _ in range(100):
+                if process.poll() is not None:
+                    break
+                yield gen.sleep(0.1)
+            self.assertIsNotNone(process.poll())
+        finally:
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGTERM)
+                process.wait()